@@ -15,8 +15,6 @@ from __future__ import unicode_literals
 from mo_dots import wrap
 from mo_logs import strings
 
-from pyLibrary.aws import s3
-
 
 def _key2etl(key):
     """
@@ -25,6 +23,8 @@ def _key2etl(key):
     S3 NAMING CONVENTION: a.b.c WHERE EACH IS A STEP IN THE ETL PROCESS
     HOW TO DEAL WITH a->b AS AGGREGATION?  b:a.c?   b->c is agg: a.c:b
     """
+    from pyLibrary.aws import s3
+
     key = s3.strip_extension(key)
 
     tokens = []
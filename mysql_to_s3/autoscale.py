@@ -0,0 +1,268 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+ADD AND RETIRE EXTRACT WORKERS WHILE THE EXTRACT RUNS
+
+    "extract": {
+        "threads": 2,
+        "autoscale": {"min": 1, "max": 8, "interval": "minute", "memory": 4000000000}
+    }
+
+EVERY interval THE CONTROLLER LOOKS AT THE QUEUE DEPTH, THE TIME THE
+LISTER WAITED FOR ROOM IN THE QUEUE (ITS LEAD OVER THE WORKERS), THE
+FRACTION OF THE TIME THE WORKERS WERE IN A BATCH, THE MEAN BATCH LATENCY,
+AND THE PROCESS RSS. IT ADDS OR RETIRES ONE WORKER AT A TIME:
+
+* memory - RSS IS OVER shrink_at OF memory: RETIRE
+* latency - THE LAST WORKER ADDED MADE THE BATCHES SLOWER BY latency_growth (THE DATABASE IS THE BOTTLENECK): RETIRE, AND DO NOT GROW FOR hold INTERVALS
+* backlog - THE QUEUE IS HALF FULL, OR THE LISTER IS WAITING, AND THE WORKERS ARE BUSY: ADD, IF THERE IS MEMORY FOR ONE MORE
+* idle - THE QUEUE IS EMPTY AND THE WORKERS ARE MOSTLY WAITING (WITH A TRANSACTION OPEN): RETIRE
+
+A RETIRED WORKER FINISHES ITS BATCH, AND CLOSES ITS CONNECTION. THE
+CONTROLLER STOPS ONCE THE LAST WORKER RUNS OUT OF BATCHES, SO A RUN THAT
+REACHES THE END OF THE FACTS CAN EXIT
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+from time import time
+
+from mo_dots import Data, coalesce
+from mo_future import text_type
+from mo_kwargs import override
+from mo_logs import Log
+from mo_threads import Lock, Signal, Thread, Till, THREAD_STOP
+from mo_threads.metrics import METRICS
+from mo_times import Duration
+
+from mysql_to_s3.snowflake_schema import open_database
+
+BUSY = 0.8  # FRACTION OF THE TIME IN A BATCH FOR THE WORKERS TO BE THE BOTTLENECK
+IDLE = 0.5  # FRACTION OF THE TIME IN A BATCH FOR A WORKER TO BE NOT NEEDED
+
+DECISIONS = {
+    (direction, reason): METRICS.counter("mysql_to_s3_autoscale_total", "Workers added or retired by the autoscaler", direction=direction, reason=reason)
+    for direction, reason in [("up", "backlog"), ("down", "memory"), ("down", "latency"), ("down", "idle")]
+}
+RSS_BYTES = METRICS.gauge("mysql_to_s3_rss_bytes", "Resident memory of the process, at the last autoscale decision")
+
+
+class Autoscaler(object):
+
+    @override
+    def __init__(
+        self,
+        extractor,
+        min=1,
+        max=None,
+        interval="minute",
+        memory=None,
+        shrink_at=0.9,
+        latency_growth=1.5,
+        hold=5,
+        kwargs=None
+    ):
+        """
+        :param extractor: THE Extract TO RUN THE WORKERS OF
+        :param min: FEWEST WORKERS
+        :param max: MOST WORKERS (DEFAULT extract.threads)
+        :param interval: TIME BETWEEN DECISIONS
+        :param memory: BYTES OF RSS ALLOWED FOR THE PROCESS (DEFAULT NO LIMIT)
+        :param shrink_at: FRACTION OF memory WHERE WORKERS ARE RETIRED
+        :param latency_growth: SLOWDOWN OF THE BATCHES, AFTER ADDING A WORKER, THAT UNDOES THE ADD
+        :param hold: INTERVALS WITHOUT ADDING A WORKER, AFTER THE latency SLOWDOWN
+        """
+        self.extractor = extractor
+        self.min = min
+        self.max = coalesce(max, extractor.settings.extract.threads)
+        if not 1 <= self.min <= self.max:
+            Log.error("Expecting 1 <= `autoscale.min` <= `autoscale.max`")
+        self.interval = Duration(interval).seconds
+        self.memory = memory
+        self.shrink_at = shrink_at
+        self.latency_growth = latency_growth
+        self.hold = hold
+
+        self.locker = Lock("autoscale")
+        self.workers = []  # retire Signal OF EACH WORKER, OLDEST FIRST
+        self.active = {}  # START TIME OF THE BATCH OF EACH BUSY WORKER
+        self.busy = 0  # WORKER SECONDS SPENT IN BATCHES SINCE tick
+        self.latencies = []  # SECONDS OF EACH BATCH DONE SINCE tick
+        self.tick = time()
+        self.count = 0  # WORKERS STARTED, FOR NAMING
+        self.latency_before_add = None  # MEAN LATENCY BEFORE THE LAST WORKER WAS ADDED
+        self.waiting = 0  # INTERVALS LEFT WITHOUT ADDING A WORKER
+        self.done = Signal("autoscale done")  # THE LAST WORKER HAS NO MORE BATCHES
+        self.controller = None
+        METRICS.gauge("mysql_to_s3_workers", "Extract workers running", function=lambda: len(self.workers))
+
+    def start(self, please_stop):
+        """
+        START extract.threads WORKERS (WITHIN min AND max), AND THE CONTROLLER
+        """
+        threads = self.extractor.settings.extract.threads
+        for _ in range(min(self.max, max(self.min, threads))):
+            self._add(please_stop)
+        self.controller = Thread.run("autoscale", self._control, please_stop=please_stop)
+
+    def _add(self, please_stop):
+        retire = Signal("retire worker")
+        with self.locker:
+            self.workers.append(retire)
+            self.count += 1
+            name = "extract #" + text_type(self.count)
+            self._resize()
+        Thread.run(name, self._work, retire, please_stop=please_stop)
+
+    def _retire(self):
+        with self.locker:
+            # THE NEWEST WORKER IS RETIRED, SO THE OLD NAMES STAY IN THE LOGS
+            retire = self.workers.pop()
+            self._resize()
+        retire.go()
+
+    def _resize(self):
+        # BACKFILL GETS ITS share OF THE WORKERS THERE ARE NOW
+        if self.extractor.backfill:
+            self.extractor.backfill.threads = len(self.workers)
+
+    def _work(self, retire, please_stop):
+        extractor = self.extractor
+        stop = please_stop | retire
+        try:
+            while not stop:
+                try:
+                    with open_database(extractor.settings.snowflake.database) as db:
+                        with db.transaction():
+                            while not stop:
+                                batch = extractor.next_batch(stop)
+                                if batch is THREAD_STOP:
+                                    return
+                                with self.locker:
+                                    self.active[retire] = time()
+                                try:
+                                    done = extractor.work(db, batch, please_stop)
+                                finally:
+                                    now = time()
+                                    with self.locker:
+                                        start = self.active.pop(retire)
+                                        self.busy += now - max(start, self.tick)
+                                        self.latencies.append(now - start)
+                                if not done:
+                                    # THE CONNECTION MAY BE BROKEN, SO OPEN ANOTHER
+                                    break
+                except Exception as e:
+                    Log.warning("Problem with connection", cause=e)
+                    (stop | Till(seconds=extractor.retries.backoff)).wait()
+        finally:
+            with self.locker:
+                if retire in self.workers:
+                    # DONE ON ITS OWN (NO MORE BATCHES)
+                    self.workers.remove(retire)
+                    self._resize()
+                    if not self.workers:
+                        self.done.go()
+
+    def _control(self, please_stop):
+        queue = self.extractor.queue
+        put_wait = queue.put_wait
+        while not please_stop:
+            (Till(seconds=self.interval) | please_stop | self.done).wait()
+            if please_stop or self.done:
+                break
+
+            now = time()
+            with self.locker:
+                workers = len(self.workers)
+                busy = self.busy + sum(now - max(s, self.tick) for s in self.active.values())
+                latencies, self.latencies = self.latencies, []
+                elapsed, self.tick, self.busy = now - self.tick, now, 0
+            stats = Data(
+                workers=workers,
+                depth=len(queue),
+                room=queue.max,
+                lead=min(1, (queue.put_wait - put_wait) / elapsed),
+                utilization=busy / (elapsed * workers) if workers else 0,
+                latency=sum(latencies) / len(latencies) if latencies else None,
+                rss=rss()
+            )
+            put_wait = queue.put_wait
+            if stats.rss is not None:
+                RSS_BYTES.set(stats.rss)
+
+            change, reason = self.decide(stats)
+            if not change:
+                continue
+            if change > 0:
+                self._add(please_stop)
+            else:
+                self._retire()
+            direction = "up" if change > 0 else "down"
+            DECISIONS[(direction, reason)].inc()
+            Log.note(
+                "Autoscale {{direction}} to {{num}} workers ({{reason}}): depth={{depth}}, lead={{lead|percent}}, busy={{utilization|percent}}, latency={{latency|round(places=2)}}, rss={{rss|comma}}",
+                direction=direction,
+                num=len(self.workers),
+                reason=reason,
+                default_params=stats
+            )
+
+    def decide(self, stats):
+        """
+        :param stats: THE workers, depth, room, lead, utilization, latency AND rss OF THE LAST interval
+        :return: (+1, -1 OR 0 WORKERS, REASON)
+        """
+        workers = stats.workers
+        latency_before_add, self.latency_before_add = self.latency_before_add, None
+        self.waiting = max(0, self.waiting - 1)
+
+        if self.memory and stats.rss is not None and stats.rss >= self.memory * self.shrink_at:
+            if workers > self.min:
+                return -1, "memory"
+            return 0, None
+
+        if latency_before_add and stats.latency and stats.latency > latency_before_add * self.latency_growth:
+            self.waiting = self.hold
+            if workers > self.min:
+                return -1, "latency"
+            return 0, None
+
+        backlog = stats.depth * 2 >= stats.room or stats.lead > IDLE
+        if backlog and stats.utilization >= BUSY and workers < self.max and not self.waiting:
+            # EACH WORKER IS ASSUMED TO NEED THE SAME SHARE OF THE RSS
+            if not self.memory or stats.rss is None or stats.rss * (workers + 1) / max(workers, 1) < self.memory * self.shrink_at:
+                self.latency_before_add = stats.latency
+                return 1, "backlog"
+
+        if not stats.depth and stats.utilization < IDLE and workers > self.min:
+            return -1, "idle"
+        return 0, None
+
+
+def rss():
+    """
+    :return: RESIDENT BYTES OF THIS PROCESS (None IF NOT KNOWN)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf(str("SC_PAGE_SIZE"))
+    except Exception:
+        pass
+    try:
+        import resource
+
+        # NOT LINUX; THE PEAK IS THE BEST THERE IS (BYTES ON MAC)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except Exception:
+        return None
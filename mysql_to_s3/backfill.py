@@ -0,0 +1,241 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import math
+
+from mo_dots import coalesce, wrap
+from mo_files import File
+from mo_future import text_type
+from mo_kwargs import override
+from mo_logs import Log, startup, constants
+from mo_threads import Lock, Queue, Till, THREAD_STOP
+from mo_times import Date
+from pyLibrary import convert
+
+
+class Backfill(object):
+    """
+    RANGES OF THE FACT TABLE TO EXTRACT AGAIN, WHILE THE LIVE TAIL CONTINUES
+
+    THE BACKFILL CLI APPENDS REQUESTS TO `file`; THE EXTRACT RECORDS WHICH
+    BATCHES ARE DONE IN `progress`, SO extract.last IS NEVER TOUCHED
+    """
+
+    @override
+    def __init__(self, file, progress=None, share=0.25, threads=1, kwargs=None):
+        """
+        :param file: JSON LINES OF {"id", "start", "end", "priority"} REQUESTS
+        :param progress: FILE WITH THE BATCHES DONE, PER REQUEST (DEFAULT file + ".progress")
+        :param share: FRACTION OF THE WORKERS THAT MAY BACKFILL WHILE THE LIVE TAIL HAS WORK
+        :param threads: NUMBER OF WORKERS
+        """
+        self.file = File(file)
+        self.progress_file = File(coalesce(progress, file + ".progress"))
+        self.share = share
+        self.threads = threads
+        self.locker = Lock("backfill")
+        self.running = 0
+        self.queue = Queue("backfill batches", max=2 * threads, silent=True)
+        try:
+            self.progress = self.progress_file.read_json() if self.progress_file.exists else wrap({})
+        except Exception as e:
+            Log.error("Can not read backfill progress {{filename}}", filename=self.progress_file.abspath, cause=e)
+        for k in self.progress.keys():
+            # BATCHES QUEUED BY A PREVIOUS RUN ARE GONE; LIST THEM AGAIN
+            self.progress[k].listed = None
+
+    def pending(self):
+        """
+        :return: THE REQUESTS NOT YET COMPLETE, HIGHEST priority FIRST
+        """
+        if not self.file.exists:
+            return []
+        requests = [convert.json2value(line) for line in self.file.read_lines() if line.strip()]
+        with self.locker:
+            return sorted(
+                (
+                    r
+                    for r in requests
+                    if not self.progress[text_type(r.id)].complete and not self.progress[text_type(r.id)].listed
+                ),
+                key=lambda r: (-coalesce(r.priority, 0), r.id)
+            )
+
+    def complete(self, request):
+        """
+        ALL BATCHES OF THE REQUEST ARE LISTED; IT IS COMPLETE WHEN THEY ARE DONE
+        """
+        with self.locker:
+            progress = self.progress[text_type(request.id)]
+            progress.listed = True
+            self._check_complete(progress)
+            self.progress_file.write(convert.value2json(self.progress))
+
+    def add(self, request, pending):
+        """
+        QUEUE THE BATCHES OF THE REQUEST THAT ARE NOT DONE YET
+        """
+        for p in pending:
+            key = _key(p["start_point"])
+            with self.locker:
+                progress = self.progress[text_type(request.id)]
+                if key in progress.done:
+                    continue
+                if key not in progress.todo:
+                    progress.todo = list(progress.todo) + [key]
+            p["backfill"] = request.id
+            self.queue.add(p)
+
+    def schedule(self, tail, please_stop):
+        """
+        :param tail: THE QUEUE OF LIVE TAIL BATCHES
+        :return: THE NEXT BATCH FOR A WORKER, OR THREAD_STOP WHEN TAIL AND BACKFILL ARE BOTH DONE
+        """
+        tail_done = False
+        while not please_stop:
+            with self.locker:
+                # BACKFILL ONLY GETS ITS SHARE OF WORKERS, UNLESS THE TAIL HAS NOTHING TO DO
+                if self.queue and (not tail or tail_done or self.running < math.ceil(self.share * self.threads)):
+                    batch = self.queue.pop(till=Till(seconds=0))
+                    if batch is not None and batch is not THREAD_STOP:
+                        self.running += 1
+                        return batch
+            if tail_done:
+                batch = self.queue.pop(till=Till(seconds=1) | please_stop)
+                if batch is THREAD_STOP:
+                    return THREAD_STOP
+                if batch is not None:
+                    with self.locker:
+                        self.running += 1
+                    return batch
+            else:
+                batch = tail.pop(till=Till(seconds=1) | please_stop)
+                if batch is THREAD_STOP:
+                    tail_done = True
+                elif batch is not None:
+                    return batch
+        return THREAD_STOP
+
+    def done(self, request_id, start_point, release=True):
+        """
+        RECORD THE BATCH IS EXTRACTED
+        :param release: False IF THE BATCH ALREADY LEFT ITS WORKER (SEE release())
+        """
+        with self.locker:
+            if release:
+                self.running -= 1
+            progress = self.progress[text_type(request_id)]
+            progress.done = list(progress.done) + [_key(start_point)]
+            self._check_complete(progress)
+            self.progress_file.write(convert.value2json(self.progress))
+
+    def release(self, batch):
+        """
+        THE BATCH LEFT ITS WORKER WITHOUT BEING DONE (IT FAILED, OR IS ONE
+        PART OF A SPLIT BATCH); extract.Retries GIVES IT BACK WITH resume()
+        """
+        with self.locker:
+            self.running -= 1
+
+    def resume(self, batch):
+        """
+        THE FAILED BATCH IS TRIED AGAIN
+        """
+        with self.locker:
+            self.running += 1
+
+    def _check_complete(self, progress):
+        # todo AND done ARE LISTS OF DESTINATION KEYS
+        if progress.listed and all(t in progress.done for t in progress.todo):
+            progress.complete = True
+            progress.todo = None
+            progress.done = None
+
+
+def _key(start_point):
+    return ".".join(map(text_type, start_point))
+
+
+def submit(file, start, end, priority=0):
+    """
+    ADD A REQUEST TO EXTRACT [start, end) AGAIN
+    :param start: VALUE OF THE FIRST extract.field
+    :param end: VALUE OF THE FIRST extract.field, NOT INCLUDED
+    """
+    file = File(file)
+    ids = [convert.json2value(line).id for line in file.read_lines() if line.strip()] if file.exists else []
+    request = {
+        "id": max(ids + [0]) + 1,
+        "start": start,
+        "end": end,
+        "priority": priority,
+        "submitted": Date.now()
+    }
+    file.append(convert.value2json(request))
+    return wrap(request)
+
+
+def _parse(value):
+    try:
+        return convert.json2value(value)
+    except Exception:
+        return value
+
+
+def main():
+    try:
+        settings = startup.read_settings(defs=[
+            {
+                "name": ["--start"],
+                "help": "first value of the first extract field to extract again (inclusive)",
+                "type": str,
+                "dest": "start",
+                "required": True
+            },
+            {
+                "name": ["--end"],
+                "help": "last value of the first extract field to extract again (exclusive)",
+                "type": str,
+                "dest": "end",
+                "required": True
+            },
+            {
+                "name": ["--priority"],
+                "help": "higher priority requests are extracted first",
+                "type": int,
+                "dest": "priority",
+                "default": 0,
+                "required": False
+            }
+        ])
+        constants.set(settings.constants)
+        Log.start(settings.debug)
+
+        if not settings.extract.backfill.file:
+            Log.error("Expecting `extract.backfill.file` in the config")
+        request = submit(
+            settings.extract.backfill.file,
+            _parse(settings.args.start),
+            _parse(settings.args.end),
+            settings.args.priority
+        )
+        Log.note("Submitted backfill {{request|json}}", request=request)
+    except Exception as e:
+        Log.warning("Problem submitting backfill", e)
+    finally:
+        Log.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from collections import deque
+
+from mo_dots import coalesce, wrap, Data
+from mo_kwargs import override
+from mo_logs import Log, strings
+from mo_logs.strings import utf82unicode
+from mo_threads import Thread, Till, Lock
+from mo_threads.metrics import METRICS
+from mo_times import Date, Duration
+from mo_times.timer import Timer
+from pyLibrary import convert
+from pyLibrary.env import http
+from pyLibrary.env.elasticsearch import proto_name
+
+DEBUG = False
+REJECTED = 429  # ELASTICSEARCH IS TOO BUSY: SLOW DOWN AND SEND AGAIN
+
+BULK_SECONDS = METRICS.histogram("elasticsearch_bulk_seconds", "Time for one bulk request")
+BULK_BYTES = METRICS.counter("elasticsearch_bulk_bytes_total", "Bytes sent in bulk requests")
+RETRIES = METRICS.counter("elasticsearch_rejected_total", "Documents rejected (429), and sent again")
+FAILURES = METRICS.counter("elasticsearch_failures_total", "Documents elasticsearch would not accept")
+
+
+class ElasticsearchSink(object):
+    """
+    SEND THE DOCUMENTS STRAIGHT TO ELASTICSEARCH WITH _bulk, INSTEAD OF
+    WRITING FILES FOR ANOTHER PROCESS TO LOAD
+    """
+
+    @override
+    def __init__(
+        self,
+        host,
+        index,
+        port=9200,
+        type="doc",
+        id_field=None,
+        max_bytes=10 * 1000 * 1000,
+        max_docs=5000,
+        in_flight=2,
+        retry=None,
+        timeout=600,
+        rollover_interval=None,
+        kwargs=None
+    ):
+        """
+        :param host: URL OF THE CLUSTER (eg "http://localhost")
+        :param index: NAME OF THE INDEX, OR THE ALIAS WHEN ROLLING OVER
+        :param type: DOCUMENT TYPE FOR THE ACTION LINES (null FOR ES7+)
+        :param id_field: PATH TO THE DOCUMENT ID (DEFAULT IS AN ELASTICSEARCH GENERATED ID)
+        :param max_bytes: MAXIMUM SIZE OF ONE BULK REQUEST
+        :param max_docs: MAXIMUM NUMBER OF DOCUMENTS IN ONE BULK REQUEST
+        :param in_flight: NUMBER OF BULK REQUESTS SENT AT ONCE
+        :param retry: {"times", "sleep"} FOR REJECTED (429) REQUESTS; THE SLEEP DOUBLES EACH TIME
+        :param rollover_interval: START A NEW INDEX FOR EACH INTERVAL OF THE FIRST extract.field
+        """
+        self.settings = kwargs
+        self.url = host.rstrip("/") + ":" + str(port) + "/_bulk"
+        self.index_url = host.rstrip("/") + ":" + str(port) + "/"
+        self.retry = _retry(retry)
+        self.rollover_interval = Duration(rollover_interval) if rollover_interval else None
+        self.locker = Lock("elasticsearch sink")
+        self.known_indexes = set()
+        self.failures = 0  # NUMBER OF DOCUMENTS ELASTICSEARCH WOULD NOT ACCEPT
+
+    def index_name(self, timestamp=None):
+        """
+        :param timestamp: TIME OF THE BATCH, REQUIRED WHEN ROLLING OVER
+        :return: NAME OF THE INDEX THE BATCH GOES TO
+        """
+        if not self.rollover_interval:
+            return self.settings.index
+        if timestamp == None:
+            Log.error("Expecting the batch time to pick the rollover index")
+        return proto_name(self.settings.index, Date(timestamp).floor(self.rollover_interval))
+
+    def write(self, lines, timestamp=None):
+        """
+        SEND ALL DOCUMENTS, AND RETURN ONLY WHEN ELASTICSEARCH HAS THEM ALL
+        :param lines: THE JSON DOCUMENTS, ONE PER LINE
+        :param timestamp: TIME OF THE BATCH, FOR ROLLOVER
+        :return: NUMBER OF DOCUMENTS SENT
+        """
+        index = self.index_name(timestamp)
+        if self.rollover_interval:
+            self._create_index(index)
+
+        count = 0
+        pending = deque()
+        for body in self._bodies(lines, index):
+            count += len(body)
+            # PIPELINE: BUILD THE NEXT REQUEST WHILE OTHERS ARE SENT
+            pending.append(Thread.run("bulk to " + index, self._send, body))
+            if len(pending) >= self.settings.in_flight:
+                pending.popleft().join()
+        while pending:
+            pending.popleft().join()
+        return count
+
+    def _bodies(self, lines, index):
+        """
+        :return: GENERATOR OF LISTS OF (action, document) PAIRS, EACH WITHIN max_docs AND max_bytes
+        """
+        action = {"_index": index}
+        if self.settings.type:
+            action["_type"] = self.settings.type
+
+        body = []
+        size = 0
+        for line in lines:
+            if self.settings.id_field:
+                action["_id"] = convert.json2value(line)[self.settings.id_field]
+            pair = (convert.value2json({"index": action}), line)
+            pair_size = len(pair[0].encode("utf8")) + len(line.encode("utf8")) + 2
+            if body and (len(body) >= self.settings.max_docs or size + pair_size > self.settings.max_bytes):
+                yield body
+                body = []
+                size = 0
+            body.append(pair)
+            size += pair_size
+        if body:
+            yield body
+
+    def _send(self, body, please_stop):
+        sleep = self.retry.sleep
+        bad = []  # DOCUMENTS NOT ACCEPTED FOR REASONS OTHER THAN 429
+        for attempt in range(self.retry.times):
+            if attempt:
+                Log.note("Elasticsearch rejected {{num}} documents, retry in {{seconds}} seconds", num=len(body), seconds=sleep)
+                RETRIES.inc(len(body))
+                (Till(seconds=sleep) | please_stop).wait()
+                sleep *= 2
+            if please_stop:
+                Log.error("Shutdown before all documents sent")
+
+            with Timer("send {{num}} documents to elasticsearch", {"num": len(body)}, debug=DEBUG, metric=BULK_SECONDS):
+                data = "".join(a + "\n" + d + "\n" for a, d in body).encode("utf8")
+                BULK_BYTES.inc(len(data))
+                response = http.post(
+                    self.url,
+                    data=data,
+                    headers={"Content-Type": "application/x-ndjson"},
+                    timeout=self.settings.timeout,
+                    zip=False
+                )
+            if response.status_code == REJECTED:
+                continue
+            if response.status_code not in [200, 201]:
+                Log.error(
+                    "Bulk request failed with {{status}}: {{content}}",
+                    status=response.status_code,
+                    content=strings.limit(utf82unicode(response.all_content), 1000)
+                )
+            details = convert.json2value(utf82unicode(response.all_content))
+            if not details.errors:
+                break
+
+            # SEND ONLY THE REJECTED DOCUMENTS AGAIN; THE REST ARE ACCEPTED, OR BAD
+            rejected = []
+            for (action, doc), item in zip(body, details["items"]):
+                status = coalesce(item.index.status, item.create.status)
+                if status == REJECTED:
+                    rejected.append((action, doc))
+                elif status not in [200, 201]:
+                    bad.append(Data(status=status, error=coalesce(item.index.error, item.create.error), doc=doc))
+            if not rejected:
+                break
+            body = rejected
+        else:
+            Log.error("Elasticsearch rejected {{num}} documents {{times}} times", num=len(body), times=self.retry.times)
+
+        if bad:
+            # FAIL THE BATCH, SO last DOES NOT MOVE PAST DOCUMENTS THAT WERE NOT INDEXED
+            with self.locker:
+                self.failures += len(bad)
+            FAILURES.inc(len(bad))
+            Log.error(
+                "{{num}} documents not accepted, eg {{status}} {{error|json}} for\n{{doc}}",
+                num=len(bad),
+                status=bad[0].status,
+                error=bad[0].error,
+                doc=strings.limit(bad[0].doc, 500)
+            )
+
+    def _create_index(self, index):
+        """
+        A NEW ROLLOVER INDEX IS ADDED TO THE ALIAS
+        """
+        with self.locker:
+            if index in self.known_indexes:
+                return
+            response = http.put(
+                self.index_url + index,
+                data=convert.value2json({"aliases": {self.settings.index: {}}}).encode("utf8"),
+                headers={"Content-Type": "application/json"},
+                timeout=self.settings.timeout
+            )
+            content = utf82unicode(response.all_content)
+            if response.status_code not in [200, 201] and "already_exists" not in content and "AlreadyExists" not in content:
+                Log.error("Can not create index {{index}}: {{content}}", index=index, content=strings.limit(content, 1000))
+            self.known_indexes.add(index)
+
+
+def _retry(retry):
+    retry = wrap(coalesce(retry, {}))
+    sleep = coalesce(retry.sleep, 1)
+    if not isinstance(sleep, (int, float)):
+        sleep = Duration(sleep).seconds
+    return Data(times=coalesce(retry.times, 5), sleep=sleep)
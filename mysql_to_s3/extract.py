@@ -12,61 +12,72 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import os
+import signal
 from contextlib import closing
 
 from mo_future import text_type
 
 from jx_python import jx
-from mo_dots import Data, wrap, Null, listwrap, unwrap, relative_field, coalesce
+from mo_dots import wrap, Null, listwrap, relative_field, coalesce, set_default, split_field, Record
 from mo_files import File, TempFile
 from mo_kwargs import override
 from mo_logs import Log, startup, constants, machine_metadata
-from mo_threads import Signal, Thread, Queue, THREAD_STOP
+from mo_threads import Signal, Thread, BatchQueue, THREAD_STOP, Till
+from mo_threads.metrics import METRICS, MetricsExporter
+from mo_math import Math
 from mo_times import Date, Duration, DAY
 from mo_times.timer import Timer
-from pyLibrary import convert, aws
-from pyLibrary.aws import s3
-from pyLibrary.env import elasticsearch
+from pyLibrary import convert
 from pyLibrary.env.git import get_git_revision
 from pyLibrary.sql import SQL, sql_list, SQL_LIMIT, SQL_ORDERBY, SQL_WHERE, SQL_FROM, SQL_SELECT, SQL_AND, SQL_OR, sql_and, sql_iso, sql_alias, SQL_TRUE
-from pyLibrary.sql.mysql import MySQL, quote_column
+from pyLibrary.sql.mysql import quote_column
 
 from mysql_to_s3.counter import Counter, DurationCounter, BatchCounter
-from mysql_to_s3.snowflake_schema import SnowflakeSchema
+from mysql_to_s3.fragments import FragmentCache, JsonEncoder, DEFAULT_SIZE
+from mysql_to_s3.profiler import BatchProfiler
+from mysql_to_s3.retries import Retries
+from mysql_to_s3.snowflake_schema import SnowflakeSchema, open_database
+from mysql_to_s3.sqlite_db import SqliteDB
+from mysql_to_s3.streaming import splice
 
 DEBUG = False
+DEFAULT_STREAM_CHILDREN = 100000  # CHILD ROWS OF ONE FACT BEFORE ITS NESTED LISTS ARE STREAMED
+
+BATCHES_LISTED = METRICS.counter("mysql_to_s3_batches_listed_total", "Batches found by the lister")
+BATCHES_DONE = METRICS.counter("mysql_to_s3_batches_total", "Batches extracted and written to the destination")
+BATCH_FAILURES = METRICS.counter("mysql_to_s3_batch_failures_total", "Batches that failed, and were tried again")
+DOCUMENTS = METRICS.counter("mysql_to_s3_documents_total", "Documents written")
+ROWS = METRICS.counter("mysql_to_s3_rows_total", "Database rows read")
+NOTIFICATIONS = METRICS.counter("mysql_to_s3_notifications_total", "Messages sent to the notify queue")
+LIST_SECONDS = METRICS.histogram("mysql_to_s3_list_seconds", "Time to list one block of batches")
+QUERY_SECONDS = METRICS.histogram("mysql_to_s3_query_seconds", "Time for the database to start answering the batch query")
+ASSEMBLE_SECONDS = METRICS.histogram("mysql_to_s3_assemble_seconds", "Time to read the rows and make the documents of one batch")
+WRITE_SECONDS = METRICS.histogram("mysql_to_s3_write_seconds", "Time to write one batch to the destination")
+BATCH_SECONDS = METRICS.histogram("mysql_to_s3_batch_seconds", "Time to extract one batch, from query to notification")
+FRAGMENT_HITS = METRICS.counter("mysql_to_s3_fragment_hits_total", "Inner objects copied from the JSON already encoded in the batch")
+FRAGMENT_MISSES = METRICS.counter("mysql_to_s3_fragment_misses_total", "Inner objects encoded")
+STREAMED_DOCUMENTS = METRICS.counter("mysql_to_s3_streamed_documents_total", "Documents with so many children they were streamed to the output")
+TRUNCATED_CHILDREN = METRICS.counter("mysql_to_s3_truncated_children_total", "Child rows left out of documents by extract.max_children")
 
 
 class Extract(object):
 
     @override
-    def __init__(self, kwargs=None):
+    def __init__(self, catalog=None, kwargs=None):
+        """
+        :param catalog: snowflake_schema.Catalog SHARED BY THE EXTRACTS OF A scheduler
+        """
         self.settings = kwargs
-        self.schema = SnowflakeSchema(self.settings.snowflake)
+        self.schema = SnowflakeSchema(catalog=catalog, kwargs=self.settings.snowflake)
         self._extract = extract = kwargs.extract
 
         # SOME PREP
         get_git_revision()
 
-        # VERIFY WE DO NOT HAVE TOO MANY OTHER PROCESSES WORKING ON STUFF
-        with MySQL(**kwargs.snowflake.database) as db:
-            processes = None
-            try:
-                processes = jx.filter(
-                    db.query("show processlist"),
-                    {"and": [
-                        {"neq": {"Command": "Sleep"}},
-                        {"neq": {"Info": "show processlist"}}
-                    ]}
-                )
-            except Exception as e:
-                Log.warning("no database", cause=e)
-
-            if processes:
-                if DEBUG:
-                    Log.warning("Processes are running\n{{list|json}}", list=processes)
-                else:
-                    Log.error("Processes are running\n{{list|json}}", list=processes)
+        if not catalog:
+            # THE scheduler CHECKS ONCE, BEFORE ANY OF ITS EXTRACTS START
+            check_processes(kwargs.snowflake.database)
 
         extract.type = listwrap(extract.type)
         extract.start = listwrap(extract.start)
@@ -85,13 +96,128 @@ class Extract(object):
 
         extract.threads = coalesce(extract.threads, 1)
         self.done_pulling = Signal()
-        self.queue = Queue("all batches", max=2 * coalesce(extract.threads, 1), silent=True)
+        # ROOM FOR TWO BATCHES FOR EACH OF THE MOST WORKERS THERE CAN BE
+        self.queue = BatchQueue("all batches", max=2 * max(extract.threads, coalesce(extract.autoscale.max, 0)), silent=True)
+        METRICS.gauge("mysql_to_s3_queue_depth", "Batches waiting for a worker", function=lambda: len(self.queue))
+        METRICS.gauge("mysql_to_s3_lister_wait_seconds", "Time the lister waited for room in the queue", function=lambda: self.queue.stats.put_wait)
+        METRICS.gauge("mysql_to_s3_worker_wait_seconds", "Time the workers waited for a batch", function=lambda: self.queue.stats.get_wait)
+
+        self.elasticsearch = None
+        if isinstance(self.settings.destination, text_type):
+            self.bucket = None
+            is_parquet = self.settings.destination.endswith(".parquet")
+        elif self.settings.destination.type == "elasticsearch":
+            self.bucket = None
+            is_parquet = False
+            if self.settings.destination.rollover_interval and extract.type[0] != "time":
+                Log.error("Expecting the first `extract.field` to be a time to rollover the elasticsearch index")
+            # THE CLIENTS (boto, elasticsearch, ...) ARE IMPORTED ONLY FOR THE DESTINATION USED
+            from mysql_to_s3.elasticsearch_sink import ElasticsearchSink
+
+            self.elasticsearch = ElasticsearchSink(kwargs=self.settings.destination)
+        else:
+            from pyLibrary.aws import s3
+
+            self.bucket = s3.Bucket(self.settings.destination)
+            is_parquet = self.settings.destination.format == "parquet"
+        if is_parquet:
+            from mysql_to_s3.parquet import ParquetSink
+
+            # ROW GROUP AND COMPRESSION SETTINGS COME WITH THE S3 DESTINATION
+            self.parquet = ParquetSink(
+                columns=self.schema.columns,
+                fact_table=self.settings.snowflake.fact_table,
+                kwargs=self.settings.destination if self.bucket else wrap({})
+            )
+        else:
+            self.parquet = None
+        # PROFILES AND SIDE OBJECTS GO NEXT TO THE OUTPUT, OR NEXT TO THE last FILE
+        if isinstance(self.settings.destination, text_type):
+            near = File(self.settings.destination).parent
+        else:
+            near = File(extract.last).parent
+        if self.settings.snowflake.large_values:
+            from mysql_to_s3.large_values import LargeValues
+
+            # HUGE TEXT/BLOB VALUES ARE TRUNCATED, OR MOVED TO SIDE OBJECTS
+            self.large_values = LargeValues(
+                bucket=self.bucket,
+                kwargs=set_default({}, self.settings.snowflake.large_values, {"directory": File.new_instance(near, "large").abspath})
+            )
+            self.large = self.large_values.rules(self.schema.columns)
+        else:
+            self.large_values = None
+            self.large = []
+        if extract.manifest:
+            from mysql_to_s3.manifest import Manifest
+
+            # ONE ENTRY PER BATCH: KEY RANGES, COUNTS AND FACT ids, FOR RESTARTS AND LOOKUPS
+            self.manifest = Manifest(
+                bucket=self.bucket,
+                kwargs=set_default({}, extract.manifest, {"directory": File.new_instance(near, "manifest").abspath})
+            )
+        else:
+            self.manifest = None
+        if extract.typed:
+            # TYPED JSON, WITH THE TYPES FROM THE SCHEMA
+            if self.parquet:
+                Log.error("Parquet is already typed; do not set `extract.typed`")
+            if self.elasticsearch and self.settings.destination.id_field:
+                Log.error("Can not use `destination.id_field` with `extract.typed`")
+            from mysql_to_s3.typed_json import TypedEncoder
+
+            self.encoder = TypedEncoder(self.schema.columns, self.settings.snowflake.fact_table)
+        else:
+            self.encoder = JsonEncoder(self.schema.columns, self.settings.snowflake.fact_table)
+        # NUMBER OF ENCODED MANY-TO-ONE OBJECTS KEPT FOR A BATCH (0 TO ENCODE EVERY ONE)
+        self.fragment_cache = coalesce(extract.fragment_cache, DEFAULT_SIZE)
+        # CHILD ROWS OF A FACT BEFORE ITS CHILDREN ARE WRITTEN AS THEY ARRIVE (0 TO KEEP ALL IN MEMORY)
+        self.stream_children = coalesce(extract.stream_children, DEFAULT_STREAM_CHILDREN)
+        self.max_children, self.descendants = self._max_children(extract.max_children)
+        if self.settings.notify:
+            from pyLibrary import aws
+
+            self.notify = aws.Queue(self.settings.notify)
+        else:
+            self.notify = None
+        if extract.lease:
+            from mysql_to_s3.leases import Leases
+
+            # SHARE THE BATCHES WITH THE OTHER PROCESSES USING THE SAME LEASE TABLE
+            self.leases = Leases(kwargs=set_default({}, extract.lease, {"database": kwargs.snowflake.database}))
+        else:
+            self.leases = None
+        # FAILED BATCHES ARE TRIED AGAIN AFTER A BACKOFF, THEN SPLIT TO QUARANTINE THE BAD FACTS
+        self.retries = Retries(
+            bucket=self.bucket,
+            kwargs=set_default({}, extract.retry, {"directory": File.new_instance(near, "quarantine").abspath})
+        )
+        self.profiler = BatchProfiler(kwargs=set_default({}, extract.profile, {"directory": File.new_instance(near, "profiles").abspath}))
+        if extract.backfill:
+            from mysql_to_s3.backfill import Backfill
 
-        self.bucket = s3.Bucket(self.settings.destination)
-        self.notify = aws.Queue(self.settings.notify)
+            # RANGES TO EXTRACT AGAIN, SHARING THE WORKERS WITH THE LIVE TAIL
+            self.backfill = Backfill(kwargs=set_default({}, extract.backfill, {"threads": extract.threads}))
+            Thread.run("get backfill records", self.pull_backfill)
+        else:
+            self.backfill = None
+        self.lister_claimed = Signal("lister claimed")
+        if self.leases:
+            # NOT A CHILD OF "get records", WHICH MAY BE DONE FIRST
+            Thread.run("claim leased batches", self.claim_all_remaining)
         Thread.run("get records", self.pull_all_remaining)
 
     def pull_all_remaining(self, please_stop):
+        if self.leases:
+            # CLAIM THE LISTER LEASE BEFORE CLAIMING BATCHES, SO WE DO NOT STOP EARLY
+            try:
+                is_lister = self.leases.claim_lister()
+            finally:
+                self.lister_claimed.go()
+            if not is_lister:
+                # ANOTHER PROCESS IS LISTING
+                self.done_pulling.go()
+                return
         try:
             try:
                 content = File(self.settings.extract.last).read_json()
@@ -104,55 +230,249 @@ class Extract(object):
                     start_point, first_value = content
                     start_point = tuple(start_point)
                 Log.note("First value is {{start1|date}}, {{start2}}", start1=first_value[0], start2=first_value[1])
-            except Exception as _:
-                Log.error("Expecting a file {{filename}} with the last good S3 bucket etl id in array form eg: [[954, 0]]", filename=self.settings.extract.last)
-                start_point = tuple(self._extract.start)
-                first_value = Null
-
-            counter = Counter(start=0)
-            for t, s, b, f, i in reversed(zip(self._extract.type, self._extract.start, self._extract.batch, listwrap(first_value)+DUMMY_LIST, range(len(self._extract.start)))):
-                if t == "time":
-                    counter = DurationCounter(start=s, duration=b, child=counter)
-                    first_value[i] = Date(f)
-                else:
-                    counter = BatchCounter(start=s, size=b, child=counter)
-
-            batch_size = self._extract.batch.last() * 2 * self.settings.extract.threads
-            with MySQL(**self.settings.snowflake.database) as db:
-                while not please_stop:
-                    sql = self._build_list_sql(db, first_value, batch_size + 1)
-                    pending = []
-                    counter.reset(start_point)
-                    with Timer("Grab a block of ids for processing"):
-                        with closing(db.db.cursor()) as cursor:
-                            acc = []
-                            cursor.execute(sql)
-                            count = 0
-                            for row in cursor:
-                                detail_key = counter.next(row)
-                                key = tuple(detail_key[:-1])
-                                count += 1
-                                if key != start_point:
-                                    if first_value:
-                                        if not acc:
-                                            Log.error("not expected, {{filename}} is probably set too far in the past", filename=self.settings.extract.last)
-                                        pending.append({"start_point": start_point, "first_value": first_value, "data": acc})
-                                    acc = []
-                                    start_point = key
-                                    first_value = row
-                                acc.append(row[-1])  # ASSUME LAST COLUMN IS THE FACT TABLE id
+            except Exception as e:
+                last = self.manifest.last() if self.manifest else None
+                if not last:
+                    Log.error("Expecting a file {{filename}} with the last good S3 bucket etl id in array form eg: [[954, 0]]", filename=self.settings.extract.last, cause=e)
+                # THE last FILE IS GONE; THE MANIFEST KNOWS THE LAST BATCH WRITTEN
+                Log.note("Continue from the manifest at batch {{start_point}}", start_point=last.start_point)
+                start_point = tuple(last.start_point)
+                first_value = last.first_value
+
+            if self.leases:
+                # CONTINUE FROM WHERE THE LAST LISTER STOPPED
+                last_listed = self.leases.last_listed()
+                if last_listed:
+                    start_point, first_value = last_listed
+
+            counter = self._make_counter(first_value)
+            with open_database(self.settings.snowflake.database) as db:
+                for pending in self._list_batches(db, counter, start_point, first_value, please_stop):
                     Log.note("adding {{num}} for processing",  num=len(pending))
-                    self.queue.extend(pending)
-
-                    if count < batch_size:
-                        self.queue.add(THREAD_STOP)
-                        break
+                    BATCHES_LISTED.inc(len(pending))
+                    if self.leases:
+                        self.leases.add(pending)
+                    else:
+                        # ALL AT ONCE, SO WORKERS NEVER SEE HALF A LIST
+                        self.queue.put_many(pending)
+                if not self.leases and not please_stop:
+                    self.queue.add(THREAD_STOP)
         except Exception as e:
             Log.warning("Problem pulling data", cause=e)
         finally:
+            if self.leases:
+                self.leases.lister_done()
             self.done_pulling.go()
             Log.note("pulling new data is done")
 
+    def claim_all_remaining(self, please_stop):
+        """
+        FILL THE QUEUE WITH BATCHES LEASED FROM THE SHARED LEASE TABLE, UNTIL
+        ALL ARE DONE: THE BATCHES OF A DEAD PROCESS ARE CLAIMED ONCE THEIR
+        LEASE EXPIRES
+        """
+        try:
+            (self.lister_claimed | please_stop).wait()
+            while not please_stop:
+                listing = self.leases.is_listing()  # CHECK BEFORE CLAIMING, SO NO LATE BATCH IS MISSED
+                batch = self.leases.claim()
+                if batch:
+                    self.queue.add(batch)
+                elif not listing and not self.leases.unfinished():
+                    # NOTHING LEFT, AND NOBODY IS ADDING MORE
+                    break
+                else:
+                    (Till(seconds=1) | please_stop).wait()
+        except Exception as e:
+            Log.warning("Problem claiming batches", cause=e)
+        finally:
+            self.queue.add(THREAD_STOP)
+            Log.note("claiming batches is done")
+
+    def pull_backfill(self, please_stop):
+        try:
+            with open_database(self.settings.snowflake.database) as db:
+                while not please_stop:
+                    for request in self.backfill.pending():
+                        if please_stop:
+                            break
+                        Log.note("Backfill {{request|json}}", request=request)
+                        start_point, first_value = self._locate(db, request.start)
+                        end_point, end_value = self._locate(db, request.end)
+                        if self._extract.type[0] == "time":
+                            inside = Date(end_value[0]) != Date(request.end)
+                        else:
+                            inside = end_value[0] != request.end
+                        if inside:
+                            # end IS INSIDE A BATCH; INCLUDE ALL OF IT
+                            end_point = (end_point[0] + 1,) + end_point[1:]
+                        counter = self._make_counter(first_value)
+                        for pending in self._list_batches(db, counter, start_point, first_value, please_stop, end_point):
+                            self.backfill.add(request, pending)
+                        if not please_stop:
+                            self.backfill.complete(request)
+                    if self.done_pulling:
+                        break
+                    # LOOK FOR NEW REQUESTS WHILE THE LIVE TAIL IS STILL LISTING
+                    (Till(seconds=10) | please_stop | self.done_pulling).wait()
+        except Exception as e:
+            Log.warning("Problem pulling backfill data", cause=e)
+        finally:
+            self.backfill.queue.add(THREAD_STOP)
+            Log.note("pulling backfill data is done")
+
+    def work(self, db, batch, please_stop):
+        """
+        EXTRACT ONE BATCH FROM next_batch(); A FAILED BATCH GOES TO self.retries
+        :return: True IF THE BATCH IS DONE
+        """
+        try:
+            self.extract(db=db, please_stop=please_stop, **batch)
+        except Exception as e:
+            Log.warning("Could not extract", cause=e)
+            self.failed(batch, e)
+            return False
+        if batch.get("part"):
+            if batch.get("backfill"):
+                self.backfill.release(batch)
+            if self.retries.succeeded(batch):
+                # THE LAST PART OF A SPLIT BATCH
+                self._done(batch["start_point"], batch["first_value"], batch.get("backfill"), release=False)
+        else:
+            self.retries.succeeded(batch)
+        return True
+
+    def failed(self, batch, cause):
+        """
+        HAND A BATCH FROM next_batch() THAT COULD NOT BE EXTRACTED TO self.retries
+        """
+        BATCH_FAILURES.inc()
+        if batch.get("backfill"):
+            self.backfill.release(batch)
+        if self.retries.failed(batch, cause):
+            # THE LAST PART OF THE BATCH WAS QUARANTINED
+            self._done(batch["start_point"], batch["first_value"], batch.get("backfill"), release=False)
+
+    def next_batch(self, please_stop):
+        """
+        :return: THE NEXT BATCH FOR A WORKER, OR THREAD_STOP WHEN THERE ARE NO MORE
+        """
+        while not please_stop:
+            batch = self.retries.due()
+            if batch:
+                if batch.get("backfill"):
+                    self.backfill.resume(batch)
+                return batch
+            wait = self.retries.wait()
+            till = please_stop if wait is None else please_stop | Till(seconds=wait)
+            if self.backfill:
+                batch = self.backfill.schedule(self.queue, till)
+            else:
+                batch = coalesce(self.queue.pop(till=till), THREAD_STOP)
+            if batch is not THREAD_STOP:
+                return batch
+            if wait is None:
+                return THREAD_STOP
+            # NOTHING LEFT BUT THE FAILED BATCHES
+            till.wait()
+        return THREAD_STOP
+
+    def _make_counter(self, first_value):
+        """
+        :param first_value: THE FIRST RECORD TO LIST (time VALUES ARE CONVERTED TO Date)
+        :return: THE COUNTER THAT CONVERTS RECORDS TO BATCH KEYS
+        """
+        counter = Counter(start=0)
+        for t, s, b, f, i in reversed(zip(self._extract.type, self._extract.start, self._extract.batch, listwrap(first_value)+DUMMY_LIST, range(len(self._extract.start)))):
+            if t == "time":
+                counter = DurationCounter(start=s, duration=b, child=counter)
+                first_value[i] = Date(f)
+            else:
+                counter = BatchCounter(start=s, size=b, child=counter)
+        return counter
+
+    def _batch_time(self, start_point):
+        """
+        :return: START TIME OF THE BATCH, IF THE FIRST extract.field IS A TIME
+        """
+        if self._extract.type[0] != "time" or not start_point:
+            return None
+        duration = self._extract.batch[0]
+        return Date(self._extract.start[0]).floor(duration) + duration * start_point[0]
+
+    def _list_batches(self, db, counter, start_point, first_value, please_stop, end_point=None):
+        """
+        GENERATE BLOCKS OF {"start_point", "first_value", "data"} BATCHES, IN ORDER
+        :param start_point: THE KEY OF THE BATCH THAT STARTS AT first_value
+        :param end_point: OPTIONAL KEY OF THE FIRST BATCH NOT LISTED; ALL BATCHES
+                          BEFORE IT ARE COMPLETE, SO THE LAST ONE IS ALSO LISTED
+        """
+        batch_size = self._extract.batch.last() * 2 * self.settings.extract.threads
+        while not please_stop:
+            sql = self._build_list_sql(db, first_value, batch_size + 1)
+            pending = []
+            counter.reset(start_point)
+            with Timer("Grab a block of ids for processing", metric=LIST_SECONDS):
+                with closing(db.db.cursor()) as cursor:
+                    acc = []
+                    cursor.execute(sql)
+                    count = 0
+                    for row in cursor:
+                        detail_key = counter.next(row)
+                        key = tuple(detail_key[:-1])
+                        count += 1
+                        if key != start_point:
+                            if first_value:
+                                if not acc:
+                                    Log.error("not expected, {{filename}} is probably set too far in the past", filename=self.settings.extract.last)
+                                pending.append({"start_point": start_point, "first_value": first_value, "data": acc})
+                            acc = []
+                            start_point = key
+                            first_value = row
+                            if end_point and key >= end_point:
+                                yield pending
+                                return
+                        acc.append(row[-1])  # ASSUME LAST COLUMN IS THE FACT TABLE id
+            if count < batch_size:
+                if end_point and acc:
+                    pending.append({"start_point": start_point, "first_value": first_value, "data": acc})
+                yield pending
+                return
+            yield pending
+
+    def _locate(self, db, value):
+        """
+        FIND THE BATCH THE GIVEN VALUE OF THE FIRST extract.field FALLS IN,
+        SO LISTING FROM THERE GIVES THE SAME BATCH KEYS AS THE LIVE TAIL
+        :return: (start_point, first_value) OF THAT BATCH
+        """
+        extract = self._extract
+        dim = len(extract.field)
+        if extract.type[0] == "time":
+            duration = extract.batch[0]
+            first = Date(value).floor(duration)
+            key = Math.round((first - Date(extract.start[0]).floor(duration)) / duration, decimal=0)
+            first_value = [first] + list(extract.start[1:])
+        else:
+            # NUMBER BATCHES ARE COUNTED IN RECORDS FROM THE START
+            field = quote_column(extract.field[0])
+            position = db.query(
+                SQL_SELECT + "COUNT(1)" + SQL_FROM + self.settings.snowflake.fact_table +
+                SQL_WHERE + field + "<" + db.quote_value(value),
+                row_tuples=True
+            )[0][0]
+            key = extract.start[0] + position // extract.batch[0]
+            first_value = db.query(
+                SQL_SELECT + sql_list(quote_column(f) for f in extract.field) +
+                SQL_FROM + self.settings.snowflake.fact_table +
+                SQL_ORDERBY + sql_list(quote_column(f) for f in extract.field) +
+                SQL_LIMIT + db.quote_value(1) +
+                SQL(" OFFSET ") + db.quote_value((key - extract.start[0]) * extract.batch[0]),
+                row_tuples=True
+            )
+            first_value = list(first_value[0]) if first_value else [value] + list(extract.start[1:])
+        return (key,) + (0,) * (dim - 1), first_value
+
     def _build_list_sql(self, db, first, batch_size):
         # TODO: ENSURE THE LAST COLUMN IS THE id
         if first:
@@ -169,7 +489,7 @@ class Extract(object):
 
         selects = []
         for t, f in zip(self._extract.type, self._extract.field):
-            if t == "time":
+            if t == "time" and not isinstance(db, SqliteDB):
                 selects.append("CAST"+sql_iso(sql_alias(quote_column(f), SQL("DATETIME(6)"))))
             else:
                 selects.append(quote_column(f))
@@ -182,7 +502,17 @@ class Extract(object):
         )
         return sql
 
-    def extract(self, db, start_point, first_value, data, please_stop):
+    def extract(self, db, start_point, first_value, data, please_stop, backfill=None, part=None):
+        """
+        :param part: FOR A PART OF A SPLIT BATCH, THE SPLITS THAT MADE IT (eg "01"); THE BATCH IS DONE WHEN ALL PARTS ARE
+        :return: NUMBER OF DOCUMENTS WRITTEN
+        """
+        with Timer("extract batch", debug=False, metric=BATCH_SECONDS), self.profiler.batch(start_point):
+            output = self._extract_batch(db, start_point, first_value, data, please_stop, backfill, part)
+        BATCHES_DONE.inc()
+        return output
+
+    def _extract_batch(self, db, start_point, first_value, data, please_stop, backfill, part):
         Log.note(
             "Starting scan of {{table}} at {{id}} and sending to batch {{start_point}}",
             table=self.settings.snowflake.fact_table,
@@ -196,13 +526,19 @@ class Extract(object):
             SQL_FROM + self.settings.snowflake.fact_table +
             SQL_WHERE + id + " in " + sql_iso(sql_list(map(db.quote_value, data)))
         )
-        sql = self.schema.get_sql(ids)
+        if self._extract.materialize:
+            setup, sql, teardown = self.schema.get_materialized_sql(ids)
+            with Timer("Materialize join prefixes"):
+                for command in setup:
+                    db.execute(command)
+        else:
+            sql = self.schema.get_sql(ids)
+            teardown = []
 
-        with Timer("Sending SQL"):
+        with Timer("Sending SQL", metric=QUERY_SECONDS):
             cursor = db.query(sql, stream=True, row_tuples=True)
 
         extract = self.settings.extract
-        fact_table = self.settings.snowflake.fact_table
 
         with TempFile() as temp_file:
             parent_etl = None
@@ -211,112 +547,354 @@ class Extract(object):
                     "id": s,
                     "source": parent_etl
                 }
+            parent_etl = coalesce(parent_etl, {})
             parent_etl["revision"] = get_git_revision()
             parent_etl["machine"] = machine_metadata
 
-            def append(value, i):
+            encoder = self.encoder
+            source = encoder.encode_etl(parent_etl)
+            cache = FragmentCache(self.fragment_cache)
+
+            streamed = []  # THE Spools OF THE DOCUMENT BEING ASSEMBLED
+
+            def spool(path):
+                output = encoder.spool(path, cache)
+                streamed.append(output)
+                return output
+
+            def append(value, i, truncated=None):
                 """
                 :param value: THE DOCUMENT TO ADD
-                :return: PleaseStop
+                :param truncated: MAP FROM NESTED PATH TO NUMBER OF CHILDREN LEFT OUT
                 """
-                temp_file.append(convert.value2json({
-                    fact_table: elasticsearch.scrub(value),
-                    "etl": {
-                        "id": i,
-                        "source": parent_etl,
-                        "timestamp": Date.now()
-                    }
-                }))
-            with Timer("assemble data"):
-                self.construct_docs(cursor, append, please_stop)
+                line = encoder.encode(value, i, source, Date.now(), cache, truncated)
+                if streamed:
+                    splice(line, streamed, temp_file.abspath)
+                    del streamed[:]
+                else:
+                    temp_file.append(line)
+            with Timer("assemble data", metric=ASSEMBLE_SECONDS):
+                count = self.construct_docs(cursor, append, please_stop, spool)
+            FRAGMENT_HITS.inc(cache.hits)
+            FRAGMENT_MISSES.inc(cache.misses)
+            for command in teardown:
+                db.execute(command)
+            ranges = self._ranges(db, data) if self.manifest else None
 
             # WRITE TO S3
             s3_file_name = ".".join(map(text_type, start_point))
-            with Timer("write to destination {{filename}}", param={"filename": s3_file_name}):
-                if not isinstance(self.settings.destination, text_type):
+            if part:
+                s3_file_name += "_" + part
+            num_bytes = None
+            is_last_step = False
+            with Timer("write to destination {{filename}}", param={"filename": s3_file_name}, metric=WRITE_SECONDS):
+                if self.elasticsearch:
+                    self.elasticsearch.write(temp_file, self._batch_time(start_point))
+                elif self.parquet and self.bucket:
+                    with TempFile() as parquet_file:
+                        self.parquet.write(temp_file, parquet_file.abspath)
+                        storage = self.bucket.new_key(s3_file_name + ".parquet")
+                        storage.set_contents_from_filename(parquet_file.abspath)
+                        if self.bucket.settings.public:
+                            storage.set_acl('public-read')
+                        num_bytes = os.path.getsize(parquet_file.abspath)
+                elif self.parquet:
+                    destination = File(self.settings.destination)
+                    self.parquet.write(temp_file, destination.abspath)
+                    num_bytes = os.path.getsize(destination.abspath)
+                    is_last_step = True
+                elif not isinstance(self.settings.destination, text_type):
                     destination = self.bucket.get_key(s3_file_name, must_exist=False)
-                    destination.write_lines(temp_file)
+                    num_bytes = destination.write_lines(temp_file)
                 else:
                     destination = File(self.settings.destination)
                     destination.write(convert.value2json([convert.json2value(o) for o in temp_file], pretty=True))
-                    return False
+                    num_bytes = os.path.getsize(destination.abspath)
+                    is_last_step = True
+
+        if self.manifest:
+            self.manifest.add(s3_file_name, start_point, first_value, ranges, count, num_bytes, data)
+        if is_last_step:
+            # A FILE IS THE WHOLE EXTRACT; THERE IS NO NOTIFICATION, AND NO NEXT BATCH TO RECORD
+            return count
 
         # NOTIFY SQS
         now = Date.now()
-        self.notify.add({
-            "bucket": self.settings.destination.bucket,
-            "key": s3_file_name,
-            "timestamp": now.unix,
-            "date/time": now.format()
-        })
-
+        if self.notify:
+            self.notify.add({
+                "bucket": self.settings.destination.bucket,
+                "key": s3_file_name,
+                "timestamp": now.unix,
+                "date/time": now.format()
+            })
+            NOTIFICATIONS.inc()
+
+        if not part:
+            self._done(start_point, first_value, backfill)
+        return count
+
+    def _done(self, start_point, first_value, backfill, release=True):
+        """
+        RECORD THE BATCH IS EXTRACTED
+        """
         # SUCCESS!!
-        File(extract.last).write(convert.value2json([start_point, first_value]))
+        if backfill:
+            # A BACKFILL NEVER MOVES THE LIVE TAIL
+            self.backfill.done(backfill, start_point, release)
+        elif self.leases:
+            # ONLY RECORD THE BATCHES THAT ARE DONE, WITH ALL BEFORE THEM DONE TOO
+            checkpoint = self.leases.done(start_point)
+            if checkpoint:
+                File(self.settings.extract.last).write(convert.value2json(list(checkpoint)))
+        else:
+            File(self.settings.extract.last).write(convert.value2json([start_point, first_value]))
 
 
-    def construct_docs(self, cursor, append, please_stop):
+    def construct_docs(self, cursor, append, please_stop, spool=None):
         """
         :param cursor: ITERATOR OF RECORDS
-        :param append: METHOD TO CALL WITH CONSTRUCTED DOCUMENT
-        :return: (count, first, next, next_key)
-        number of documents added
-        the first document in the batch
-        the first document of the next batch
+        :param append: METHOD TO CALL WITH CONSTRUCTED DOCUMENT (AND THE truncated COUNTS, IF ANY)
+        :param spool: FUNCTION FROM PATH OF A NESTED LIST TO A streaming.Spool, TO WRITE
+                      THE CHILDREN OF HUGE FACTS AS THEY ARRIVE (None TO KEEP ALL IN MEMORY)
+        :return: NUMBER OF DOCUMENTS ADDED
         """
         null_values = set(self.settings.snowflake.null_values) | {None}
 
         count = 0
         rownum = 0
-        columns = tuple(wrap(c) for c in self.schema.columns)
+        large = self.large
+        # THE null_values OF THESE COLUMNS ARE ALREADY NULL (A TRUNCATED VALUE MAY BECOME ONE)
+        normalized = set(self.schema.normalized) - set(i for i, _ in large)
+        # SPLIT THE PATHS ONCE, NOT FOR EVERY VALUE (put IS NULL FOR COLUMNS ONLY USED TO SORT)
+        columns = tuple(
+            (tuple(split_field(c.put)) if c.put != None else (), tuple(c.nested_path), ci in normalized)
+            for ci, c in enumerate(self.schema.columns)
+        )
+        steps = {}
+        stream_children = self.stream_children if spool else 0
+        max_children = self.max_children
+        descendants = self.descendants
+
+        def get_steps(path, parent):
+            output = steps.get((path, parent))
+            if output is None:
+                output = steps[(path, parent)] = tuple(split_field(relative_field(path, parent)))
+            return output
+
+        def flush(spools, relative_path, children):
+            # ENCODE THE CHILDREN NOW, SO THEY CAN BE FORGOTTEN
+            s = spools.get(relative_path)
+            if s is None:
+                # THE STEPS ARE FROM THE RECORD, WHICH HAS THE FACT UNDER "id"
+                s = spools[relative_path] = spool(relative_path[1:])
+            for c in children:
+                s.add(c)
+            del children[:]
+
+        def emit(record, spools, lists, truncated, count):
+            if spools is not None:
+                for relative_path, children in lists.items():
+                    flush(spools, relative_path, children)
+                    record.set_path(relative_path, spools[relative_path])
+                STREAMED_DOCUMENTS.inc()
+            if truncated:
+                TRUNCATED_CHILDREN.inc(sum(truncated.values()))
+                append(record.get("id"), count, truncated)
+            else:
+                append(record.get("id"), count)
+
         with Timer("Downloading from MySQL"):
-            curr_record = Null
-            for rownum, row in enumerate(cursor):
+            curr_record = None
+            num_children = 0  # CHILD ROWS OF curr_record
+            lists = {}  # THE TOP NESTED LISTS OF curr_record, BY PATH
+            spools = None  # Spool FOR EACH OF lists, ONCE curr_record IS STREAMED
+            seen = {}  # CHILDREN OF EACH NESTED PATH IN THE CURRENT PARENT
+            truncated = {}  # CHILDREN OF curr_record LEFT OUT, BY NESTED PATH
+            skip_depth = 0  # ROWS DEEPER THAN THIS BELONG TO A CHILD THAT WAS LEFT OUT
+            for rownum, row in enumerate(cursor, 1):
                 if please_stop:
                     Log.error("Got `please_stop` signal")
 
-                nested_path = []
+                nested_path = ()
                 next_record = None
-
-                for c, value in zip(columns, row):
-                    if value in null_values:
+                if large:
+                    row = list(row)
+                    for i, shrink in large:
+                        if row[i] is not None:
+                            row[i] = shrink(row[i])
+
+                for (put, c_nested_path, is_normal), value in zip(columns, row):
+                    if value is None or (not is_normal and value in null_values):
+                        continue
+                    if len(nested_path) < len(c_nested_path):
+                        nested_path = c_nested_path
+                        next_record = Record()
+                    if put:
+                        next_record.set_path(put, value)
+
+                depth = len(nested_path)
+                if depth > 1:
+                    if curr_record is None:
+                        # NO PARENT TO ATTACH TO
                         continue
-                    if len(nested_path) < len(c.nested_path):
-                        nested_path = unwrap(c.nested_path)
-                        next_record = Data()
-                    next_record[c.put] = value
+                    if max_children:
+                        if skip_depth:
+                            if depth > skip_depth:
+                                continue
+                            skip_depth = 0
+                        list_path = nested_path[0]
+                        for d in descendants.get(list_path, ()):
+                            seen[d] = 0
+                        limit = max_children.get(list_path)
+                        if limit:
+                            most, name = limit
+                            seen[list_path] = n = seen.get(list_path, 0) + 1
+                            if n > most:
+                                truncated[name] = truncated.get(name, 0) + 1
+                                skip_depth = depth
+                                continue
+
+                    num_children += 1
+                    if num_children > stream_children and spools is None and stream_children:
+                        # TOO BIG TO HOLD; WRITE ALL BUT THE LAST CHILD OF EACH LIST NOW
+                        spools = {}
+                        for relative_path, children in lists.items():
+                            last = children[-1:]
+                            flush(spools, relative_path, children[:-1])
+                            children[:] = last
 
-                if len(nested_path) > 1:
                     path = nested_path[-2]
-                    children = curr_record[path]
-                    if children == None:
-                        children = curr_record[path] = wrap([])
+                    relative_path = get_steps(path, ".")
+                    children = curr_record.get_path(relative_path)
+                    if children is None:
+                        children = lists[relative_path] = []
+                        curr_record.set_path(relative_path, children)
                     if len(nested_path) > 2:
                         parent_path = path
-                        for path in list(reversed(nested_path[0:-2:])):
-                            parent = children.last()
-                            relative_path = relative_field(path, parent_path)
-                            children = parent[relative_path]
-                            if children == None:
-                                children = parent[relative_path] = wrap([])
-                            parent_path=path
+                        for path in reversed(nested_path[0:-2]):
+                            parent = children[-1]
+                            relative_path = get_steps(path, parent_path)
+                            children = parent.get_path(relative_path)
+                            if children is None:
+                                children = []
+                                parent.set_path(relative_path, children)
+                            parent_path = path
+                    elif spools is not None and children:
+                        # THE PREVIOUS CHILD IS COMPLETE
+                        flush(spools, relative_path, children)
 
                     children.append(next_record)
                     continue
 
-                if curr_record == next_record:
+                if curr_record is next_record:
                     Log.error("not expected")
 
                 if curr_record:
-                    append(curr_record["id"], count)
+                    emit(curr_record, spools, lists, truncated, count)
                     count += 1
                 curr_record = next_record
+                num_children = 0
+                lists = {}
+                spools = None
+                seen = {}
+                truncated = {}
+                skip_depth = 0
 
             # DEAL WITH LAST RECORD
             if curr_record:
-                append(curr_record["id"], count)
+                emit(curr_record, spools, lists, truncated, count)
                 count += 1
 
+        DOCUMENTS.inc(count)
+        ROWS.inc(rownum)
         Log.note("{{num}} documents ({{rownum}} db records)", num=count, rownum=rownum)
+        return count
+
+    def _max_children(self, max_children):
+        """
+        :param max_children: MOST CHILDREN IN EACH NESTED LIST, OR A LIST OF {"path", "max"} FOR SOME OF THEM
+        :return: (MAP FROM NESTED PATH TO (MOST, NAME), MAP FROM NESTED PATH TO THE NESTED PATHS BELOW IT)
+        """
+        if max_children == None:
+            return {}, {}
+        columns = self.schema.columns
+        fact_path = [c.path for c in columns if c.sort and len(c.nested_path) == 1][0]
+        nested_paths = set(tuple(c.nested_path) for c in columns if len(c.nested_path) > 1)
+        names = {relative_field(n[0], fact_path): n[0] for n in nested_paths}
+
+        limits = {}
+        if Math.is_integer(max_children):
+            for name, path in names.items():
+                limits[path] = (int(max_children), name)
+        else:
+            for rule in listwrap(max_children):
+                path = names.get(rule.path)
+                if path is None:
+                    Log.error("Expecting `extract.max_children` path {{path|quote}} to be one of {{names|json}}", path=rule.path, names=sorted(names.keys()))
+                if not Math.is_integer(rule.max) or int(rule.max) < 1:
+                    Log.error("Expecting `extract.max_children` of {{path|quote}} to be a positive integer", path=rule.path)
+                limits[path] = (int(rule.max), rule.path)
+
+        descendants = {}
+        for n in nested_paths:
+            for parent in n[1:-1]:
+                descendants.setdefault(parent, []).append(n[0])
+        return limits, {p: tuple(d) for p, d in descendants.items()}
+
+    def _ranges(self, db, data):
+        """
+        :param data: THE FACT ids OF THE BATCH
+        :return: LIST OF {"field", "min", "max"}, ONE FOR EACH extract.field (time AS unix)
+        """
+        fields = self._extract.field
+        # THE ids ARE THE LAST field; THE OTHERS COME FROM THE DATABASE
+        mins_maxs = []
+        if len(fields) > 1:
+            id = quote_column(fields.last())
+            sql = (
+                SQL_SELECT + sql_list(
+                    SQL("MIN") + sql_iso(quote_column(f)) + SQL(", MAX") + sql_iso(quote_column(f))
+                    for f in fields[:-1]
+                ) +
+                SQL_FROM + self.settings.snowflake.fact_table +
+                SQL_WHERE + id + " in " + sql_iso(sql_list(map(db.quote_value, data)))
+            )
+            row = list(db.query(sql, row_tuples=True))[0]
+            mins_maxs = [(row[2 * i], row[2 * i + 1]) for i in range(len(fields) - 1)]
+        mins_maxs.append((min(data), max(data)))
+
+        output = []
+        for f, t, (lo, hi) in zip(fields, self._extract.type, mins_maxs):
+            if t == "time":
+                lo, hi = Date(lo).unix, Date(hi).unix
+            output.append({"field": f, "min": lo, "max": hi})
+        return output
+
+
+def check_processes(database):
+    """
+    VERIFY WE DO NOT HAVE TOO MANY OTHER PROCESSES WORKING ON STUFF
+    (A LOCAL SNAPSHOT HAS NO OTHER PROCESSES)
+    """
+    with open_database(database) as db:
+        processes = None
+        if not isinstance(db, SqliteDB):
+            try:
+                processes = jx.filter(
+                    db.query("show processlist"),
+                    {"and": [
+                        {"neq": {"Command": "Sleep"}},
+                        {"neq": {"Info": "show processlist"}}
+                    ]}
+                )
+            except Exception as e:
+                Log.warning("no database", cause=e)
+
+        if processes:
+            if DEBUG:
+                Log.warning("Processes are running\n{{list|json}}", list=processes)
+            else:
+                Log.error("Processes are running\n{{list|json}}", list=processes)
 
 
 def main():
@@ -326,25 +904,46 @@ def main():
             constants.set(settings.constants)
             Log.start(settings.debug)
 
-            extractor = Extract(settings)
+            exporter = MetricsExporter(kwargs=settings.metrics) if settings.metrics else None
+            extractor = Extract(kwargs=settings)
+            if hasattr(signal, "SIGUSR2"):
+                # kill -USR2 <pid> TO PROFILE THE NEXT BATCH OF EVERY WORKER
+                signal.signal(signal.SIGUSR2, lambda signum, frame: extractor.profiler.request(settings.extract.threads))
 
-            def extract(please_stop):
-                with MySQL(**settings.snowflake.database) as db:
-                    with db.transaction():
-                        for kwargs in extractor.queue:
-                            if please_stop:
-                                break
-                            try:
-                                extractor.extract(db=db, please_stop=please_stop, **kwargs)
-                            except Exception as e:
-                                Log.warning("Could not extract", cause=e)
-                                extractor.queue.add(kwargs)
+            please_stop = Signal()
+            if settings.extract.autoscale:
+                from mysql_to_s3.autoscale import Autoscaler
 
-            for i in range(settings.extract.threads):
-                Thread.run("extract #"+text_type(i), extract)
+                # THE NUMBER OF WORKERS FOLLOWS THE BACKLOG, THE LATENCY AND THE MEMORY
+                Autoscaler(extractor, kwargs=settings.extract.autoscale).start(please_stop)
+            else:
+                def extract(please_stop):
+                    while not please_stop:
+                        try:
+                            with open_database(settings.snowflake.database) as db:
+                                with db.transaction():
+                                    while not please_stop:
+                                        batch = extractor.next_batch(please_stop)
+                                        if batch is THREAD_STOP:
+                                            return
+                                        if not extractor.work(db, batch, please_stop):
+                                            # THE CONNECTION MAY BE BROKEN, SO OPEN ANOTHER
+                                            break
+                        except Exception as e:
+                            Log.warning("Problem with connection", cause=e)
+                            (please_stop | Till(seconds=extractor.retries.backoff)).wait()
+
+                for i in range(settings.extract.threads):
+                    Thread.run("extract #"+text_type(i), extract)
 
-            please_stop = Signal()
             Thread.wait_for_shutdown_signal(please_stop=please_stop, allow_exit=True, wait_forever=False)
+            if extractor.manifest:
+                extractor.manifest.close()
+            if extractor.leases:
+                extractor.leases.close()
+            if exporter:
+                # THE LAST SNAPSHOT HAS ALL THE WORK
+                exporter.stop()
     except Exception as e:
         Log.warning("Problem with data extraction", e)
     finally:
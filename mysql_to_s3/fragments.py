@@ -0,0 +1,272 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from json.encoder import encode_basestring
+
+from mo_dots import split_field, relative_field, concat_field
+from mo_future import text_type
+from mo_json.encoder import fast_encode
+from pyLibrary.convert import scrub
+
+from mysql_to_s3.snowflake_schema import schema_tree
+from mysql_to_s3.streaming import Spool
+
+DEFAULT_SIZE = 10000  # NUMBER OF ENCODED OBJECTS KEPT FOR A BATCH
+
+
+class FragmentCache(object):
+    """
+    THE JSON OF THE MANY-TO-ONE OBJECTS OF ONE BATCH
+
+    THE SAME repository, machine_platform, ... SHOW UP IN THOUSANDS OF
+    DOCUMENTS; THEY ARE ENCODED ONCE AND SPLICED INTO THE REST. ONCE size
+    OBJECTS ARE KEPT, NO MORE ARE ADDED. MAKE A NEW ONE FOR EACH BATCH
+    """
+    __slots__ = ["size", "fragments", "hits", "misses"]
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+
+def object_ids(columns):
+    """
+    :param columns: SnowflakeSchema.columns
+    :return: MAP FROM PATH (TUPLE OF STEPS, AS IN schema_tree(lower=False))
+             OF AN INNER OBJECT TO THE NAMES OF ITS ID PROPERTIES
+    """
+    fact_path = [c.path for c in columns if c.sort and len(c.nested_path) == 1][0]
+    found = {}
+    for c in columns:
+        if c.put == None or not c.column.is_id:
+            continue
+        steps = split_field(relative_field(concat_field(c.nested_path[0], c.put), fact_path))
+        path = tuple(steps[:-1])
+        if not path:
+            continue  # THE FACT ITSELF
+        alias, names = found.setdefault(path, (c.table_alias, []))
+        if alias != c.table_alias:
+            found[path] = (None, names)  # MORE THAN ONE TABLE, NO IDENTITY
+            continue
+        names.append(steps[-1])
+    return {path: tuple(sorted(names)) for path, (alias, names) in found.items() if alias}
+
+
+def identity(node, path, ids):
+    """
+    :param node: schema_tree() NODE OF AN INNER OBJECT
+    :param path: TUPLE OF STEPS TO node
+    :param ids: FROM object_ids()
+    :return: FUNCTION FROM OBJECT TO ITS CACHE KEY (None FOR NO KEY), OR None IF
+             THE OBJECT CAN NOT BE CACHED (IT HAS NESTED DOCUMENTS, WHICH CHANGE WITH THE FACT)
+    """
+    if _has_nested(node):
+        return None
+    names = ids.get(path)
+    if names:
+        # (path, id)
+        def id_key(value):
+            key = (path,) + tuple(value.get(n) for n in names)
+            if None in key:
+                return None
+            return key
+        return id_key
+
+    # NO id IN THE DOCUMENT (eg show_foreign_keys=false); THE VALUES ARE THE IDENTITY
+    values = _values(node)
+    return lambda value: (path, values(value))
+
+
+def _has_nested(node):
+    return any(
+        isinstance(child, dict) and (child["repeated"] or _has_nested(child))
+        for child in node["fields"].values()
+    )
+
+
+def _values(node):
+    """
+    :return: FUNCTION FROM OBJECT TO A TUPLE OF ALL ITS VALUES
+    """
+    children = [
+        (name, _values(child) if isinstance(child, dict) else None)
+        for name, child in sorted(node["fields"].items())
+    ]
+
+    def values(value):
+        output = []
+        for name, child in children:
+            v = value.get(name)
+            if child is not None and v is not None:
+                v = child(v)
+            output.append(v)
+        return tuple(output)
+
+    return values
+
+
+def memoize(encode_object, identity):
+    """
+    :param encode_object: FUNCTION(value, cache) RETURNING THE JSON OF AN OBJECT
+    :param identity: FROM identity()
+    :return: SAME, BUT ENCODE ONLY THE FIRST OF EACH OBJECT IN A BATCH
+    """
+    def encode(value, cache):
+        if value is None or not cache.size:
+            return encode_object(value, cache)
+        key = identity(value)
+        if key is None:
+            return encode_object(value, cache)
+        fragments = cache.fragments
+        try:
+            output = fragments.get(key)
+        except TypeError:
+            # NOT HASHABLE
+            return encode_object(value, cache)
+        if output is not None:
+            cache.hits += 1
+            return output
+        cache.misses += 1
+        output = encode_object(value, cache)
+        if output is not None and len(fragments) < cache.size:
+            fragments[key] = output
+        return output
+
+    return encode
+
+
+class JsonEncoder(object):
+    """
+    WRITE THE SAME JSON AS convert.value2json({fact_table: elasticsearch.scrub(doc), "etl": ...}),
+    BUT WITH THE etl.source AND THE MANY-TO-ONE OBJECTS ENCODED ONCE PER BATCH
+    """
+
+    def __init__(self, columns, fact_table):
+        """
+        :param columns: SnowflakeSchema.columns
+        :param fact_table: NAME OF THE PROPERTY THE DOCUMENT GOES IN
+        """
+        self.fact_table = fact_table
+        self.fact_name = encode_basestring(fact_table) + ":"
+        self.nested = {}  # PATH OF A NESTED LIST TO THE FUNCTION ENCODING ONE ELEMENT
+        self.encode_doc = _compile(schema_tree(columns, lower=False), (), object_ids(columns), self.nested)
+
+    def encode_etl(self, etl):
+        """
+        :param etl: THE etl.source, SAME FOR ALL DOCUMENTS OF A BATCH
+        :return: JSON FOR etl.source
+        """
+        return fast_encode(etl)
+
+    def spool(self, path, cache):
+        """
+        :param path: TUPLE OF STEPS FROM THE FACT TO A NESTED LIST
+        :param cache: FragmentCache FOR THIS BATCH
+        :return: Spool FOR THE ELEMENTS OF THAT LIST
+        """
+        return Spool(self.nested[path], _list, cache)
+
+    def encode(self, doc, id, source, timestamp, cache, truncated=None):
+        """
+        :param doc: THE Record FROM construct_docs()
+        :param id: etl.id
+        :param source: etl.source, FROM encode_etl()
+        :param timestamp: etl.timestamp
+        :param cache: FragmentCache FOR THIS BATCH
+        :param truncated: MAP FROM NESTED PATH TO NUMBER OF CHILDREN LEFT OUT (etl.truncated)
+        :return: ONE LINE OF JSON
+        """
+        etl = '"etl":{"id":' + text_type(id) + ',"source":' + source + ',"timestamp":' + fast_encode(timestamp)
+        if truncated:
+            etl += ',"truncated":' + fast_encode(truncated)
+        etl += "}"
+        fact = self.encode_doc(doc, cache)
+        if fact is None:
+            return "{" + etl + "}"
+        # PROPERTIES IN ORDER, AS value2json() DOES
+        if self.fact_table < "etl":
+            return "{" + self.fact_name + fact + "," + etl + "}"
+        return "{" + etl + "," + self.fact_name + fact + "}"
+
+
+def _compile(node, path, ids, nested):
+    """
+    :param nested: FILLED WITH THE PATH OF EACH NESTED LIST, AND THE FUNCTION ENCODING ONE OF ITS ELEMENTS
+    :return: FUNCTION FROM (VALUE, FragmentCache) TO JSON (OR None WHEN scrub() WOULD REMOVE IT)
+    """
+    if not isinstance(node, dict):
+        return _value
+
+    properties = sorted(
+        (name.lower(), encode_basestring(name.lower()) + ":", name, _compile(child, path + (name,), ids, nested))
+        for name, child in node["fields"].items()
+    )
+
+    def encode_object(value, cache):
+        if value is None:
+            return None
+        acc = []
+        for _, quoted, name, encode in properties:
+            v = value.get(name)
+            if v is None:
+                continue
+            v = encode(v, cache)
+            if v is None:
+                continue
+            acc.append(quoted + v)
+        if not acc:
+            return None
+        return "{" + ",".join(acc) + "}"
+
+    if node["repeated"]:
+        nested[path] = encode_object
+
+        def encode_nested(value, cache):
+            if value.__class__ is Spool:
+                # THE ELEMENTS ARE ALREADY ENCODED, splice() PUTS THEM HERE
+                return value.marker if value.count else None
+            if not isinstance(value, list):
+                return encode_object(value, cache)
+            acc = [e for e in (encode_object(v, cache) for v in value) if e is not None]
+            if not acc:
+                return None
+            elif len(acc) == 1:
+                # scrub() REPLACES A SINGLE-ELEMENT LIST WITH THE ELEMENT
+                return acc[0]
+            return "[" + ",".join(acc) + "]"
+        return encode_nested
+
+    key = identity(node, path, ids) if path else None
+    if key:
+        return memoize(encode_object, key)
+    return encode_object
+
+
+def _list(count):
+    # scrub() REPLACES A SINGLE-ELEMENT LIST WITH THE ELEMENT
+    if count == 1:
+        return "", ""
+    return "[", "]"
+
+
+def _value(value, cache):
+    value = scrub(value)
+    if value == None:
+        return None
+    output = fast_encode(value)
+    if output == "null":
+        return None
+    return output
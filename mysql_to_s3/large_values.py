@@ -0,0 +1,185 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from hashlib import sha256
+
+from mo_dots import coalesce, listwrap
+from mo_files import File
+from mo_future import text_type, binary_type
+from mo_kwargs import override
+from mo_logs import Log
+from mo_threads import Lock
+from mo_threads.metrics import METRICS
+
+# MySQL data_type OF THE COLUMNS THAT ARE CHECKED WITHOUT A RULE OF THEIR OWN
+LARGE_TYPES = ["text", "mediumtext", "longtext", "blob", "mediumblob", "longblob", "json"]
+# data_type WHOSE LENGTH IS IN BYTES; THE OTHERS COUNT CHARACTERS, UP TO 4 BYTES EACH IN utf8
+BINARY_TYPES = ["binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob"]
+ACTIONS = ["truncate", "offload", "keep"]
+MAX_REMEMBERED = 100000  # NUMBER OF OFFLOADED HASHES REMEMBERED, SO THEY ARE NOT SENT AGAIN
+
+TRUNCATED = METRICS.counter("mysql_to_s3_large_values_truncated_total", "Values cut to the size limit")
+OFFLOADED = METRICS.counter("mysql_to_s3_large_values_offloaded_total", "Values replaced with the address of a side object")
+OFFLOADED_BYTES = METRICS.counter("mysql_to_s3_large_values_offloaded_bytes_total", "Bytes written to new side objects")
+
+
+class LargeValues(object):
+    """
+    KEEP THE HUGE VALUES (LOG SNIPPETS, JSON BLOBS) OUT OF THE DOCUMENTS
+
+    A VALUE OVER size BYTES IS EITHER TRUNCATED, OR WRITTEN TO A SIDE OBJECT
+    NAMED BY THE sha256 OF ITS CONTENT, AND REPLACED BY THE ADDRESS OF THAT
+    OBJECT (s3://bucket/large/<sha256>, OR file:///.../<sha256>). IDENTICAL
+    VALUES, IN ANY BATCH, SHARE ONE SIDE OBJECT
+    """
+
+    @override
+    def __init__(
+        self,
+        size=65536,
+        action="truncate",
+        types=LARGE_TYPES,
+        columns=None,
+        prefix="large/",
+        directory=None,
+        bucket=None,
+        kwargs=None
+    ):
+        """
+        :param size: BYTES ALLOWED IN A VALUE
+        :param action: WHAT TO DO WITH A BIG VALUE IN A COLUMN OF ONE OF THE types: "truncate" OR "offload"
+        :param types: MySQL data_type OF THE COLUMNS TO CHECK
+        :param columns: LIST OF {"name": <table>.<column>, "action", "size"} RULES; "keep" LEAVES THE COLUMN ALONE
+        :param prefix: KEY PREFIX OF THE SIDE OBJECTS IN THE bucket
+        :param directory: WHERE THE SIDE OBJECTS GO WHEN THERE IS NO bucket
+        :param bucket: THE s3.Bucket OF THE DESTINATION
+        """
+        self.size = size
+        self.action = action
+        self.types = set(types or [])
+        self.columns = {r.name: r for r in listwrap(columns)}
+        self.prefix = prefix
+        self.bucket = bucket
+        self.directory = File(directory) if directory else None
+        for name, a in [("large_values", action)] + [(r.name, r.action) for r in listwrap(columns)]:
+            if a not in ACTIONS:
+                Log.error("Expecting action of {{name|quote}} to be one of {{actions}}", name=name, actions=ACTIONS)
+            if a == "offload" and not bucket and not directory:
+                Log.error("Expecting a `directory` to offload large values to")
+        self.locker = Lock("large values")
+        self.written = set()
+
+    def rules(self, columns):
+        """
+        :param columns: SnowflakeSchema.columns
+        :return: LIST OF (INDEX INTO THE ROW, FUNCTION FROM VALUE TO SMALLER VALUE)
+        """
+        output = []
+        for i, c in enumerate(columns):
+            if c.put == None or c.column.is_id:
+                continue
+            name = c.column.table.name + "." + c.column.column.name
+            rule = self.columns.get(name)
+            if rule:
+                action = rule.action
+                size = coalesce(rule.size, self.size)
+            else:
+                # THE DECLARED LENGTH DECIDES, WHEN THERE IS ONE
+                max_bytes = _max_bytes(c.column.column)
+                if max_bytes is None:
+                    if c.column.column.type not in self.types:
+                        continue
+                elif max_bytes <= self.size:
+                    continue
+                action = self.action
+                size = self.size
+
+            if action == "truncate":
+                output.append((i, _truncate(size)))
+            elif action == "offload":
+                output.append((i, self._offload(size)))
+
+        known = {c.column.table.name + "." + c.column.column.name for c in columns if c.put != None}
+        for name in self.columns:
+            if name not in known:
+                Log.warning("Large value rule for {{name|quote}} matches no column in the documents", name=name)
+        return output
+
+    def _offload(self, size):
+        def offload(value):
+            data = _bytes(value)
+            if data is None or len(data) <= size:
+                return value
+            name = sha256(data).hexdigest()
+            with self.locker:
+                done = name in self.written
+            if not done:
+                self._write(name, data)
+                with self.locker:
+                    if len(self.written) < MAX_REMEMBERED:
+                        self.written.add(name)
+                OFFLOADED_BYTES.inc(len(data))
+            OFFLOADED.inc()
+            return self._address(name)
+        return offload
+
+    def _write(self, name, data):
+        if self.bucket:
+            storage = self.bucket.new_key(self.prefix + name)
+            storage.set_contents_from_string(data)
+            if self.bucket.settings.public:
+                storage.set_acl('public-read')
+        else:
+            File.new_instance(self.directory, name).write_bytes(data)
+
+    def _address(self, name):
+        if self.bucket:
+            return "s3://" + self.bucket.name + "/" + self.prefix + name
+        return "file://" + File.new_instance(self.directory, name).abspath
+
+
+def _max_bytes(column):
+    """
+    :param column: THE {"name", "type", "length"} OF A DATABASE COLUMN
+    :return: MOST BYTES A VALUE OF THE COLUMN CAN HAVE, OR None IF NOT DECLARED
+    """
+    if column.length == None:
+        return None
+    if column.type in BINARY_TYPES:
+        return column.length
+    return column.length * 4
+
+
+def _truncate(size):
+    def truncate(value):
+        data = _bytes(value)
+        if data is None or len(data) <= size:
+            return value
+        TRUNCATED.inc()
+        if isinstance(value, text_type):
+            # DO NOT LEAVE HALF A CHARACTER
+            return data[:size].decode("utf8", "ignore")
+        return data[:size]
+    return truncate
+
+
+def _bytes(value):
+    """
+    :return: THE BYTES OF A TEXT OR BLOB VALUE, None FOR ANYTHING ELSE
+    """
+    if isinstance(value, text_type):
+        return value.encode("utf8")
+    elif isinstance(value, (binary_type, bytearray)):
+        return bytes(value)
+    return None
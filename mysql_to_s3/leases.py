@@ -0,0 +1,287 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from contextlib import closing
+
+from mo_dots import coalesce, wrap
+from mo_future import text_type
+from mo_kwargs import override
+from mo_logs import Log, machine_metadata
+from mo_math.randoms import Random
+from mo_threads import Lock, Thread, Till
+from mo_threads.threads import MAIN_THREAD
+from mo_times import Date, Duration
+from pyLibrary import convert
+from pyLibrary.sql import SQL, SQL_SELECT, SQL_FROM, SQL_WHERE, SQL_ORDERBY, SQL_LIMIT, SQL_AND, sql_list, sql_iso
+from pyLibrary.sql.mysql import quote_column
+
+from mysql_to_s3.sqlite_db import SqliteDB
+
+DEBUG = False
+LISTER = "__lister__"  # THE ROW HOLDING THE LEASE TO LIST NEW BATCHES
+
+
+class Leases(object):
+    """
+    A SHARED TABLE OF BATCHES, SO MANY EXTRACT PROCESSES (ON MANY MACHINES)
+    CAN WORK ON THE SAME CONFIG WITHOUT DUPLICATING WORK
+
+    ONE PROCESS HOLDS THE LISTER LEASE, AND ADDS BATCHES; ALL PROCESSES LEASE
+    BATCHES TO EXTRACT. LEASES ARE KEPT ALIVE WITH A HEARTBEAT; THE BATCHES OF
+    A DEAD PROCESS ARE RECLAIMED WHEN THEIR LEASE EXPIRES, BY A PROCESS THAT
+    IS STILL WAITING FOR THEM TO BE DONE
+
+    THE HEARTBEAT IS NOT WORK THAT KEEPS THE PROCESS ALIVE; CALL close() WHEN
+    THE WORKERS ARE DONE
+    """
+
+    @override
+    def __init__(self, database, table="extract_lease", timeout="10minute", heartbeat=None, kwargs=None):
+        from mysql_to_s3.snowflake_schema import open_database
+
+        self.settings = kwargs
+        self.table = quote_column(table, database.schema)
+        self.timeout = Duration(timeout).seconds
+        self.heartbeat = coalesce(Duration(heartbeat).seconds if heartbeat else None, self.timeout / 3)
+        self.owner = machine_metadata.name + "-" + text_type(machine_metadata.pid) + "-" + Random.hex(4)
+        self.locker = Lock("leases")
+        self.held = set()  # ordinals OF THE BATCHES THIS PROCESS IS WORKING ON
+        self.db = open_database(database)
+        self._setup()
+        self.heartbeat_thread = Thread.run("lease heartbeat", self._heartbeat, parent_thread=MAIN_THREAD)
+
+    def _setup(self):
+        big_text = "TEXT" if isinstance(self.db, SqliteDB) else "MEDIUMTEXT"
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS " + self.table + sql_iso(sql_list([
+                SQL("ordinal BIGINT PRIMARY KEY"),
+                SQL("batch VARCHAR(200) NOT NULL UNIQUE"),
+                SQL("first_value " + big_text),
+                SQL("data " + big_text),
+                SQL("owner VARCHAR(200)"),
+                SQL("expires DOUBLE NOT NULL"),
+                SQL("done INTEGER NOT NULL")
+            ]))
+        )
+        self._insert_ignore([{"ordinal": 0, "batch": LISTER, "expires": 0, "done": 0}])
+
+    def _execute(self, sql):
+        """
+        :return: (ROWS, ROWCOUNT)
+        """
+        with self.locker:
+            if DEBUG:
+                Log.note("lease sql:\n{{sql|indent}}", sql=sql)
+            try:
+                with closing(self.db.db.cursor()) as cursor:
+                    cursor.execute(sql)
+                    rows = list(cursor) if cursor.description else []
+                    rowcount = cursor.rowcount
+                self.db.db.commit()
+                return rows, rowcount
+            except Exception as e:
+                self.db.db.rollback()
+                Log.error("Problem with lease table", cause=e)
+
+    def _insert_ignore(self, records):
+        if not records:
+            return
+        columns = list(records[0].keys())
+        verb = "INSERT OR IGNORE INTO " if isinstance(self.db, SqliteDB) else "INSERT IGNORE INTO "
+        self._execute(
+            verb + self.table + sql_iso(sql_list(quote_column(c) for c in columns)) +
+            " VALUES " + sql_list(
+                sql_iso(sql_list(self.db.quote_value(r[c]) for c in columns))
+                for r in records
+            )
+        )
+
+    def _update(self, set_, where):
+        _, rowcount = self._execute(
+            "UPDATE " + self.table +
+            " SET " + sql_list(quote_column(k) + "=" + self.db.quote_value(v) for k, v in set_.items()) +
+            SQL_WHERE + SQL_AND.join(where)
+        )
+        return rowcount
+
+    def claim_lister(self):
+        """
+        :return: True IF THIS PROCESS IS (NOW) THE LISTER
+        """
+        now = Date.now().unix
+        rowcount = self._update(
+            {"owner": self.owner, "expires": now + self.timeout, "done": 0},
+            [
+                SQL("ordinal=0"),
+                sql_iso(SQL("expires<") + self.db.quote_value(now) + " OR owner=" + self.db.quote_value(self.owner))
+            ]
+        )
+        if rowcount == 1:
+            with self.locker:
+                self.held.add(0)
+            return True
+        return False
+
+    def lister_done(self):
+        """
+        THE LISTER HAS CAUGHT UP; RELEASE THE LISTER LEASE
+        """
+        self._update({"done": 1, "expires": 0}, [SQL("ordinal=0"), "owner=" + self.db.quote_value(self.owner)])
+        with self.locker:
+            self.held.discard(0)
+
+    def is_listing(self):
+        """
+        :return: True IF SOME LIVE PROCESS IS STILL LISTING BATCHES
+        """
+        rows, _ = self._execute(SQL_SELECT + "expires, done" + SQL_FROM + self.table + SQL_WHERE + "ordinal=0")
+        expires, done = rows[0]
+        return not done and expires >= Date.now().unix
+
+    def unfinished(self):
+        """
+        :return: NUMBER OF BATCHES LISTED, AND NOT DONE (MAYBE LEASED BY ANOTHER PROCESS)
+        """
+        rows, _ = self._execute(SQL_SELECT + "COUNT(1)" + SQL_FROM + self.table + SQL_WHERE + "ordinal>0 AND done=0")
+        return rows[0][0]
+
+    def last_listed(self):
+        """
+        :return: (start_point, first_value) OF THE LAST BATCH LISTED, OR None
+        """
+        rows, _ = self._execute(
+            SQL_SELECT + "batch, first_value" + SQL_FROM + self.table + SQL_WHERE + "ordinal>0" +
+            SQL_ORDERBY + "ordinal DESC" + SQL_LIMIT + "1"
+        )
+        if not rows:
+            return None
+        batch, first_value = rows[0]
+        return tuple(convert.json2value(batch)), convert.json2value(first_value)
+
+    def add(self, pending):
+        """
+        :param pending: LIST OF {"start_point", "first_value", "data"} BATCHES, IN ORDER
+        """
+        if not pending:
+            return
+        rows, _ = self._execute(SQL_SELECT + "MAX(ordinal)" + SQL_FROM + self.table)
+        ordinal = coalesce(rows[0][0], 0)
+        records = []
+        for p in pending:
+            ordinal += 1
+            records.append({
+                "ordinal": ordinal,
+                "batch": convert.value2json(p["start_point"]),
+                "first_value": convert.value2json(p["first_value"]),
+                "data": convert.value2json(p["data"]),
+                "expires": 0,
+                "done": 0
+            })
+        self._insert_ignore(records)
+
+    def claim(self):
+        """
+        :return: A BATCH {"start_point", "first_value", "data"} NOW LEASED BY THIS PROCESS, OR None
+        """
+        now = Date.now().unix
+        rows, _ = self._execute(
+            SQL_SELECT + "ordinal" + SQL_FROM + self.table +
+            SQL_WHERE + "ordinal>0 AND done=0 AND expires<" + self.db.quote_value(now) +
+            SQL_ORDERBY + "ordinal" + SQL_LIMIT + "10"
+        )
+        for ordinal, in rows:
+            rowcount = self._update(
+                {"owner": self.owner, "expires": now + self.timeout},
+                [
+                    "ordinal=" + self.db.quote_value(ordinal),
+                    SQL("done=0"),
+                    "expires<" + self.db.quote_value(now)
+                ]
+            )
+            if rowcount != 1:
+                continue  # ANOTHER PROCESS GOT IT FIRST
+            with self.locker:
+                self.held.add(ordinal)
+            details, _ = self._execute(
+                SQL_SELECT + "batch, first_value, data" + SQL_FROM + self.table +
+                SQL_WHERE + "ordinal=" + self.db.quote_value(ordinal)
+            )
+            batch, first_value, data = details[0]
+            return wrap({
+                "start_point": tuple(convert.json2value(batch)),
+                "first_value": convert.json2value(first_value),
+                "data": convert.json2value(data)
+            })
+        return None
+
+    def done(self, start_point):
+        """
+        MARK BATCH AS EXTRACTED
+        :return: (start_point, first_value) OF THE LAST BATCH WITH ALL PRIOR BATCHES DONE
+        """
+        ordinal = self._ordinal(start_point)
+        self._update({"done": 1}, ["ordinal=" + self.db.quote_value(ordinal)])
+        with self.locker:
+            self.held.discard(ordinal)
+
+        # THE CHECKPOINT IS THE LAST DONE BATCH BEFORE THE FIRST NOT-DONE BATCH
+        rows, _ = self._execute(
+            SQL_SELECT + "MIN(ordinal)" + SQL_FROM + self.table + SQL_WHERE + "ordinal>0 AND done=0"
+        )
+        first_pending = rows[0][0]
+        rows, _ = self._execute(
+            SQL_SELECT + "ordinal, batch, first_value" + SQL_FROM + self.table +
+            SQL_WHERE + "ordinal>0 AND done=1" +
+            ((" AND ordinal<" + self.db.quote_value(first_pending)) if first_pending is not None else "") +
+            SQL_ORDERBY + "ordinal DESC" + SQL_LIMIT + "1"
+        )
+        if not rows:
+            return None
+        checkpoint, batch, first_value = rows[0]
+
+        # FORGET THE BATCHES BEFORE THE CHECKPOINT
+        self._execute("DELETE" + SQL_FROM + self.table + SQL_WHERE + "ordinal>0 AND done=1 AND ordinal<" + self.db.quote_value(checkpoint))
+        return tuple(convert.json2value(batch)), convert.json2value(first_value)
+
+    def _ordinal(self, start_point):
+        rows, _ = self._execute(
+            SQL_SELECT + "ordinal" + SQL_FROM + self.table +
+            SQL_WHERE + "batch=" + self.db.quote_value(convert.value2json(start_point))
+        )
+        if not rows:
+            Log.error("Batch {{batch}} is not in the lease table", batch=start_point)
+        return rows[0][0]
+
+    def _heartbeat(self, please_stop):
+        while not please_stop:
+            (Till(seconds=self.heartbeat) | please_stop).wait()
+            with self.locker:
+                held = list(self.held)
+            if not held:
+                continue
+            try:
+                self._update(
+                    {"expires": Date.now().unix + self.timeout},
+                    [
+                        "owner=" + self.db.quote_value(self.owner),
+                        "ordinal IN " + sql_iso(sql_list(self.db.quote_value(o) for o in held))
+                    ]
+                )
+            except Exception as e:
+                Log.warning("Could not renew leases", cause=e)
+
+    def close(self):
+        self.heartbeat_thread.stop()
+        self.heartbeat_thread.join()
+        self.db.close()
@@ -0,0 +1,271 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import base64
+from bisect import bisect_left
+from hashlib import sha1
+
+from mo_dots import wrap, coalesce
+from mo_files import File
+from mo_future import text_type, long
+from mo_json import value2json, json2value
+from mo_kwargs import override
+from mo_logs import Log, machine_metadata
+from mo_threads import Lock, Thread, Till
+from mo_times import Date, Duration
+
+BLOOM_BITS_PER_ID = 10  # ABOUT 1% FALSE POSITIVES
+BLOOM_HASHES = 7
+
+
+class Manifest(object):
+    """
+    ONE ENTRY FOR EACH BATCH WRITTEN: ITS KEY, THE min/max OF EACH extract.field,
+    THE NUMBER OF DOCUMENTS, THE BYTES, AND THE SET OF FACT ids
+
+    ENTRIES ARE ROLLED UP INTO ONE OBJECT PER DAY (AND PER PROCESS, SO
+    PROCESSES SHARING A LEASE TABLE DO NOT OVERWRITE EACH OTHER):
+
+        <prefix><YYYY-MM-DD>/<machine>-<pid>
+
+    SO "WHERE IS FACT 123" AND "WHAT IS THE LAST BATCH" ARE A FEW SMALL
+    GETS, NOT A LISTING OF THE WHOLE BUCKET. THE OBJECTS ARE WRITTEN EVERY
+    interval, AND ON close()
+    """
+
+    @override
+    def __init__(self, bucket=None, directory=None, prefix="manifest/", interval="minute", kwargs=None):
+        """
+        :param bucket: s3.Bucket TO KEEP THE MANIFEST IN
+        :param directory: WHERE THE MANIFEST GOES WHEN THERE IS NO bucket
+        :param prefix: KEY PREFIX OF THE MANIFEST OBJECTS IN THE bucket
+        :param interval: TIME BETWEEN WRITES OF THE CHANGED DAYS
+        """
+        if not bucket and not directory:
+            Log.error("Expecting a `bucket` or a `directory` for the manifest")
+        self.bucket = bucket
+        self.directory = File(directory) if directory else None
+        self.prefix = prefix
+        self.interval = Duration(interval).seconds
+        self.writer = machine_metadata.name + "-" + text_type(machine_metadata.pid)
+        self.locker = Lock("manifest")
+        self.days = {}  # MAP FROM DAY TO ENTRIES ADDED BY THIS PROCESS
+        self.dirty = set()
+        self.flusher = None
+
+    def add(self, key, start_point, first_value, ranges, count, num_bytes, ids):
+        """
+        :param key: NAME OF THE OBJECT WRITTEN
+        :param start_point: KEY OF THE BATCH
+        :param first_value: first_value OF THE BATCH (TO CONTINUE FROM, LIKE THE last FILE)
+        :param ranges: LIST OF {"field", "min", "max"}, ONE FOR EACH extract.field
+        :param count: NUMBER OF DOCUMENTS
+        :param num_bytes: SIZE OF THE OBJECT WRITTEN
+        :param ids: THE FACT ids IN THE BATCH
+        """
+        now = Date.now()
+        entry = {
+            "key": key,
+            "start_point": list(start_point),
+            "first_value": first_value,
+            "ranges": ranges,
+            "count": count,
+            "bytes": num_bytes,
+            "ids": pack_ids(ids),
+            "timestamp": now.unix
+        }
+        day = now.format("%Y-%m-%d")
+        with self.locker:
+            self.days.setdefault(day, []).append(entry)
+            self.dirty.add(day)
+            if not self.flusher:
+                self.flusher = Thread.run("write manifest", self._flush_daemon)
+
+    def _flush_daemon(self, please_stop):
+        while not please_stop:
+            (Till(seconds=self.interval) | please_stop).wait()
+            try:
+                self.flush()
+            except Exception as e:
+                Log.warning("Can not write manifest", cause=e)
+
+    def flush(self):
+        today = Date.now().format("%Y-%m-%d")
+        with self.locker:
+            todo = [(day, list(self.days[day])) for day in sorted(self.dirty)]
+            self.dirty = set()
+            # ONLY TODAY GETS MORE ENTRIES
+            for day in list(self.days.keys()):
+                if day != today:
+                    del self.days[day]
+        for day, entries in todo:
+            self._write(day + "/" + self.writer, value2json(entries))
+
+    def close(self):
+        if self.flusher:
+            self.flusher.stop()
+            self.flusher.join()
+        self.flush()
+
+    def all_days(self):
+        """
+        :return: SORTED LIST OF THE DAYS WITH ENTRIES
+        """
+        if self.bucket:
+            return sorted(
+                p.name[len(self.prefix):].rstrip("/")
+                for p in self.bucket.bucket.list(prefix=self.prefix, delimiter="/")
+            )
+        if not self.directory.exists:
+            return []
+        return sorted(c.name for c in self.directory.children if c.is_directory())
+
+    def entries(self, day):
+        """
+        :return: ALL ENTRIES OF THE GIVEN DAY, FROM ALL PROCESSES
+        """
+        output = []
+        if self.bucket:
+            from pyLibrary.aws.s3 import strip_extension
+
+            names = set(
+                strip_extension(k.key)
+                for k in self.bucket.bucket.list(prefix=self.prefix + day + "/")
+            )
+            for name in sorted(names):
+                output.extend(json2value(self.bucket.read(name)))
+        else:
+            folder = File.new_instance(self.directory, day)
+            if folder.exists:
+                for f in sorted(folder.children, key=lambda f: f.abspath):
+                    output.extend(json2value(f.read()))
+        return wrap(output)
+
+    def last(self):
+        """
+        :return: ENTRY OF THE GREATEST start_point IN THE LATEST DAY, OR None
+        """
+        for day in reversed(self.all_days()):
+            entries = self.entries(day)
+            if entries:
+                return wrap(max(entries, key=lambda e: tuple(e.start_point)))
+        return None
+
+    def find(self, id, days=None):
+        """
+        :param id: A FACT id
+        :param days: DAYS TO LOOK IN (DEFAULT ALL)
+        :return: THE ENTRIES OF THE BATCHES WITH THAT id
+        """
+        output = []
+        for day in coalesce(days, self.all_days()):
+            for e in self.entries(day):
+                r = e.ranges.last()
+                if r.min <= id <= r.max and ids_contain(e.ids, id):
+                    output.append(e)
+        return wrap(output)
+
+    def _write(self, name, content):
+        if self.bucket:
+            self.bucket.write(self.prefix + name, content)
+        else:
+            File.new_instance(self.directory, name + ".json").write(content)
+
+
+def pack_ids(ids):
+    """
+    :return: A COMPACT SET OF THE ids: THE SORTED INTEGERS AS base64 VARINT
+             DELTAS, OR A BLOOM FILTER WHEN THEY ARE NOT ALL INTEGERS
+    """
+    ids = list(ids)
+    if all(isinstance(i, (int, long)) and not isinstance(i, bool) for i in ids):
+        acc = bytearray()
+        prev = None
+        for i in sorted(set(ids)):
+            _varint(acc, i - prev if prev is not None else _zigzag(i))
+            prev = i
+        return {"packed": base64.b64encode(bytes(acc)).decode("ascii")}
+
+    num_bits = max(64, len(ids) * BLOOM_BITS_PER_ID)
+    bits = bytearray((num_bits + 7) // 8)
+    for i in ids:
+        for b in _bloom_bits(i, num_bits):
+            bits[b >> 3] |= 1 << (b & 7)
+    return {"bloom": base64.b64encode(bytes(bits)).decode("ascii"), "bits": num_bits}
+
+
+def unpack_ids(packed):
+    """
+    :return: SORTED LIST OF THE ids IN A {"packed"} SET
+    """
+    data = bytearray(base64.b64decode(packed))
+    output = []
+    value = shift = 0
+    for b in data:
+        value |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        if output:
+            output.append(output[-1] + value)
+        else:
+            output.append(_unzigzag(value))
+        value = shift = 0
+    return output
+
+
+def ids_contain(ids, id):
+    """
+    :param ids: FROM pack_ids()
+    :return: True IF id IS IN THE SET (A BLOOM FILTER MAY SAY True WHEN IT IS NOT)
+    """
+    if ids.packed != None:
+        if not isinstance(id, (int, long)):
+            return False
+        values = unpack_ids(ids.packed)
+        i = bisect_left(values, id)
+        return i < len(values) and values[i] == id
+    bits = bytearray(base64.b64decode(ids.bloom))
+    return all(bits[b >> 3] & (1 << (b & 7)) for b in _bloom_bits(id, ids.bits))
+
+
+def _bloom_bits(value, num_bits):
+    digest = bytearray(sha1(value2json(value).encode("utf8")).digest())
+    h1 = _int(digest[0:8])
+    h2 = _int(digest[8:16]) | 1
+    return [(h1 + k * h2) % num_bits for k in range(BLOOM_HASHES)]
+
+
+def _int(data):
+    output = 0
+    for b in data:
+        output = (output << 8) | b
+    return output
+
+
+def _varint(acc, value):
+    while value > 0x7f:
+        acc.append((value & 0x7f) | 0x80)
+        value >>= 7
+    acc.append(value)
+
+
+def _zigzag(value):
+    # THE FIRST id MAY BE NEGATIVE
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
@@ -0,0 +1,160 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from collections import Mapping
+
+from mo_dots import listwrap, FlatList
+from mo_future import text_type, binary_type
+from mo_kwargs import override
+from mo_logs import Log
+from mo_times import Date
+from pyLibrary import convert
+
+from mysql_to_s3.snowflake_schema import schema_tree
+
+# MySQL data_type TO THE (PHYSICAL) PARQUET TYPE; ANYTHING ELSE IS A STRING
+# TIME IS IN UNIX SECONDS, LIKE THE JSON DOCUMENTS
+TYPES = {
+    "bigint": "int64",
+    "bit": "int64",
+    "int": "int64",
+    "integer": "int64",
+    "mediumint": "int64",
+    "smallint": "int64",
+    "tinyint": "int64",
+    "decimal": "float64",
+    "double": "float64",
+    "float": "float64",
+    "date": "float64",
+    "datetime": "float64",
+    "time": "float64",
+    "timestamp": "float64",
+    "year": "int64",
+    "binary": "binary",
+    "blob": "binary",
+    "longblob": "binary",
+    "mediumblob": "binary",
+    "tinyblob": "binary",
+    "varbinary": "binary"
+}
+
+
+class ParquetSink(object):
+    """
+    WRITE A BATCH OF DOCUMENTS AS A PARQUET FILE, WITH THE NESTED SCHEMA OF
+    THE SNOWFLAKE: STRUCTS FOR INNER OBJECTS, LISTS FOR THE NESTED DOCUMENTS
+    """
+
+    @override
+    def __init__(self, columns, fact_table, row_group_size=10000, dictionary=True, compression="snappy", kwargs=None):
+        """
+        :param columns: SnowflakeSchema.columns
+        :param fact_table: NAME OF THE TOP PROPERTY HOLDING THE DOCUMENT
+        :param row_group_size: NUMBER OF DOCUMENTS IN EACH ROW GROUP
+        :param dictionary: USE DICTIONARY ENCODING (GOOD FOR REPEATED DIMENSION STRINGS)
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except Exception as e:
+            Log.error("Expecting pyarrow to be installed to write parquet", cause=e)
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.row_group_size = row_group_size
+        self.dictionary = dictionary
+        self.compression = compression
+        self.schema = pyarrow.schema([
+            pyarrow.field(fact_table, _arrow_type(pyarrow, schema_tree(columns))),
+            pyarrow.field("etl", pyarrow.struct([
+                pyarrow.field("id", pyarrow.int64()),
+                pyarrow.field("source", pyarrow.string()),  # JSON, THE DEPTH VARIES
+                pyarrow.field("timestamp", pyarrow.float64())
+            ]))
+        ])
+
+    def write(self, lines, filename):
+        """
+        :param lines: THE JSON DOCUMENTS, ONE PER LINE
+        :param filename: THE PARQUET FILE TO WRITE
+        """
+        writer = self.pq.ParquetWriter(
+            filename,
+            self.schema,
+            use_dictionary=self.dictionary,
+            compression=self.compression
+        )
+        try:
+            rows = []
+            for line in lines:
+                row = convert.json2value(line)
+                row.etl.source = convert.value2json(row.etl.source)
+                rows.append(row)
+                if len(rows) >= self.row_group_size:
+                    self._write_rows(writer, rows)
+                    rows = []
+            if rows:
+                self._write_rows(writer, rows)
+        finally:
+            writer.close()
+
+    def _write_rows(self, writer, rows):
+        arrays = [
+            self.pa.array([_normalize(self.pa, r[f.name], f.type) for r in rows], type=f.type)
+            for f in self.schema
+        ]
+        writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+
+def _arrow_type(pa, node):
+    if not isinstance(node, dict):
+        return getattr(pa, TYPES.get(node, "string"))()
+    struct = pa.struct([
+        pa.field(name, _arrow_type(pa, child))
+        for name, child in sorted(node["fields"].items())
+    ])
+    if node["repeated"]:
+        return pa.list_(struct)
+    return struct
+
+
+def _normalize(pa, value, type_):
+    """
+    :return: value IN THE SHAPE pyarrow EXPECTS FOR type_
+    """
+    if value == None:
+        return None
+    elif isinstance(type_, pa.ListType):
+        # elasticsearch.scrub() REPLACES A SINGLE-ELEMENT LIST WITH THE ELEMENT
+        output = [_normalize(pa, v, type_.value_type) for v in listwrap(value)]
+        return output or None
+    elif isinstance(type_, pa.StructType):
+        if not isinstance(value, Mapping):
+            Log.error("Expecting an object, not {{value|json}}", value=value)
+        return {f.name: _normalize(pa, value.get(f.name), f.type) for f in type_}
+    elif type_ == pa.string():
+        if isinstance(value, (Mapping, list, FlatList)):
+            return convert.value2json(value)
+        return text_type(value)
+    elif type_ == pa.float64():
+        if isinstance(value, Date) or hasattr(value, "timetuple"):
+            return Date(value).unix
+        return float(value)
+    elif type_ == pa.int64():
+        return int(value)
+    elif type_ == pa.binary():
+        if isinstance(value, text_type):
+            return value.encode("utf8")
+        return binary_type(value)
+    return value
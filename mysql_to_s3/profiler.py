@@ -0,0 +1,224 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import sys
+from collections import defaultdict
+from time import sleep, time
+
+from mo_files import File
+from mo_future import text_type, get_ident
+from mo_kwargs import override
+from mo_logs import Log
+from mo_threads import Lock, Thread, Till
+from mo_threads.threads import MAIN_THREAD
+from mo_times import Duration
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MEMORY_TOP = 50  # NUMBER OF ALLOCATION SITES IN A MEMORY REPORT
+
+
+class BatchProfiler(object):
+    """
+    SAMPLE THE STACK OF THE WORKER WHILE IT EXTRACTS A BATCH, AND WRITE THE
+    SAMPLES AS COLLAPSED STACKS (ONE "frame;frame;frame count" PER LINE),
+    WHICH flamegraph.pl, speedscope AND FRIENDS UNDERSTAND
+
+    A BATCH IS PROFILED WHEN
+    * IT IS THE every'TH BATCH
+    * IT TAKES LONGER THAN slow (ONE SHARED WATCHER STARTS SAMPLING ONCE slow
+      HAS PASSED, SO FAST BATCHES ONLY COST A dict ENTRY; THE WATCHER RUNS
+      WHILE THERE ARE BATCHES TO WATCH, AND BELONGS TO NO WORKER)
+    * request() WAS CALLED (eg BY THE SIGUSR2 HANDLER) SINCE THE LAST ONE
+    """
+
+    @override
+    def __init__(self, directory, every=None, slow=None, interval=0.01, memory=False, kwargs=None):
+        """
+        :param directory: WHERE THE <start_point>.collapsed FILES ARE WRITTEN
+        :param every: PROFILE EVERY Nth BATCH
+        :param slow: PROFILE BATCHES THAT TAKE LONGER THAN THIS DURATION (OR SECONDS)
+        :param interval: SECONDS BETWEEN SAMPLES
+        :param memory: ALSO WRITE THE TOP ALLOCATIONS (<start_point>.memory.txt) WITH tracemalloc
+        """
+        self.directory = File(directory)
+        self.every = every
+        if slow and not isinstance(slow, (int, float)):
+            slow = Duration(slow).seconds
+        self.slow = slow
+        self.interval = interval
+        self.memory = memory
+        if memory and not tracemalloc:
+            Log.warning("tracemalloc is not available; no memory profiles will be written")
+            self.memory = False
+        self.locker = Lock("batch profiler")
+        self.count = 0
+        self.requested = 0
+        self.watching = set()  # slow BATCHES NOT SAMPLED YET
+        self.watcher = None
+
+    def request(self, num=1):
+        """
+        PROFILE THE NEXT num BATCHES
+        """
+        with self.locker:
+            self.requested += num
+
+    def batch(self, start_point):
+        """
+        :param start_point: KEY OF THE BATCH, USED TO NAME THE FILES
+        :return: CONTEXT MANAGER TO SURROUND THE BATCH WORK WITH
+        """
+        with self.locker:
+            self.count += 1
+            if self.every and self.count % self.every == 0:
+                delay = 0
+            elif self.requested:
+                self.requested -= 1
+                delay = 0
+            elif self.slow:
+                delay = self.slow
+            else:
+                return _NOTHING
+        name = ".".join(map(text_type, start_point)) or "batch"
+        return _Profile(self, name, delay)
+
+    def _watch(self, profile):
+        with self.locker:
+            self.watching.add(profile)
+            if not self.watcher:
+                # NOT A CHILD OF THIS WORKER, WHICH MAY BE RETIRED FIRST
+                self.watcher = Thread.run("watch for slow batches", self._watch_slow, parent_thread=MAIN_THREAD)
+
+    def _unwatch(self, profile):
+        """
+        :return: True IF THE BATCH WAS NEVER SAMPLED
+        """
+        with self.locker:
+            if profile in self.watching:
+                self.watching.remove(profile)
+                return True
+            return False
+
+    def _watch_slow(self, please_stop):
+        try:
+            while not please_stop:
+                now = time()
+                with self.locker:
+                    if not self.watching:
+                        # THE NEXT slow BATCH STARTS ANOTHER
+                        self.watcher = None
+                        return
+                    for profile in [p for p in self.watching if p.start + p.delay <= now]:
+                        self.watching.remove(profile)
+                        # NOT A CHILD OF THE WATCHER, WHICH MAY END FIRST
+                        profile.sampler = Thread.run("sample " + profile.name, profile._sample, profile.ident, parent_thread=MAIN_THREAD)
+                (Till(seconds=min(self.slow / 10, 1)) | please_stop).wait()
+        finally:
+            with self.locker:
+                if self.watcher is Thread.current():
+                    self.watcher = None
+
+
+class _Profile(object):
+
+    def __init__(self, profiler, name, delay):
+        self.profiler = profiler
+        self.name = name
+        self.delay = delay
+        self.samples = defaultdict(int)
+        self.sampler = None
+        self.start = None
+        self.ident = None
+
+    def __enter__(self):
+        self.start = time()
+        self.ident = get_ident()
+        if self.delay:
+            self.profiler._watch(self)
+            return self
+        if self.profiler.memory:
+            tracemalloc.start()
+        self.sampler = Thread.run("sample " + self.name, self._sample, self.ident)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.delay and self.profiler._unwatch(self):
+            return  # FAST ENOUGH
+        self.sampler.stop()
+        self.sampler.join()
+        duration = time() - self.start
+        try:
+            directory = self.profiler.directory
+            if not directory.exists:
+                directory.create()
+            collapsed = File.new_instance(directory, self.name + ".collapsed")
+            collapsed.write("\n".join(
+                stack + " " + text_type(count)
+                for stack, count in sorted(self.samples.items())
+            ))
+            if self.profiler.memory and not self.delay:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                File.new_instance(directory, self.name + ".memory.txt").write("\n".join(
+                    text_type(s) for s in snapshot.statistics("lineno")[:MEMORY_TOP]
+                ))
+            Log.note(
+                "Batch {{name}} took {{duration|round(places=2)}} seconds, wrote {{num}} samples to {{file}}",
+                name=self.name,
+                duration=duration,
+                num=sum(self.samples.values()),
+                file=collapsed.abspath
+            )
+        except Exception as e:
+            Log.warning("Can not write profile of {{name}}", name=self.name, cause=e)
+
+    def _sample(self, ident, please_stop):
+        interval = self.profiler.interval
+        samples = self.samples
+        while not please_stop:
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                break
+            samples[_collapse(frame)] += 1
+            sleep(interval)
+
+
+def _collapse(frame):
+    """
+    :return: THE STACK, ROOT FIRST, AS ONE LINE
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" + text_type(frame.f_lineno) + ")")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class _Nothing(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NOTHING = _Nothing()
@@ -0,0 +1,258 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import heapq
+from time import time
+
+from mo_dots import listwrap
+from mo_files import File
+from mo_future import text_type
+from mo_kwargs import override
+from mo_logs import Log
+from mo_logs.exceptions import Except
+from mo_threads import Lock
+from mo_threads.metrics import METRICS
+from mo_times import Date, Duration
+from pyLibrary import convert
+
+BATCH_RETRIES = METRICS.counter("mysql_to_s3_batch_retries_total", "Failed batches queued to be tried again, after a backoff")
+BATCH_SPLITS = METRICS.counter("mysql_to_s3_batch_splits_total", "Failed batches split in two, to find the facts that fail")
+QUARANTINED = METRICS.counter("mysql_to_s3_quarantined_total", "Facts that failed on their own, and were left out")
+
+# ERRORS THAT SAY NOTHING ABOUT THE FACTS (LOWER CASE, FOUND ANYWHERE IN THE MESSAGES)
+OUTAGES = (
+    "connect",  # CAN NOT CONNECT, LOST CONNECTION, CONNECTION RESET/REFUSED/ABORTED
+    "gone away",
+    "broken pipe",
+    "timed out",
+    "timeout",
+    "database is locked",
+    "errno",  # IOError, OSError, socket.error
+    "service unavailable",
+    "slow down",
+    "internalerror"
+)
+
+
+class Retries(object):
+    """
+    FAILED BATCHES, WAITING TO BE TRIED AGAIN
+
+    A BATCH IS TRIED attempts TIMES, WAITING backoff, THEN TWICE THAT, ...
+    (UP TO max_backoff) BETWEEN TRIES. THEN IT IS SPLIT IN TWO PARTS, WHICH
+    ARE TRIED AT ONCE, AND THE SAME WAY; THE PARTS WITHOUT THE BAD FACTS ARE
+    WRITTEN AS <key>_<part>. A SINGLE FACT THAT FAILS attempts TIMES IS
+    WRITTEN, WITH THE CAUSE, TO THE QUARANTINE, AND LEFT OUT
+
+    ONLY THE FACTS ARE BLAMED WHEN THE REST OF THE BATCH GOES THROUGH: A PART
+    IS SPLIT (OR QUARANTINED) AT ONCE AFTER THE OTHER HALF OF ITS PARENT WAS
+    WRITTEN. WHEN BOTH HALVES FAIL, THEY ARE TRIED rounds MORE TIMES (AT UP TO
+    max_backoff) BEFORE THEY ARE BLAMED ANYWAY, SO TWO BAD FACTS IN DIFFERENT
+    HALVES ARE STILL FOUND. WHEN THE ERROR IS ONE OF THE outages (THE
+    DATABASE, THE NETWORK, S3), THE BATCH IS TRIED AGAIN, EVERY max_backoff,
+    UNTIL IT GOES THROUGH
+
+    THE BATCH IS DONE (FOR extract.last, THE LEASES, OR THE BACKFILL) ONCE
+    ALL ITS PARTS ARE WRITTEN OR QUARANTINED
+    """
+
+    @override
+    def __init__(
+        self,
+        attempts=3,
+        backoff="second",
+        max_backoff="minute",
+        prefix="quarantine/",
+        directory=None,
+        bucket=None,
+        outages=OUTAGES,
+        rounds=10,
+        kwargs=None
+    ):
+        """
+        :param attempts: TRIES OF A BATCH (OR PART) BEFORE IT IS SPLIT (OR QUARANTINED)
+        :param backoff: WAIT BEFORE THE SECOND TRY; DOUBLED FOR EACH TRY AFTER
+        :param max_backoff: LONGEST WAIT BETWEEN TRIES
+        :param prefix: KEY PREFIX OF THE QUARANTINE OBJECTS IN THE bucket
+        :param directory: WHERE THE QUARANTINE FILES GO WHEN THERE IS NO bucket
+        :param bucket: THE s3.Bucket OF THE DESTINATION
+        :param outages: LOWER CASE TEXT OF THE ERRORS THAT ARE NOT THE FAULT OF THE FACTS
+        :param rounds: MORE TRIES OF A PART, WHEN THE OTHER HALF ALSO FAILS, BEFORE IT IS SPLIT (OR QUARANTINED)
+        """
+        if attempts < 1:
+            Log.error("Expecting `retry.attempts` to be at least 1")
+        self.attempts = attempts
+        self.backoff = Duration(backoff).seconds
+        self.max_backoff = Duration(max_backoff).seconds
+        self.prefix = prefix
+        self.directory = File(directory) if directory else None
+        self.bucket = bucket
+        self.outages = [o.lower() for o in outages]
+        self.rounds = rounds
+
+        self.locker = Lock("retries")
+        self.waiting = []  # HEAP OF (DUE TIME, NUMBER, BATCH)
+        self.count = 0  # FOR ORDERING BATCHES DUE AT THE SAME TIME
+        self.failures = {}  # MAP FROM BATCH KEY TO THE TIMES IT FAILED
+        self.parts = {}  # MAP FROM KEY OF A SPLIT BATCH TO THE NUMBER OF ITS PARTS NOT DONE
+        self.passed = {}  # MAP FROM KEY OF A SPLIT BATCH TO THE PARTS WRITTEN
+
+    def __len__(self):
+        with self.locker:
+            return len(self.waiting)
+
+    def due(self):
+        """
+        :return: A BATCH TO TRY AGAIN NOW, OR None
+        """
+        with self.locker:
+            if self.waiting and self.waiting[0][0] <= time():
+                return heapq.heappop(self.waiting)[2]
+            return None
+
+    def wait(self):
+        """
+        :return: SECONDS UNTIL THE NEXT BATCH IS DUE, OR None IF NONE ARE WAITING
+        """
+        with self.locker:
+            if not self.waiting:
+                return None
+            return max(0, self.waiting[0][0] - time())
+
+    def failed(self, batch, cause):
+        """
+        :param batch: THE BATCH THAT FAILED
+        :param cause: THE EXCEPTION
+        :return: True IF THE BATCH IS DONE (ITS LAST PART WAS QUARANTINED)
+        """
+        key = _key(batch)
+        with self.locker:
+            failures = self.failures[_id(batch)] = self.failures.get(_id(batch), 0) + 1
+            if failures < self.attempts or self._is_outage(cause) or not self._is_blamed(batch, failures):
+                delay = min(self.max_backoff, self.backoff * 2 ** min(failures - 1, 30))
+                self._add(batch, delay)
+                BATCH_RETRIES.inc()
+                return False
+            del self.failures[_id(batch)]
+
+            data = list(batch["data"])
+            if len(data) > 1:
+                # THE HALF WITHOUT THE BAD FACTS GOES THROUGH AT FULL SPEED
+                part = batch.get("part") or ""
+                whole = _id(dict(batch, part=None))
+                self.parts[whole] = self.parts.get(whole, 1) + 1
+                mid = len(data) // 2
+                self._add(dict(batch, data=data[:mid], part=part + "0"), 0)
+                self._add(dict(batch, data=data[mid:], part=part + "1"), 0)
+                BATCH_SPLITS.inc()
+                Log.note("Split batch {{key}} of {{num}} facts, after {{failures}} failures", key=key, num=len(data), failures=failures)
+                return False
+
+        self._quarantine(batch, cause)
+        return self._part_done(batch)
+
+    def succeeded(self, batch):
+        """
+        :return: True IF THE BATCH IS DONE (THIS WAS ITS LAST PART)
+        """
+        with self.locker:
+            self.failures.pop(_id(batch), None)
+            if batch.get("part"):
+                self.passed.setdefault(_id(dict(batch, part=None)), set()).add(batch["part"])
+        return self._part_done(batch)
+
+    def _part_done(self, batch):
+        if not batch.get("part"):
+            return True
+        whole = _id(dict(batch, part=None))
+        with self.locker:
+            remaining = self.parts[whole] = self.parts[whole] - 1
+            if remaining:
+                return False
+            del self.parts[whole]
+            self.passed.pop(whole, None)
+            return True
+
+    def _is_outage(self, cause):
+        messages = " ".join(_messages(cause)).lower()
+        return any(o in messages for o in self.outages)
+
+    def _is_blamed(self, batch, failures):
+        """
+        :return: True IF THE FACTS OF THE batch CAN BE BLAMED FOR ITS FAILURE:
+                 IT IS A WHOLE BATCH, THE OTHER HALF OF ITS PARENT WAS WRITTEN,
+                 OR IT FAILED rounds MORE TIMES
+        """
+        part = batch.get("part")
+        if not part or failures >= self.attempts + self.rounds:
+            return True
+        sibling = part[:-1] + ("1" if part[-1] == "0" else "0")
+        passed = self.passed.get(_id(dict(batch, part=None)), ())
+        return any(p.startswith(sibling) for p in passed)
+
+    def _add(self, batch, delay):
+        self.count += 1
+        heapq.heappush(self.waiting, (time() + delay, self.count, batch))
+
+    def _quarantine(self, batch, cause):
+        QUARANTINED.inc(len(batch["data"]))
+        Log.warning("Quarantine facts {{data|json}} of batch {{key}}", data=batch["data"], key=_key(batch), cause=cause)
+        content = convert.value2json({
+            "start_point": batch["start_point"],
+            "first_value": batch["first_value"],
+            "data": batch["data"],
+            "backfill": batch.get("backfill"),
+            "cause": text_type(cause),
+            "timestamp": Date.now().unix
+        })
+        name = _key(batch) + ".json"
+        try:
+            if self.bucket:
+                storage = self.bucket.new_key(self.prefix + name)
+                storage.set_contents_from_string(content)
+            else:
+                File.new_instance(self.directory, name).write(content)
+        except Exception as e:
+            Log.warning("Could not write quarantine {{name}}", name=name, cause=e)
+
+
+def _messages(cause):
+    """
+    :return: THE MESSAGES OF THE cause, AND OF ITS CAUSES
+    """
+    if isinstance(cause, Except):
+        output = [cause.message]
+        for c in listwrap(cause.cause):
+            output.extend(_messages(c))
+        return output
+    return [text_type(cause)]
+
+
+def _name(start_point):
+    return ".".join(map(text_type, start_point))
+
+
+def _id(batch):
+    # A BACKFILL MAY HAVE THE SAME start_point AS THE LIVE TAIL
+    return _key(batch), batch.get("backfill")
+
+
+def _key(batch):
+    """
+    :return: THE DESTINATION NAME OF THE BATCH (OR PART)
+    """
+    part = batch.get("part")
+    if part:
+        return _name(batch["start_point"]) + "_" + part
+    return _name(batch["start_point"])
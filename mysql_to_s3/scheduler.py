@@ -0,0 +1,252 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+RUN MANY EXTRACT CONFIGS IN ONE PROCESS
+
+    {
+        "threads": 4,
+        "extracts": [
+            {"$ref": "file://treeherder.json", "extract": {"weight": 2}},
+            {"$ref": "file://perfherder.json"}
+        ]
+    }
+
+THE CATALOG SCAN IS DONE ONCE FOR EACH SERVER, THE CONNECTIONS ARE SHARED
+BY ALL CONFIGS USING THE SAME database, AND NO MORE THAN threads BATCHES
+ARE EXTRACTED AT ONCE. THE SLOTS ARE SHARED BY WEIGHT: A CONFIG WITH weight
+2 GETS TWICE THE WORKER TIME OF A CONFIG WITH weight 1, WHEN BOTH HAVE
+BATCHES WAITING. EACH CONFIG KEEPS ITS OWN `last` CHECKPOINT
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import signal
+
+from mo_dots import coalesce, listwrap
+from mo_future import text_type
+from mo_logs import Log, startup, constants
+from mo_threads import Lock, Signal, Thread, THREAD_STOP
+from mo_threads.metrics import METRICS, MetricsExporter
+from mo_times.timer import Timer
+
+from mysql_to_s3.extract import Extract, check_processes
+from mysql_to_s3.snowflake_schema import Catalog, open_database
+
+SLOT_WAIT_SECONDS = METRICS.histogram("mysql_to_s3_slot_wait_seconds", "Time a batch waited for a worker slot of the scheduler")
+
+
+class Scheduler(object):
+    """
+    threads SLOTS, SHARED BY WEIGHTED FAIR SHARE: EACH NAME IS CHARGED THE
+    SECONDS IT HELD A SLOT, DIVIDED BY ITS weight, AND A FREE SLOT GOES TO
+    THE WAITING NAME THAT WAS CHARGED THE LEAST
+    """
+
+    def __init__(self, threads):
+        self.locker = Lock("scheduler")
+        self.free = threads
+        self.weights = {}
+        self.used = {}  # WEIGHTED SECONDS CHARGED TO EACH NAME
+        self.clock = 0  # used OF THE LAST NAME GIVEN A SLOT
+        self.waiting = []  # (name, Signal) IN ORDER OF ARRIVAL
+
+    def add(self, name, weight=1):
+        if weight <= 0:
+            Log.error("Expecting a positive weight for {{name|quote}}", name=name)
+        with self.locker:
+            self.weights[name] = weight
+            self.used[name] = 0
+
+    def acquire(self, name, please_stop):
+        """
+        WAIT FOR A SLOT
+        :return: True WHEN THE SLOT IS GIVEN, False IF please_stop CAME FIRST
+        """
+        ready = Signal("slot for " + name)
+        with self.locker:
+            # A NAME THAT WAS IDLE DOES NOT GET TO CATCH UP ON THE TIME IT DID NOT USE
+            self.used[name] = max(self.used[name], self.clock)
+            self.waiting.append((name, ready))
+            self._grant()
+        (ready | please_stop).wait()
+        with self.locker:
+            if ready:
+                return True
+            self.waiting.remove((name, ready))
+            return False
+
+    def release(self, name, seconds):
+        """
+        GIVE BACK THE SLOT
+        :param seconds: TIME THE SLOT WAS HELD
+        """
+        with self.locker:
+            self.used[name] += seconds / self.weights[name]
+            self.free += 1
+            self._grant()
+
+    def _grant(self):
+        while self.free and self.waiting:
+            i, (name, ready) = min(enumerate(self.waiting), key=lambda p: (self.used[p[1][0]], p[0]))
+            del self.waiting[i]
+            self.free -= 1
+            self.clock = self.used[name]
+            ready.go()
+
+
+class ConnectionPool(object):
+    """
+    IDLE CONNECTIONS, FOR EACH database
+    """
+
+    def __init__(self):
+        self.locker = Lock("connection pool")
+        self.idle = {}
+
+    def get(self, database):
+        with self.locker:
+            idle = self.idle.get(_key(database))
+            if idle:
+                return idle.pop()
+        return open_database(database)
+
+    def put(self, database, db):
+        with self.locker:
+            self.idle.setdefault(_key(database), []).append(db)
+
+    def close(self):
+        with self.locker:
+            idle, self.idle = self.idle, {}
+        for dbs in idle.values():
+            for db in dbs:
+                try:
+                    db.close()
+                except Exception as e:
+                    Log.warning("Can not close connection", cause=e)
+
+
+def _key(database):
+    return database.filename, database.schema, database.host, database.port, database.username
+
+
+def run(extracts, threads, please_stop):
+    """
+    :param extracts: LIST OF (name, Extract)
+    :param threads: NUMBER OF BATCHES EXTRACTED AT ONCE
+    """
+    scheduler = Scheduler(threads)
+    pool = ConnectionPool()
+    workers = []
+
+    def work(name, extractor, please_stop):
+        database = extractor.settings.snowflake.database
+        while not please_stop:
+            batch = extractor.next_batch(please_stop)
+            if batch is THREAD_STOP:
+                break
+            with Timer("wait for slot", debug=False, metric=SLOT_WAIT_SECONDS):
+                acquired = scheduler.acquire(name, please_stop)
+            if not acquired:
+                break
+            timer = Timer("extract {{name}} batch", param={"name": name}, debug=False)
+            db = None
+            started = False
+            try:
+                with timer:
+                    db = pool.get(database)
+                    with db.transaction():
+                        started = True
+                        done = extractor.work(db, batch, please_stop)
+                if done:
+                    pool.put(database, db)
+                else:
+                    # THE CONNECTION MAY BE BROKEN
+                    db.close()
+            except Exception as e:
+                Log.warning("Problem with {{name}} connection", name=name, cause=e)
+                if not started:
+                    # THE BATCH NEVER REACHED extractor.work(), SO IT IS RETRIED LIKE ANY OTHER FAILURE
+                    extractor.failed(batch, e)
+                if db is not None:
+                    try:
+                        db.close()
+                    except Exception:
+                        pass
+            finally:
+                scheduler.release(name, timer.interval if timer.end else 0)
+
+    for name, extractor in extracts:
+        scheduler.add(name, coalesce(extractor.settings.extract.weight, 1))
+        for i in range(min(extractor.settings.extract.threads, threads)):
+            workers.append(Thread.run("extract " + name + " #" + text_type(i), work, name, extractor, please_stop=please_stop))
+
+    try:
+        for w in workers:
+            w.join()
+    finally:
+        pool.close()
+        for _, extractor in extracts:
+            if extractor.manifest:
+                extractor.manifest.close()
+            if extractor.leases:
+                extractor.leases.close()
+
+
+def main():
+    try:
+        settings = startup.read_settings()
+        with startup.SingleInstance(settings.args.filename):
+            constants.set(settings.constants)
+            Log.start(settings.debug)
+
+            exporter = MetricsExporter(kwargs=settings.metrics) if settings.metrics else None
+
+            configs = listwrap(settings.extracts)
+            names = [coalesce(c.name, c.snowflake.fact_table) for c in configs]
+            if len(set(names)) != len(names):
+                Log.error("Expecting each of the extracts to have its own `name` (default is the fact_table)")
+            lasts = [c.extract.last for c in configs]
+            if len(set(lasts)) != len(lasts):
+                Log.error("Expecting each of the extracts to have its own `extract.last` file")
+
+            checked = set()
+            for c in configs:
+                if _key(c.snowflake.database) not in checked:
+                    checked.add(_key(c.snowflake.database))
+                    check_processes(c.snowflake.database)
+
+            catalog = Catalog()
+            extracts = [(name, Extract(catalog=catalog, kwargs=c)) for name, c in zip(names, configs)]
+            Log.note("{{num}} extracts using {{scans}} catalog scans", num=len(extracts), scans=catalog.scans)
+            if hasattr(signal, "SIGUSR2"):
+                # kill -USR2 <pid> TO PROFILE THE NEXT BATCH OF EVERY WORKER
+                def profile(signum, frame):
+                    for _, e in extracts:
+                        e.profiler.request(e.settings.extract.threads)
+                signal.signal(signal.SIGUSR2, profile)
+
+            threads = coalesce(settings.threads, sum(e.settings.extract.threads for _, e in extracts))
+            please_stop = Signal()
+            Thread.run("scheduler", run, extracts, threads, please_stop=please_stop)
+            Thread.wait_for_shutdown_signal(please_stop=please_stop, allow_exit=True, wait_forever=False)
+            if exporter:
+                # THE LAST SNAPSHOT HAS ALL THE WORK
+                exporter.stop()
+    except Exception as e:
+        Log.warning("Problem with data extraction", e)
+    finally:
+        Log.stop()
+
+
+if __name__ == "__main__":
+    main()
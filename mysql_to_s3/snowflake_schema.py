@@ -13,43 +13,180 @@ from __future__ import division
 from __future__ import unicode_literals
 
 from copy import deepcopy, copy
+from decimal import Decimal
 
 from jx_python import jx
 from mo_collections import UniqueIndex
-from mo_dots import coalesce, Data, wrap, Null, FlatList, unwrap, join_field, split_field, relative_field, concat_field, literal_field, set_default, startswith_field
-from mo_future import text_type
+from mo_dots import coalesce, Data, wrap, Null, FlatList, unwrap, join_field, split_field, relative_field, concat_field, literal_field, set_default, startswith_field, listwrap
+from mo_files import File
+from mo_future import text_type, long
 from mo_kwargs import override
 from mo_logs import Log, strings
 from mo_logs.exceptions import Explanation
 from mo_math.randoms import Random
+from mo_threads import Lock
 from mo_times.timer import Timer
-from pyLibrary.sql import SQL_SELECT, sql_list, sql_alias, SQL_NULL, sql_iso, SQL_FROM, SQL_LEFT_JOIN, sql_and, SQL_ON, SQL_JOIN, SQL_UNION_ALL, SQL_ORDERBY, SQL_STAR, SQL_IS_NOT_NULL
+from pyLibrary.sql import SQL, SQL_SELECT, sql_list, sql_alias, SQL_NULL, sql_iso, SQL_FROM, SQL_LEFT_JOIN, sql_and, SQL_ON, SQL_JOIN, SQL_UNION_ALL, SQL_ORDERBY, SQL_STAR, SQL_IS_NOT_NULL
 from pyLibrary.sql.mysql import MySQL, quote_column
 
+from mysql_to_s3.sqlite_db import SqliteDB, TIME_TYPES, unix_time
+
 DEBUG = False
 
+# data_type OF THE COLUMNS THE DATABASE CAN COMPARE TO THE null_values AS PYTHON WOULD
+TEXT_TYPES = {"char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set"}
+EXACT_NUMBER_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "decimal", "numeric"}
+BINARY_TYPES = {"binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob", "bit"}
+
+
+class Catalog(object):
+    """
+    THE RAW information_schema ROWS, READ ONCE FOR ALL THE SnowflakeSchema
+    OF A PROCESS THAT LOOK AT THE SAME SERVER
+    """
+
+    def __init__(self):
+        self.locker = Lock("catalog")
+        self.servers = {}
+        self.scans = 0
+
+    def get(self, database, load):
+        """
+        :param database: THE database SETTINGS
+        :param load: FUNCTION RETURNING (relations, tables, columns), CALLED ONCE FOR EACH SERVER
+        :return: (relations, tables, columns)
+        """
+        if database.filename:
+            key = (File(database.filename).abspath, database.schema)
+        else:
+            # THE CATALOG QUERIES COVER ALL SCHEMAS OF THE SERVER
+            key = (database.host, database.port, database.username)
+        with self.locker:
+            found = self.servers.get(key)
+            if found is None:
+                found = self.servers[key] = load()
+                self.scans += 1
+        relations, tables, columns = found
+        # EACH SCHEMA APPENDS ITS OWN add_relations
+        return wrap(list(unwrap(relations))), tables, columns
+
 
 class SnowflakeSchema(object):
 
     @override
-    def __init__(self, kwargs=None):
+    def __init__(self, catalog=None, kwargs=None):
+        """
+        :param catalog: Catalog SHARED WITH OTHER SCHEMAS OF THE PROCESS (OPTIONAL)
+        """
         self.settings = kwargs
+        self.catalog = catalog
         self.settings.exclude = set(self.settings.exclude)
         self.settings.show_foreign_keys = coalesce(self.settings.show_foreign_keys, True)
 
         self.all_nested_paths = None
         self.nested_path_to_join = None
         self.columns = None
+        self.normalized = {}  # MAP FROM COLUMN INDEX TO THE SQL LITERALS REPLACED WITH NULL
 
         with Explanation("scan database", debug=DEBUG):
-            self.db = MySQL(**kwargs.database)
+            self.db = open_database(kwargs.database)
+            self.is_sqlite = isinstance(self.db, SqliteDB)
             with self.db:
                 with self.db.transaction():
                     self._scan_database()
+                    if self.settings.normalize:
+                        self.normalized = self._normalize_columns()
 
     def get_sql(self, get_ids):
         sql = self._compose_sql(get_ids)
+        return self._sort_union(sql)
+
+    def get_materialized_sql(self, get_ids):
+        """
+        MATERIALIZE EACH SHARED JOIN PREFIX ONCE, SO THE CHILD BRANCHES OF THE
+        UNION JOIN AGAINST A SMALL TEMPORARY TABLE, NOT THE WHOLE JOIN CHAIN
 
+        :param get_ids: SQL to get the ids, and used to select the documents returned
+        :return: (setup, sql, teardown) WHERE setup IS THE LIST OF SQL TO RUN
+                 BEFORE sql, AND teardown IS THE LIST OF SQL TO RUN AFTER
+        """
+        prefixes = {}
+
+        def get_prefix(joins):
+            key = tuple(id(j) for j in joins)
+            prefix = prefixes.get(key)
+            if prefix:
+                return prefix
+            split = _last_children_join(joins)
+            prefix = prefixes[key] = Data(
+                name="__prefix" + text_type(len(prefixes)) + "__",
+                joins=joins,
+                size=len(joins),
+                aliases=set(_join_alias(j) for j in joins),
+                needs=set(),
+                uses=0,
+                parent=get_prefix(joins[:split]) if split > 1 else None
+            )
+            return prefix
+
+        # CHILD BRANCHES USE THE PREFIX THEY SHARE WITH THEIR PARENT
+        sql = []
+        copies = []
+        for nested_path in self.all_nested_paths:
+            joins = self.nested_path_to_join[nested_path[0]]
+            split = _last_children_join(joins)
+            if split > 1:
+                prefix = get_prefix(joins[:split])
+                if prefix.uses:
+                    # MYSQL CAN NOT OPEN THE SAME TEMPORARY TABLE TWICE IN ONE QUERY
+                    copy_name = prefix.name[:-2] + "_" + text_type(prefix.uses) + "__"
+                    copies.append((prefix, copy_name))
+                    source = Data(name=copy_name, size=prefix.size, aliases=prefix.aliases, needs=prefix.needs)
+                else:
+                    source = prefix
+                prefix.uses += 1
+                branch = self._compose_branch(nested_path, joins, get_ids, source)
+            else:
+                branch = self._compose_branch(nested_path, joins, get_ids)
+            if branch:
+                sql.append(branch)
+
+        # LONGER PREFIXES ADD THEIR NEEDS TO THE SHORTER ONES THEY ARE BUILT FROM
+        creates = {}
+        for prefix in sorted(prefixes.values(), key=lambda p: -p.size):
+            selects = [
+                sql_alias(_reference(c, a, prefix.parent), quote_column(a + "__" + c))
+                for a, c in sorted(prefix.needs)
+            ]
+            joins = self._compose_joins(prefix.joins, get_ids, prefix.parent)
+            creates[prefix.name] = (
+                "CREATE TEMPORARY TABLE " + quote_column(prefix.name) + " AS " +
+                SQL_SELECT + sql_list(selects) + joins
+            )
+
+        setup = []
+        teardown = []
+        for prefix in sorted(prefixes.values(), key=lambda p: p.size):
+            setup.append(self._drop_temporary(prefix.name))
+            setup.append(creates[prefix.name])
+            teardown.append(self._drop_temporary(prefix.name))
+            for p, copy_name in copies:
+                if p is prefix:
+                    setup.append(self._drop_temporary(copy_name))
+                    setup.append("CREATE TEMPORARY TABLE " + quote_column(copy_name) + " AS " + SQL_SELECT + SQL_STAR + SQL_FROM + quote_column(prefix.name))
+                    teardown.append(self._drop_temporary(copy_name))
+
+        if DEBUG:
+            Log.note("Materialized {{num}} join prefixes", num=len(prefixes))
+
+        return setup, self._sort_union(sql), teardown
+
+    def _drop_temporary(self, name):
+        if self.is_sqlite:
+            return SQL("DROP TABLE IF EXISTS temp.") + quote_column(name).lstrip()
+        return SQL("DROP TEMPORARY TABLE IF EXISTS ") + quote_column(name)
+
+    def _sort_union(self, sql):
         # ORDERING
         sort = []
         ordering = []
@@ -67,7 +204,10 @@ class SnowflakeSchema(object):
         )
         return union_all_sql
 
-    def _scan_database(self):
+    def _mysql_catalog(self):
+        """
+        :return: (relations, tables, columns) FROM THE information_schema
+        """
         # GET ALL RELATIONS
         raw_relations = self.db.query("""
             SELECT
@@ -85,6 +225,50 @@ class SnowflakeSchema(object):
                 referenced_column_name IS NOT NULL
         """, param=self.settings.database)
 
+        # GET ALL TABLES
+        raw_tables = self.db.query("""
+            SELECT
+                t.table_schema,
+                t.table_name,
+                c.constraint_name,
+                c.constraint_type,
+                k.column_name,
+                k.ordinal_position
+            FROM
+                information_schema.tables t
+            LEFT JOIN
+                information_schema.table_constraints c on c.table_name=t.table_name AND c.table_schema=t.table_schema and (constraint_type='UNIQUE' or constraint_type='PRIMARY KEY')
+            LEFT JOIN
+                information_schema.key_column_usage k on k.constraint_name=c.constraint_name AND k.table_name=t.table_name and k.table_schema=t.table_schema
+            ORDER BY
+                t.table_schema,
+                t.table_name,
+                c.constraint_name,
+                k.ordinal_position,
+                k.column_name
+        """, param=self.settings.database)
+
+        # GET ALL COLUMNS
+        raw_columns = self.db.query("""
+            SELECT
+                column_name,
+                table_schema,
+                table_name,
+                ordinal_position,
+                data_type,
+                character_maximum_length
+            FROM
+                information_schema.columns
+        """, param=self.settings.database)
+        return raw_relations, raw_tables, raw_columns
+
+    def _scan_database(self):
+        load = self.db.catalog if self.is_sqlite else self._mysql_catalog
+        if self.catalog:
+            raw_relations, raw_tables, raw_columns = self.catalog.get(self.settings.database, load)
+        else:
+            raw_relations, raw_tables, raw_columns = load()
+
         if not raw_relations:
             Log.error("No relations in the database")
 
@@ -117,29 +301,6 @@ class SnowflakeSchema(object):
             {"name": "ordinal_position", "value": "ordinal_position"}
         ])
 
-        # GET ALL TABLES
-        raw_tables = self.db.query("""
-            SELECT
-                t.table_schema,
-                t.table_name,
-                c.constraint_name,
-                c.constraint_type,
-                k.column_name,
-                k.ordinal_position
-            FROM
-                information_schema.tables t
-            LEFT JOIN
-                information_schema.table_constraints c on c.table_name=t.table_name AND c.table_schema=t.table_schema and (constraint_type='UNIQUE' or constraint_type='PRIMARY KEY')
-            LEFT JOIN
-                information_schema.key_column_usage k on k.constraint_name=c.constraint_name AND k.table_name=t.table_name and k.table_schema=t.table_schema
-            ORDER BY
-                t.table_schema,
-                t.table_name,
-                c.constraint_name,
-                k.ordinal_position,
-                k.column_name
-        """, param=self.settings.database)
-
         # ORGANIZE, AND PICK ONE UNIQUE CONSTRAINT FOR LINKING
         tables = UniqueIndex(keys=["name", "schema"])
         for t, c in jx.groupby(raw_tables, ["table_name", "table_schema"]):
@@ -198,18 +359,6 @@ class SnowflakeSchema(object):
         )
         tables.add(ids_table)
 
-        # GET ALL COLUMNS
-        raw_columns = self.db.query("""
-            SELECT
-                column_name,
-                table_schema,
-                table_name,
-                ordinal_position,
-                data_type
-            FROM
-                information_schema.columns
-        """, param=self.settings.database)
-
         reference_only_tables = [r.split(".")[0] for r in self.settings.reference_only if len(r.split(".")) == 2]
         reference_all_tables = [r.split(".")[0] for r in self.settings.reference_only if len(r.split(".")) == 1]
         foreign_column_table_schema_triples = {(r.column.name, r.table.name, r.table.schema) for r in relations}
@@ -265,7 +414,8 @@ class SnowflakeSchema(object):
             rel = {
                 "column": {
                     "name": c.column_name,
-                    "type": c.data_type
+                    "type": c.data_type,
+                    "length": c.character_maximum_length
                 },
                 "table": {
                     "name": c.table_name,
@@ -515,6 +665,121 @@ class SnowflakeSchema(object):
         self.all_nested_paths = all_nested_paths
         self.nested_path_to_join = nested_path_to_join
         self.columns = output_columns
+        self._prune_to_includes()
+
+    def _prune_to_includes(self):
+        """
+        REMOVE THE COLUMNS, JOINS AND NESTED PATHS THAT DO NOT CONTRIBUTE TO
+        THE include PATHS (OR ARE IN THE exclude_paths)
+
+        PATHS ARE RELATIVE TO THE FACT DOCUMENT (eg "job_type.name")
+        """
+        include = listwrap(self.settings.include)
+        exclude_paths = listwrap(self.settings.exclude_paths)
+
+        # THE FACT TABLE IS PUT UNDER ITS id PATH
+        fact_path = [c.path for c in self.columns if c.sort and len(c.nested_path) == 1][0]
+
+        def doc_path(c):
+            return relative_field(concat_field(c.nested_path[0], c.put), fact_path)
+
+        # DESELECT COLUMNS
+        for c in self.columns:
+            if c.put == None:
+                continue
+            path = doc_path(c)
+            if include and not any(startswith_field(path, i) or startswith_field(i, path) for i in include):
+                c.put = None
+            elif any(startswith_field(path, e) for e in exclude_paths):
+                c.put = None
+
+        # NESTED PATHS WITH A SELECTED COLUMN, AND ALL THEIR PARENTS
+        needed_paths = {"."}
+        for c in self.columns:
+            if c.put != None:
+                needed_paths.update(c.nested_path)
+        all_nested_paths = [np for np in self.all_nested_paths if np[0] in needed_paths]
+
+        # ONLY SELECTED COLUMNS, AND THE ids NEEDED TO ASSEMBLE THE DOCUMENT
+        columns = FlatList()
+        for np in all_nested_paths:
+            path_columns = [c for c in self.columns if c.nested_path[0] == np[0]]
+            selected = [c for c in path_columns if c.put != None or c.sort]
+            # NEED SOMETHING TO SHOW THE NESTED DOCUMENT EXISTS
+            columns.extend(selected or path_columns[:1])
+        columns = wrap(sorted(columns, key=lambda c: int(c.column_alias[1:])))
+        for ci, c in enumerate(columns):
+            c.column_alias = "c" + text_type(ci)
+
+        # ONLY THE JOINS THAT FEED SELECTED COLUMNS
+        nested_path_to_join = {}
+        for np in all_nested_paths:
+            needed_aliases = set(
+                c.table_alias
+                for c in columns
+                if c.nested_path[0] == np[0] or (c.column.is_id and startswith_field(np[0], c.path))
+            )
+            joins = self.nested_path_to_join[np[0]]
+            keep = [False] * len(joins)
+            for i, curr_join in reversed(list(enumerate(joins))):
+                curr_join = wrap(curr_join)
+                rel = curr_join.join_columns[0]
+                if i == 0:
+                    keep[i] = True
+                elif curr_join.children:
+                    # INNER JOINS CHANGE THE NUMBER OF ROWS, ALWAYS KEEP
+                    keep[i] = True
+                    needed_aliases.add(rel.referenced.table.alias)
+                elif rel.referenced.table.alias in needed_aliases:
+                    keep[i] = True
+                    needed_aliases.add(rel.table.alias)
+            nested_path_to_join[np[0]] = [j for j, k in zip(joins, keep) if k]
+
+            if DEBUG:
+                Log.note(
+                    "{{path}} uses {{num}} of {{total}} joins",
+                    path=np[0],
+                    num=len(nested_path_to_join[np[0]]),
+                    total=len(joins)
+                )
+
+        self.all_nested_paths = all_nested_paths
+        self.nested_path_to_join = nested_path_to_join
+        self.columns = columns
+
+    def _normalize_columns(self):
+        """
+        null_values (AND '') ARE TURNED TO NULL BY THE DATABASE, FOR THE COLUMNS
+        WHERE THE DATABASE COMPARES LIKE PYTHON DOES: MySQL COMPARES TEXT
+        AS BINARY, AND ONLY TO TEXT, AND EXACT NUMBERS ONLY TO NUMBERS;
+        SQLITE NULLIF() DOES NOT CONVERT TYPES, SO ANY COLUMN BUT TIME AND BLOB.
+        ids ARE LEFT ALONE: THE UNION IS ORDERED BY THEM, AND CHILDREN ARE
+        PUT UNDER THEIR PARENT BY THEM, SO THEY ARE CHECKED IN PYTHON
+        :return: MAP FROM COLUMN INDEX TO THE SQL LITERALS TO REPLACE WITH NULL
+        """
+        null_values = [v for v in listwrap(self.settings.null_values) if v is not None]
+        texts = [v for v in null_values if isinstance(v, text_type)]
+        numbers = [v for v in null_values if v.__class__ in (int, long, float, Decimal)]
+        if len(texts) + len(numbers) != len(null_values):
+            Log.warning("Can only normalize `null_values` that are strings or numbers, not {{values|json}}", values=null_values)
+            return {}
+        if "" not in texts:
+            texts.append("")
+
+        output = {}
+        for ci, c in enumerate(self.columns):
+            if c.sort or c.column.is_id:
+                continue
+            data_type = c.column.column.type
+            if self.is_sqlite:
+                if data_type in TIME_TYPES or data_type in BINARY_TYPES:
+                    continue
+                output[ci] = [self.db.quote_value(v) for v in texts + numbers]
+            elif data_type in TEXT_TYPES:
+                output[ci] = [SQL("BINARY ") + self.db.quote_value(v) for v in texts]
+            elif data_type in EXACT_NUMBER_TYPES:
+                output[ci] = [self.db.quote_value(v) for v in numbers]
+        return output
 
     def _compose_sql(self, get_ids):
         """
@@ -524,57 +789,166 @@ class SnowflakeSchema(object):
 
         sql = []
         for nested_path in self.all_nested_paths:
-            # MAKE THE REQUIRED JOINS
-            sql_joins = []
+            branch = self._compose_branch(nested_path, self.nested_path_to_join[nested_path[0]], get_ids)
+            if branch:
+                sql.append(branch)
+        return sql
 
-            for i, curr_join in enumerate(self.nested_path_to_join[nested_path[0]]):
-                curr_join = wrap(curr_join)
-                rel = curr_join.join_columns[0]
-                if i == 0:
-                    sql_joins.append(SQL_FROM + sql_alias(sql_iso(get_ids), quote_column(rel.referenced.table.alias)))
-                elif curr_join.children:
-                    full_name = quote_column(rel.table.name, rel.table.schema)
-                    sql_joins.append(
-                        SQL_JOIN + sql_alias(full_name, quote_column(rel.table.alias)) +
-                        SQL_ON + sql_and(
-                            quote_column(const_col.column.name,rel.table.alias) + "=" + quote_column(const_col.referenced.column.name, rel.referenced.table.alias)
-                            for const_col in curr_join.join_columns
-                        )
-                    )
-                else:
-                    full_name = quote_column(rel.referenced.table.name, rel.referenced.table.schema)
-                    sql_joins.append(
-                        SQL_LEFT_JOIN + sql_alias(full_name, quote_column(rel.referenced.table.alias)) +
-                        SQL_ON + sql_and(
-                            quote_column(const_col.referenced.column.name, rel.referenced.table.alias) + "=" + quote_column(const_col.column.name, rel.table.alias)
-                            for const_col in curr_join.join_columns
-                        )
-                    )
+    def _compose_branch(self, nested_path, joins, get_ids, prefix=None):
+        """
+        :param nested_path: THE NESTED PATH THIS BRANCH OF THE UNION SELECTS
+        :param joins: THE JOINS REQUIRED BY THE nested_path
+        :param get_ids: SQL to get the ids
+        :param prefix: OPTIONAL MATERIALIZED TABLE THAT HOLDS THE FIRST prefix.size JOINS
+        :return: SQL, OR None IF NOTHING TO SELECT
+        """
+        # MAKE THE REQUIRED JOINS
+        sql_joins = self._compose_joins(joins, get_ids, prefix)
 
-            # ONLY SELECT WHAT WE NEED, NULL THE REST
-            selects = []
-            not_null_column_seen = False
-            for ci, c in enumerate(self.columns):
-                if c.column_alias[1:] != text_type(ci):
-                    Log.error("expecting consistency")
-                if c.nested_path[0] == nested_path[0]:
-                    s = sql_alias(quote_column(c.column.column.name, c.table_alias), quote_column(c.column_alias))
-                    if s == None:
-                        Log.error("bug")
+        # ONLY SELECT WHAT WE NEED, NULL THE REST
+        selects = []
+        not_null_column_seen = False
+        for ci, c in enumerate(self.columns):
+            if c.column_alias[1:] != text_type(ci):
+                Log.error("expecting consistency")
+            if c.nested_path[0] == nested_path[0]:
+                value = _nullif(_reference(c.column.column.name, c.table_alias, prefix), self.normalized.get(ci))
+                if self.is_sqlite and c.column.column.type in TIME_TYPES:
+                    value = unix_time(value)
+                s = sql_alias(value, quote_column(c.column_alias))
+                if s == None:
+                    Log.error("bug")
+                selects.append(s)
+                not_null_column_seen = True
+            elif startswith_field(nested_path[0], c.path):
+                # PARENT ID REFERENCES
+                if c.column.is_id:
+                    s = sql_alias(_reference(c.column.column.name, c.table_alias, prefix), quote_column(c.column_alias))
                     selects.append(s)
                     not_null_column_seen = True
-                elif startswith_field(nested_path[0], c.path):
-                    # PARENT ID REFERENCES
-                    if c.column.is_id:
-                        s = sql_alias(quote_column(c.column.column.name, c.table_alias),  quote_column(c.column_alias))
-                        selects.append(s)
-                        not_null_column_seen = True
-                    else:
-                        selects.append(sql_alias(SQL_NULL,  quote_column(c.column_alias)))
                 else:
-                    selects.append(sql_alias(SQL_NULL,  quote_column(c.column_alias)))
+                    selects.append(sql_alias(SQL_NULL, quote_column(c.column_alias)))
+            else:
+                selects.append(sql_alias(SQL_NULL, quote_column(c.column_alias)))
 
-            if not_null_column_seen:
-                sql.append(SQL_SELECT + sql_list(selects) + "".join(sql_joins))
-        return sql
+        if not_null_column_seen:
+            return SQL_SELECT + sql_list(selects) + sql_joins
+        return None
 
+    def _compose_joins(self, joins, get_ids, prefix=None):
+        if prefix:
+            sql_joins = [SQL_FROM + sql_alias(quote_column(prefix.name), quote_column(PREFIX_ALIAS))]
+            start = prefix.size
+        else:
+            sql_joins = []
+            start = 0
+
+        for i, curr_join in enumerate(joins):
+            if i < start:
+                continue
+            curr_join = wrap(curr_join)
+            rel = curr_join.join_columns[0]
+            if i == 0:
+                sql_joins.append(SQL_FROM + sql_alias(sql_iso(get_ids), quote_column(rel.referenced.table.alias)))
+            elif curr_join.children:
+                full_name = quote_column(rel.table.name, rel.table.schema)
+                sql_joins.append(
+                    SQL_JOIN + sql_alias(full_name, quote_column(rel.table.alias)) +
+                    SQL_ON + sql_and(
+                        _reference(const_col.column.name, rel.table.alias, prefix) + "=" + _reference(const_col.referenced.column.name, rel.referenced.table.alias, prefix)
+                        for const_col in curr_join.join_columns
+                    )
+                )
+            else:
+                full_name = quote_column(rel.referenced.table.name, rel.referenced.table.schema)
+                sql_joins.append(
+                    SQL_LEFT_JOIN + sql_alias(full_name, quote_column(rel.referenced.table.alias)) +
+                    SQL_ON + sql_and(
+                        _reference(const_col.referenced.column.name, rel.referenced.table.alias, prefix) + "=" + _reference(const_col.column.name, rel.table.alias, prefix)
+                        for const_col in curr_join.join_columns
+                    )
+                )
+        return SQL("").join(sql_joins)
+
+
+PREFIX_ALIAS = "__prefix__"
+
+
+def open_database(kwargs):
+    """
+    :param kwargs: THE database SETTINGS
+    :return: MySQL CONNECTION, OR A SqliteDB WHEN GIVEN THE filename OF A LOCAL SNAPSHOT
+    """
+    if kwargs.filename:
+        return SqliteDB(kwargs=kwargs)
+    return MySQL(kwargs=kwargs)
+
+
+def _reference(column_name, alias, prefix):
+    """
+    :return: SQL FOR THE COLUMN, WHICH MAY BE IN THE MATERIALIZED prefix TABLE
+    """
+    if prefix and alias in prefix.aliases:
+        prefix.needs.add((alias, column_name))
+        return quote_column(alias + "__" + column_name, PREFIX_ALIAS)
+    return quote_column(column_name, alias)
+
+
+def _nullif(value, literals):
+    """
+    :return: SQL FOR value, WITH NULL IN PLACE OF EACH OF THE literals
+    """
+    for l in literals or ():
+        value = SQL("NULLIF(") + value + SQL(", ") + l + SQL(")")
+    return value
+
+
+def _join_alias(join):
+    """
+    :return: THE TABLE ALIAS THE JOIN INTRODUCES
+    """
+    join = wrap(join)
+    rel = join.join_columns[0]
+    if join.children:
+        return rel.table.alias
+    return rel.referenced.table.alias
+
+
+def _last_children_join(joins):
+    """
+    :return: INDEX OF THE LAST ONE-TO-MANY JOIN, OR 0 IF NONE
+    """
+    for i, j in reversed(list(enumerate(joins))):
+        if wrap(j).children:
+            return i
+    return 0
+
+
+def schema_tree(columns, lower=True):
+    """
+    :param columns: SnowflakeSchema.columns
+    :param lower: USE LOWER CASE PROPERTY NAMES, LIKE elasticsearch.scrub() DOES
+    :return: NESTED {"fields", "repeated"} NODES, WITH MySQL data_type AT THE LEAVES
+    """
+    fact_path = [c.path for c in columns if c.sort and len(c.nested_path) == 1][0]
+    root = {"fields": {}, "repeated": False}
+    for c in columns:
+        if c.put == None:
+            continue
+        nested_paths = set(relative_field(np, fact_path) for np in list(c.nested_path)[:-1])
+        steps = relative_field(concat_field(c.nested_path[0], c.put), fact_path)
+        if lower:
+            nested_paths = set(p.lower() for p in nested_paths)
+            steps = steps.lower()
+        steps = split_field(steps)
+        node = root
+        for i, step in enumerate(steps[:-1]):
+            path = ".".join(steps[:i + 1])
+            child = node["fields"].setdefault(step, {"fields": {}, "repeated": path in nested_paths})
+            if not isinstance(child, dict):
+                Log.error("{{path}} is both a value and an object", path=path)
+            node = child
+        if isinstance(node["fields"].get(steps[-1]), dict):
+            Log.error("{{path}} is both a value and an object", path=".".join(steps))
+        node["fields"][steps[-1]] = c.column.column.type
+    return root
@@ -0,0 +1,319 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import sqlite3
+from collections import Mapping
+from datetime import datetime, date
+
+from mo_dots import coalesce, wrap
+from mo_files import File
+from mo_future import text_type
+from mo_kwargs import override
+from mo_logs import Log
+from mo_logs.strings import expand_template, indent, outdent
+from mo_math import Math
+from mo_times import Date
+from pyLibrary.sql import SQL, SQL_NULL, SQL_TRUE, SQL_FALSE
+from pyLibrary.sql.mysql import json_encode
+
+DEBUG = False
+
+# data_type OF THE COLUMNS THAT MySQL RETURNS AS datetime
+TIME_TYPES = {"date", "datetime", "timestamp"}
+
+
+class SqliteDB(object):
+    """
+    A LOCAL SQLITE COPY OF THE DATABASE (eg A CONVERTED DUMP) WITH THE PART OF
+    THE MySQL INTERFACE THE EXTRACT USES
+
+    THE FILE IS ATTACHED AS THE schema, SO `schema`.`table` NAMES STILL WORK
+    """
+
+    @override
+    def __init__(self, filename, schema, debug=False, kwargs=None):
+        self.settings = kwargs
+        self.filename = File(filename).abspath
+        self.schema = schema
+        self.debug = coalesce(debug, DEBUG)
+        self.transaction_level = 0
+        self.backlog = []
+        self.cursor = None
+        self.db = None
+        self._open()
+
+    def _open(self):
+        try:
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+            self.db.execute("ATTACH DATABASE " + quote_value(self.filename).template + " AS " + _quote_name(self.schema))
+        except Exception as e:
+            Log.error("Failure to open {{filename}}", filename=self.filename, cause=e)
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if isinstance(value, BaseException):
+                self.rollback()
+            else:
+                self.commit()
+        finally:
+            self.close()
+
+    def transaction(self):
+        return Transaction(self)
+
+    def begin(self):
+        if self.transaction_level == 0:
+            self.cursor = self.db.cursor()
+        self.transaction_level += 1
+
+    def commit(self):
+        self._execute_backlog()
+        if self.transaction_level == 0:
+            Log.error("No transaction has begun")
+        elif self.transaction_level == 1:
+            self.db.commit()
+        self.transaction_level -= 1
+
+    def rollback(self):
+        self.backlog = []
+        if self.transaction_level == 0:
+            Log.error("No transaction has begun")
+        elif self.transaction_level == 1:
+            self.db.rollback()
+        self.transaction_level -= 1
+
+    def close(self):
+        self.cursor = None
+        try:
+            self.db.close()
+        except Exception as e:
+            Log.warning("can not close()", e)
+
+    def query(self, sql, param=None, stream=False, row_tuples=False):
+        """
+        RETURN LIST OF dicts
+        """
+        if not self.cursor:
+            Log.error("must perform all queries inside a transaction")
+        self._execute_backlog()
+
+        try:
+            if param:
+                sql = expand_template(sql, self.quote_param(param))
+            sql = outdent(sql)
+            if self.debug:
+                Log.note("Execute SQL:\n{{sql}}", sql=indent(sql))
+
+            cursor = self.db.cursor()
+            cursor.execute(sql)
+            if row_tuples:
+                if stream:
+                    return cursor
+                return wrap(list(cursor))
+            columns = [d[0] for d in coalesce(cursor.description, [])]
+            if stream:
+                return (wrap(dict(zip(columns, row))) for row in cursor)
+            return wrap([dict(zip(columns, row)) for row in cursor])
+        except Exception as e:
+            Log.error("Problem executing SQL:\n{{sql|indent}}", sql=sql, cause=e, stack_depth=1)
+
+    def execute(self, sql, param=None):
+        if self.transaction_level == 0:
+            Log.error("Expecting transaction to be started before issuing queries")
+
+        if param:
+            sql = expand_template(sql, self.quote_param(param))
+        self.backlog.append(outdent(sql))
+        if self.debug:
+            self._execute_backlog()
+
+    def _execute_backlog(self):
+        backlog, self.backlog = self.backlog, []
+        for sql in backlog:
+            try:
+                if self.debug:
+                    Log.note("Execute SQL:\n{{sql|indent}}", sql=sql)
+                self.db.execute(sql)
+            except Exception as e:
+                Log.error("Can not execute sql:\n{{sql}}", sql=sql, cause=e)
+
+    def catalog(self):
+        """
+        :return: (relations, tables, columns) IN THE SAME SHAPE AS THE
+                 information_schema QUERIES OF SnowflakeSchema
+        """
+        schema = self.schema
+
+        def pragma(name, arg):
+            return self.db.execute("PRAGMA " + _quote_name(schema) + "." + name + "(" + quote_value(arg).template + ")")
+
+        table_names = [
+            name
+            for name, in self.db.execute(
+                "SELECT name FROM " + _quote_name(schema) + ".sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+
+        columns = []
+        primary_keys = {}
+        for t in table_names:
+            for cid, name, type_, _, _, pk in pragma("table_info", t):
+                columns.append({
+                    "column_name": name,
+                    "table_schema": schema,
+                    "table_name": t,
+                    "ordinal_position": cid + 1,
+                    "data_type": _data_type(type_),
+                    "character_maximum_length": _data_length(type_)
+                })
+                if pk:
+                    primary_keys.setdefault(t, []).append((pk, name))
+
+        relations = []
+        for t in table_names:
+            for id, seq, ref_table, from_, to, _, _, _ in pragma("foreign_key_list", t):
+                if to is None:
+                    # REFERENCES THE PRIMARY KEY
+                    to = [name for _, name in sorted(primary_keys.get(ref_table, []))][seq]
+                relations.append({
+                    "table_schema": schema,
+                    "table_name": t,
+                    "referenced_table_schema": schema,
+                    "referenced_table_name": ref_table,
+                    "referenced_column_name": to,
+                    "constraint_name": t + "_ibfk_" + text_type(id + 1),
+                    "column_name": from_,
+                    "ordinal_position": seq + 1
+                })
+
+        tables = []
+        for t in table_names:
+            constraints = []
+            pk = [name for _, name in sorted(primary_keys.get(t, []))]
+            if pk:
+                constraints.append(("PRIMARY", "PRIMARY KEY", pk))
+            for _, index_name, unique, origin, _ in pragma("index_list", t):
+                if not unique or origin == "pk":
+                    continue
+                index_columns = [
+                    name
+                    for _, _, name in sorted(pragma("index_info", index_name))
+                ]
+                constraints.append((index_name, "UNIQUE", index_columns))
+
+            if not constraints:
+                tables.append({"table_schema": schema, "table_name": t})
+            for constraint_name, constraint_type, names in sorted(constraints):
+                for i, name in enumerate(names):
+                    tables.append({
+                        "table_schema": schema,
+                        "table_name": t,
+                        "constraint_name": constraint_name,
+                        "constraint_type": constraint_type,
+                        "column_name": name,
+                        "ordinal_position": i + 1
+                    })
+
+        return wrap(relations), wrap(tables), wrap(columns)
+
+    def quote_param(self, param):
+        return {k: self.quote_value(v) for k, v in param.items()}
+
+    def quote_value(self, value):
+        return quote_value(value)
+
+
+class Transaction(object):
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if isinstance(exc_val, Exception):
+            self.db.rollback()
+        else:
+            self.db.commit()
+
+
+def _data_type(declared):
+    """
+    :return: THE MySQL data_type FOR THE DECLARED SQLITE TYPE (eg "VARCHAR(20)" -> "varchar")
+    """
+    if not declared:
+        return "text"
+    return declared.lower().split("(")[0].split(" ")[0]
+
+
+def _data_length(declared):
+    """
+    :return: THE DECLARED LENGTH (eg "VARCHAR(20)" -> 20), OR None
+    """
+    if not declared or "(" not in declared:
+        return None
+    try:
+        return int(declared.split("(")[1].split(")")[0].split(",")[0])
+    except ValueError:
+        return None
+
+
+def quote_value(value):
+    if value == None:
+        return SQL_NULL
+    elif isinstance(value, SQL):
+        return value
+    elif value is True:
+        return SQL_TRUE
+    elif value is False:
+        return SQL_FALSE
+    elif isinstance(value, text_type):
+        return SQL("'" + value.replace("'", "''") + "'")
+    elif isinstance(value, Mapping):
+        return quote_value(json_encode(value))
+    elif isinstance(value, (datetime, date, Date)):
+        # SAME FORMAT AS A CONVERTED DUMP, SO TEXT COMPARISON WORKS
+        value = Date(value)
+        if value.unix % 1:
+            return quote_value(value.format("%Y-%m-%d %H:%M:%S.%f"))
+        return quote_value(value.format("%Y-%m-%d %H:%M:%S"))
+    elif Math.is_number(value):
+        return SQL(text_type(value))
+    elif hasattr(value, '__iter__'):
+        return quote_value(json_encode(value))
+    else:
+        return quote_value(text_type(value))
+
+
+def _quote_name(name):
+    return "\"" + name.replace("\"", "\"\"") + "\""
+
+
+def unix_time(column):
+    """
+    :param column: SQL FOR A date/datetime/timestamp COLUMN
+    :return: SQL FOR THE SAME IN UNIX SECONDS, LIKE value2json() DOES FOR THE MySQL datetime
+    """
+    # strftime('%s') DROPS THE FRACTION, AND julianday() HAS ONLY ~10 MICROSECONDS
+    # OF PRECISION, SO ADD THE MICROSECONDS FROM THE TEXT ITSELF
+    return (
+        SQL("(CAST(strftime('%s', ") + column + SQL(") AS INTEGER) + CASE WHEN instr(") + column +
+        SQL(", '.') > 0 THEN CAST('0' || substr(") + column + SQL(", instr(") + column +
+        SQL(", '.')) AS REAL) ELSE 0 END)")
+    )
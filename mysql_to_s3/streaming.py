@@ -0,0 +1,91 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+WRITE DOCUMENTS WITH HUGE NESTED LISTS (A job WITH 100K failure_line)
+WITHOUT HOLDING THE WHOLE DOCUMENT IN MEMORY
+
+ONCE A FACT HAS MORE THAN extract.stream_children CHILD ROWS,
+construct_docs() ENCODES EACH CHILD AS SOON AS IT IS COMPLETE, AND
+APPENDS THE JSON TO A Spool. THE DOCUMENT IS ENCODED WITH A MARKER IN
+PLACE OF EACH SPOOLED LIST, AND splice() COPIES THE SPOOLS INTO THE
+OUTPUT WHERE THE MARKERS ARE
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import re
+import shutil
+from tempfile import TemporaryFile
+
+from mo_future import text_type
+
+# JSON ENCODERS ESCAPE \x00, SO THE MARKER CAN NOT SHOW UP IN ANY VALUE
+_MARKER = re.compile("\x00(\\d+)\x00")
+
+
+class Spool(object):
+    """
+    THE ENCODED ELEMENTS OF ONE NESTED LIST OF ONE DOCUMENT, IN A TEMP FILE
+    """
+    __slots__ = ["encode", "wrap", "cache", "count", "file", "marker"]
+
+    def __init__(self, encode, wrap, cache):
+        """
+        :param encode: FUNCTION FROM (ELEMENT, FragmentCache) TO JSON (OR None)
+        :param wrap: FUNCTION FROM NUMBER OF ELEMENTS TO THE (BEFORE, AFTER) TEXT OF THE LIST
+        :param cache: FragmentCache FOR THIS BATCH
+        """
+        self.encode = encode
+        self.wrap = wrap
+        self.cache = cache
+        self.count = 0
+        self.file = TemporaryFile()
+        self.marker = "\x00" + text_type(id(self)) + "\x00"
+
+    def add(self, element):
+        json = self.encode(element, self.cache)
+        if json is None:
+            return
+        if self.count:
+            self.file.write(b",")
+        self.file.write(json.encode("utf8"))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def splice(line, spools, filename):
+    """
+    APPEND line TO THE FILE, WITH THE SPOOLED ELEMENTS IN PLACE OF THEIR MARKERS
+    :param line: THE JSON FROM THE ENCODER
+    :param spools: ALL THE Spools OF THE DOCUMENT (EMPTY ONES HAVE NO MARKER)
+    :param filename: FILE TO APPEND TO
+    """
+    lookup = {text_type(id(s)): s for s in spools}
+    try:
+        parts = _MARKER.split(line)
+        with open(filename, "ab") as output:
+            output.write(parts[0].encode("utf8"))
+            for key, after in zip(parts[1::2], parts[2::2]):
+                spool = lookup[key]
+                before, end = spool.wrap(spool.count)
+                output.write(before.encode("utf8"))
+                spool.file.seek(0)
+                shutil.copyfileobj(spool.file, output)
+                output.write(end.encode("utf8"))
+                output.write(after.encode("utf8"))
+            output.write(b"\n")
+    finally:
+        for s in spools:
+            s.close()
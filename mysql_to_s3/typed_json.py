@@ -0,0 +1,200 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from mo_future import text_type, binary_type, long
+from mo_json import float2json
+from mo_json.typed_encoder import encode_property, NUMBER_TYPE, STRING_TYPE, NESTED_TYPE, EXISTS_TYPE
+from mo_logs.strings import quote, utf82unicode
+from mo_math import Math
+from mo_times import Date
+from pyLibrary.env.typed_inserter import TypedInserter
+
+from mysql_to_s3.fragments import object_ids, identity, memoize
+from mysql_to_s3.snowflake_schema import schema_tree
+from mysql_to_s3.streaming import Spool
+
+# MySQL data_type OF THE COLUMNS WITH NUMBERS; ANYTHING ELSE IS A STRING
+# TIME IS IN UNIX SECONDS, LIKE THE JSON DOCUMENTS
+NUMBER_TYPES = {
+    "bigint", "bit", "int", "integer", "mediumint", "smallint", "tinyint", "year",
+    "decimal", "double", "float", "real", "numeric",
+    "date", "datetime", "time", "timestamp"
+}
+
+_NUMBER_PREFIX = "{" + quote(NUMBER_TYPE) + ":"
+_STRING_PREFIX = "{" + quote(STRING_TYPE) + ":"
+_NESTED_PREFIX = "{" + quote(NESTED_TYPE) + ":["
+_EXISTS_SUFFIX = "," + quote(EXISTS_TYPE) + ":"
+_OBJECT_SUFFIX = _EXISTS_SUFFIX + "1}"
+
+
+class TypedEncoder(object):
+    """
+    WRITE THE DOCUMENTS IN THE TYPED JSON OF mo_json.typed_encoder, SO
+    INGEST NEED NOT GUESS THE TYPE OF EVERY VALUE:
+
+        {"name": {"~s~": "A"}, "nested1": {"~N~": [{...,"~e~": 1}], "~e~": 1}, "~e~": 1}
+
+    THE TYPE OF EACH PROPERTY IS DECIDED ONCE, FROM THE MySQL data_type OF
+    ITS COLUMN, AND A NESTED DOCUMENT IS ALWAYS A LIST. AS WITH
+    elasticsearch.scrub(), PROPERTY NAMES ARE LOWER CASE, AND NULLS, EMPTY
+    STRINGS, EMPTY OBJECTS AND EMPTY LISTS ARE LEFT OUT
+    """
+
+    def __init__(self, columns, fact_table):
+        """
+        :param columns: SnowflakeSchema.columns
+        :param fact_table: NAME OF THE PROPERTY THE DOCUMENT GOES IN
+        """
+        self.fact_name = quote(encode_property(fact_table))
+        self.nested = {}  # PATH OF A NESTED LIST TO THE FUNCTION ENCODING ONE ELEMENT
+        self.encode_doc = _compile(schema_tree(columns, lower=False), (), object_ids(columns), self.nested)
+
+    def encode_etl(self, etl):
+        """
+        :param etl: THE etl.source, SAME FOR ALL DOCUMENTS OF A BATCH
+        :return: TYPED JSON FOR etl.source
+        """
+        return TypedInserter().typed_encode({"value": etl})["json"]
+
+    def spool(self, path, cache):
+        """
+        :param path: TUPLE OF STEPS FROM THE FACT TO A NESTED LIST
+        :param cache: FragmentCache FOR THIS BATCH
+        :return: Spool FOR THE ELEMENTS OF THAT LIST
+        """
+        return Spool(self.nested[path], _list, cache)
+
+    def encode(self, doc, id, source, timestamp, cache, truncated=None):
+        """
+        :param doc: THE Record FROM construct_docs()
+        :param id: etl.id
+        :param source: etl.source, FROM encode_etl()
+        :param timestamp: etl.timestamp
+        :param cache: FragmentCache FOR THIS BATCH
+        :param truncated: MAP FROM NESTED PATH TO NUMBER OF CHILDREN LEFT OUT (etl.truncated)
+        :return: ONE LINE OF TYPED JSON
+        """
+        etl = (
+            '{"id":' + _NUMBER_PREFIX + text_type(id) + "}," +
+            '"source":' + source + "," +
+            '"timestamp":' + _NUMBER_PREFIX + float2json(Date(timestamp).unix) + "}"
+        )
+        if truncated:
+            etl += ',"truncated":{' + ",".join(
+                quote(encode_property(k)) + ":" + _NUMBER_PREFIX + text_type(v) + "}"
+                for k, v in sorted(truncated.items())
+            ) + _OBJECT_SUFFIX
+        etl += _OBJECT_SUFFIX
+        fact = self.encode_doc(doc, cache)
+        if fact is None:
+            return '{"etl":' + etl + _OBJECT_SUFFIX
+        # PROPERTIES IN ORDER, AS TypedInserter DOES
+        if self.fact_name < '"etl"':
+            return "{" + self.fact_name + ":" + fact + ',"etl":' + etl + _OBJECT_SUFFIX
+        return '{"etl":' + etl + "," + self.fact_name + ":" + fact + _OBJECT_SUFFIX
+
+
+def _compile(node, path, ids, nested):
+    """
+    :param nested: FILLED WITH THE PATH OF EACH NESTED LIST, AND THE FUNCTION ENCODING ONE OF ITS ELEMENTS
+    :return: FUNCTION FROM (VALUE, FragmentCache) TO TYPED JSON (OR None WHEN THERE IS NOTHING TO WRITE)
+    """
+    if not isinstance(node, dict):
+        if node in NUMBER_TYPES:
+            return _number
+        return _string
+
+    properties = sorted(
+        (quote(encode_property(name.lower())), name, _compile(child, path + (name,), ids, nested))
+        for name, child in node["fields"].items()
+    )
+
+    def encode_object(value, cache):
+        if value is None:
+            return None
+        acc = []
+        for quoted, name, encode in properties:
+            v = value.get(name)
+            if v is None:
+                continue
+            v = encode(v, cache)
+            if v is None:
+                continue
+            acc.append(quoted + ":" + v)
+        if not acc:
+            return None
+        return "{" + ",".join(acc) + _OBJECT_SUFFIX
+
+    if not node["repeated"]:
+        key = identity(node, path, ids) if path else None
+        if key:
+            return memoize(encode_object, key)
+        return encode_object
+
+    nested[path] = encode_object
+
+    def encode_nested(value, cache):
+        if value.__class__ is Spool:
+            # THE ELEMENTS ARE ALREADY ENCODED, splice() PUTS THEM HERE
+            return value.marker if value.count else None
+        if not isinstance(value, list):
+            value = [value]
+        acc = [e for e in (encode_object(v, cache) for v in value) if e is not None]
+        if not acc:
+            return None
+        return _NESTED_PREFIX + ",".join(acc) + "]" + _EXISTS_SUFFIX + text_type(len(acc)) + "}"
+
+    return encode_nested
+
+
+def _list(count):
+    return _NESTED_PREFIX, "]" + _EXISTS_SUFFIX + text_type(count) + "}"
+
+
+def _number(value, cache=None):
+    _type = value.__class__
+    if _type in (int, long):
+        return _NUMBER_PREFIX + text_type(value) + "}"
+    elif _type in (float, Decimal):
+        return _NUMBER_PREFIX + float2json(value) + "}"
+    elif _type in (datetime, date, Date):
+        return _NUMBER_PREFIX + float2json(Date(value).unix) + "}"
+    elif _type is bool:
+        return _NUMBER_PREFIX + ("1" if value else "0") + "}"
+    elif _type in (text_type, binary_type):
+        if value in ("", b""):
+            return None
+        if Math.is_number(value):
+            return _NUMBER_PREFIX + float2json(float(value)) + "}"
+    # NOT A NUMBER AFTER ALL (eg A SQLITE TEXT IN AN INTEGER COLUMN)
+    return _string(value)
+
+
+def _string(value, cache=None):
+    _type = value.__class__
+    if _type is text_type:
+        if not value:
+            return None
+        return _STRING_PREFIX + quote(value) + "}"
+    elif _type is binary_type:
+        if not value:
+            return None
+        return _STRING_PREFIX + quote(utf82unicode(value)) + "}"
+    elif _type in (datetime, date, Date):
+        return _number(value)
+    return _STRING_PREFIX + quote(text_type(value)) + "}"
@@ -0,0 +1,20 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+BENCHMARK THE PIPELINE STAGES WITHOUT A DATABASE SERVER
+
+snowflake - MAKE A SYNTHETIC SQLITE SNOWFLAKE OF ANY WIDTH, DEPTH AND FAN-OUT
+streams   - RECORD THE UNION QUERY RESULT, AND REPLAY IT
+suite     - TIME EACH STAGE, AND COMPARE WITH A BASELINE
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --facts=2000 --depth=2 --fanout=3
+"""
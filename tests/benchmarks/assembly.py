@@ -0,0 +1,111 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+COMPARE Extract.construct_docs() WITH THE OLD Data-BASED ASSEMBLY, ON THE
+tests/test_extract.py DATA (FROM THE SQLITE SNAPSHOT), REPEATED MANY TIMES
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --stages=assembly --docs=8000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from copy import deepcopy
+
+from mo_dots import Data, wrap, unwrap, Null, relative_field
+from mo_logs import Log
+from pyLibrary.env import elasticsearch
+from pyLibrary import convert
+from pyLibrary.sql import SQL_SELECT, SQL_FROM, SQL_WHERE, sql_iso, sql_list
+from pyLibrary.sql.mysql import quote_column
+
+from mysql_to_s3.extract import Extract
+from mysql_to_s3.sqlite_db import SqliteDB
+from tests.benchmarks.suite import stage
+from tests.test_sqlite import config_template, TestSqlite
+
+FACTS = [10, 11, 12, 13]
+
+
+def old_construct_docs(self, cursor, append, please_stop):
+    """
+    THE ASSEMBLY, AS IT WAS, WITH Data
+    """
+    null_values = set(self.settings.snowflake.null_values) | {None}
+    count = 0
+    columns = tuple(wrap(c) for c in self.schema.columns)
+    curr_record = Null
+    for rownum, row in enumerate(cursor):
+        nested_path = []
+        next_record = None
+        for c, value in zip(columns, row):
+            if value in null_values:
+                continue
+            if len(nested_path) < len(c.nested_path):
+                nested_path = unwrap(c.nested_path)
+                next_record = Data()
+            next_record[c.put] = value
+
+        if len(nested_path) > 1:
+            path = nested_path[-2]
+            children = curr_record[path]
+            if children == None:
+                children = curr_record[path] = wrap([])
+            if len(nested_path) > 2:
+                parent_path = path
+                for path in list(reversed(nested_path[0:-2:])):
+                    parent = children.last()
+                    relative_path = relative_field(path, parent_path)
+                    children = parent[relative_path]
+                    if children == None:
+                        children = parent[relative_path] = wrap([])
+                    parent_path = path
+            children.append(next_record)
+            continue
+
+        if curr_record:
+            append(curr_record["id"], count)
+            count += 1
+        curr_record = next_record
+    if curr_record:
+        append(curr_record["id"], count)
+
+
+def run(results, num_docs=8000, repeat=3):
+    """
+    ADD THE assembly_data (THE OLD ASSEMBLY) AND assembly_record STAGES TO results
+    """
+    TestSqlite.setUpClass()
+    config = deepcopy(config_template)
+    extractor = Extract(kwargs=config)
+    with SqliteDB(kwargs=config.snowflake.database) as db:
+        ids = (
+            SQL_SELECT + quote_column("id") +
+            SQL_FROM + config.snowflake.fact_table +
+            SQL_WHERE + quote_column("id") + " in " + sql_iso(sql_list(map(db.quote_value, FACTS)))
+        )
+        rows = list(db.query(extractor.schema.get_sql(ids), stream=True, row_tuples=True))
+    rows = rows * max(1, num_docs // len(FACTS))
+
+    def assemble(construct):
+        docs = []
+        construct(extractor, iter(rows), lambda v, i: docs.append(v), Null)
+        return docs
+
+    old_docs = stage(results, "assembly_data", lambda: assemble(old_construct_docs), len(rows), None, repeat)
+    new_docs = stage(results, "assembly_record", lambda: assemble(Extract.construct_docs), len(rows), None, repeat)
+    if len(old_docs) != len(new_docs):
+        Log.error("expecting same number of documents")
+    for o, n in zip(old_docs, new_docs):
+        if convert.value2json(elasticsearch.scrub(o)) != convert.value2json(elasticsearch.scrub(n)):
+            Log.error("expecting same documents")
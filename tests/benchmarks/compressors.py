@@ -0,0 +1,66 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+COMPARE THE write_lines() CODECS ON DOCUMENTS SHAPED LIKE THE TREEHERDER
+JOB EXTRACT: MB/sec OF JSON COMPRESSED, AND THE COMPRESSION RATIO
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --stages=compression --docs=20000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from tempfile import TemporaryFile
+
+from mo_json import value2json
+from mo_logs import Log
+
+from pyLibrary.env.big_data import ilines2file
+from tests.benchmarks.json_encoders import treeherder_doc
+from tests.benchmarks.suite import stage
+
+CODECS = [
+    ("none", None, 1),
+    ("gzip", 1, 1),
+    ("gzip", 6, 1),
+    ("gzip", 9, 1),
+    ("gzip", 6, 4),
+    ("gzip", 9, 4),
+    ("zstd", 3, 1),
+    ("zstd", 3, 4),
+    ("zstd", 10, 1)
+]
+
+
+def run(results, num_docs=20000, repeat=3, codecs=CODECS):
+    """
+    ADD A compress_<codec>_<level>_x<threads> STAGE TO results FOR EACH OF THE codecs THAT CAN BE USED
+    """
+    lines = [value2json(treeherder_doc(i)) for i in range(num_docs)]
+    size = sum(len(l.encode("utf8")) + 1 for l in lines)
+    for codec, level, threads in codecs:
+        name = "compress_" + codec + ("_" + str(level) + "_x" + str(threads) if level is not None else "")
+        try:
+            compressed = stage(results, name, lambda: _compress(lines, codec, level, threads), len(lines), size, repeat)
+            Log.note("{{name}} ratio {{ratio}}", name=name, ratio=round(size / compressed, 2))
+        except Exception as e:
+            Log.warning("Can not benchmark {{codec}}", codec=codec, cause=e)
+
+
+def _compress(lines, codec, level, threads):
+    """
+    :return: NUMBER OF COMPRESSED BYTES
+    """
+    with TemporaryFile() as buff:
+        ilines2file(lines, buff, codec=codec, level=level, threads=threads)
+        return buff.tell()
@@ -0,0 +1,126 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+TIME THE IMPORT OF A MODULE, LIKE `python -X importtime` (WHICH PYTHON 2 DOES NOT HAVE)
+
+SHOWS THE SELF AND CUMULATIVE SECONDS OF THE SLOWEST MODULES, AND THE
+SECONDS SPENT IN EACH TOP LEVEL PACKAGE. EXITS WITH 1 IF A --forbid
+MODULE IS LOADED, OR THE IMPORT TAKES LONGER THAN --max SECONDS
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/imports.py --module=mysql_to_s3.extract --forbid=boto,jx_elasticsearch,pyLibrary.env.elasticsearch
+
+RUN IT ON ITS OWN; IT ONLY USES THE STANDARD LIBRARY, SO NOTHING IS LOADED BEFORE
+THE TIMING STARTS. THE imports STAGE OF suite.py RUNS IT IN A NEW PROCESS, WITH --json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import resource
+import sys
+from collections import defaultdict
+from timeit import default_timer
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+def time_import(module):
+    """
+    :return: (TOTAL SECONDS, LIST OF (name, self seconds, cumulative seconds))
+    """
+    real_import = builtins.__import__
+    stack = [[0]]  # CHILD SECONDS OF EACH import IN PROGRESS
+    found = []
+
+    def timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return real_import(name, *args, **kwargs)
+        before = len(sys.modules)
+        known = set(sys.modules)
+        stack.append([0])
+        start = default_timer()
+        try:
+            return real_import(name, *args, **kwargs)
+        finally:
+            duration = default_timer() - start
+            children = stack.pop()[0]
+            if len(sys.modules) != before:
+                stack[-1][0] += duration
+                new = [m for m in sys.modules if m not in known and sys.modules[m] is not None]
+                loaded = ([m for m in new if m == name or m.endswith("." + name)] or new or [name])[0]
+                found.append((loaded, duration - children, duration))
+
+    builtins.__import__ = timed_import
+    start = default_timer()
+    try:
+        __import__(module)
+    finally:
+        builtins.__import__ = real_import
+    return default_timer() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="mysql_to_s3.extract", help="module to import")
+    parser.add_argument("--top", type=int, default=25, help="number of modules to show")
+    parser.add_argument("--forbid", default="", help="comma separated modules that must not be loaded")
+    parser.add_argument("--max", type=float, default=None, help="most seconds allowed for the import")
+    parser.add_argument("--json", action="store_true", help="print the suite.py stage result, and problems, as JSON")
+    args = parser.parse_args()
+
+    total, found = time_import(args.module)
+    problems = []
+    for name in filter(None, args.forbid.split(",")):
+        if name in sys.modules:
+            problems.append(name + " is loaded")
+    if args.max is not None and total > args.max:
+        problems.append("import took {0:.3f} seconds, more than {1}".format(total, args.max))
+
+    if args.json:
+        scale = 1 if sys.platform == "darwin" else 1000  # ru_maxrss IS KB ON LINUX, BYTES ON OSX
+        print(json.dumps({
+            "stage": {
+                "items": 1,
+                "items_per_second": 1 / max(total, 1e-9),
+                "mb_per_second": None,
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1000 * 1000)
+            },
+            "problems": problems
+        }))
+        sys.exit(1 if problems else 0)
+
+    print("     self | cumulative | module")
+    for name, self_seconds, cumulative in sorted(found, key=lambda f: -f[1])[:args.top]:
+        print("{0:9.3f} | {1:10.3f} | {2}".format(self_seconds, cumulative, name))
+
+    packages = defaultdict(float)
+    for name, self_seconds, _ in found:
+        packages[name.split(".")[0]] += self_seconds
+    print("\n     self | package")
+    for name, self_seconds in sorted(packages.items(), key=lambda p: -p[1])[:args.top]:
+        print("{0:9.3f} | {1}".format(self_seconds, name))
+
+    print("\n{0:.3f} seconds, {1} modules".format(total, len(sys.modules)))
+    for p in problems:
+        print("PROBLEM: " + p)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
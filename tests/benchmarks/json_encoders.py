@@ -0,0 +1,95 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+COMPARE value2json WITH THE OLD scrub() + utf8_json_encoder, ON DOCUMENTS
+SHAPED LIKE THE TREEHERDER JOB EXTRACT
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --stages=value2json --docs=2000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap
+from mo_future import text_type, utf8_json_encoder
+from mo_json import scrub, value2json
+from mo_logs import Log
+from mo_times import Date
+
+from tests.benchmarks.suite import stage
+
+
+def treeherder_doc(i):
+    start = Date("2017-06-01").unix + i * 37
+    return wrap({"job": {
+        "id": 100000000 + i,
+        "guid": "c6f2a6b1-7d29-4f5b-8d1c-%012d/0" % i,
+        "result": ["success", "testfailed", "busted"][i % 3],
+        "state": "completed",
+        "tier": 1 + i % 3,
+        "submit_time": Date(start - 60),
+        "start_time": Date(start),
+        "end_time": Date(start + 915.5),
+        "last_modified": Date(start + 1000),
+        "signature": {
+            "name": "test-linux64/opt-mochitest-e10s-" + text_type(i % 12),
+            "build_platform": "linux64",
+            "build_architecture": "x86_64",
+            "build_os_name": "linux",
+            "option_collection_hash": "102210fe594ee9b33d82058545b1ed14f4c8206e",
+            "job_group": {"name": "Mochitests executed by TaskCluster with e10s", "symbol": "M-e10s"},
+            "job_type": {"name": "test-linux64/opt-mochitest-e10s-" + text_type(i % 12), "symbol": text_type(i % 12)}
+        },
+        "push": {
+            "revision": "%040x" % (i * 7919),
+            "author": "someone@example.com",
+            "time": Date(start - 3600),
+            "repository": {"name": "mozilla-inbound", "url": "https://hg.mozilla.org/integration/mozilla-inbound"}
+        },
+        "job_log": [
+            {
+                "name": "builds-4h",
+                "url": "https://queue.taskcluster.net/v1/task/%d/runs/0/artifacts/public/logs/live_backing.log" % i,
+                "status": 1,
+                "failure_line": [
+                    {"line": 1000 + j, "action": "test_result", "test": "dom/tests/test_%d.html" % j, "status": "FAIL", "expected": "PASS", "message": "   "}
+                    for j in range(i % 4)
+                ]
+            }
+        ],
+        "job_detail": [
+            {"title": "artifact uploaded", "value": "log_%d.txt" % j, "url": None}
+            for j in range(3)
+        ],
+        "bugjobmap": None,
+        "failure_classification": {"name": "not classified"},
+        "ratio": 0.1 * i
+    }})
+
+
+def run(results, num_docs=2000, repeat=3):
+    """
+    ADD THE value2json AND value2json_old (scrub + utf8_json_encoder) STAGES TO results
+    """
+    docs = [treeherder_doc(i) for i in range(num_docs)]
+    for d in docs:
+        if value2json(d) != _old_encode(d):
+            Log.error("expecting same output")
+    num_bytes = sum(len(value2json(d).encode("utf8")) for d in docs)
+
+    stage(results, "value2json_old", lambda: [_old_encode(d) for d in docs], len(docs), num_bytes, repeat)
+    stage(results, "value2json", lambda: [value2json(d) for d in docs], len(docs), num_bytes, repeat)
+
+
+def _old_encode(value):
+    return text_type(utf8_json_encoder(scrub(value)))
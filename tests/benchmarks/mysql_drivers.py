@@ -0,0 +1,67 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+COMPARE THE MySQL DRIVERS: rows/sec STREAMED WITH query(stream=True, row_tuples=True),
+WITH AND WITHOUT THE COMPRESSED PROTOCOL. DRIVERS THAT ARE NOT INSTALLED ARE SKIPPED
+
+NEEDS A SERVER; THE database OF THE --mysql SETTINGS FILE IS USED, AND
+THE QUERY IS ANY SELECT THAT RETURNS MANY ROWS
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --stages=mysql --mysql=tests/resources/config/test.json --sql="SELECT * FROM job LIMIT 200000"
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from copy import deepcopy
+
+from mo_logs import Log
+from pyLibrary.sql.mysql import MySQL
+
+from tests.benchmarks.suite import stage
+
+DRIVERS = ["pymysql", "mysqlclient", "mysql-connector"]
+
+
+def run(results, database, sql, fetch_size=1000, repeat=3):
+    """
+    ADD A mysql_<driver> STAGE (AND mysql_<driver>_compressed) TO results FOR EACH INSTALLED DRIVER
+    :param database: MySQL SETTINGS
+    :param sql: QUERY TO STREAM
+    """
+    for driver in DRIVERS:
+        for compress in [False, True]:
+            if driver == "pymysql" and compress:
+                continue
+            config = deepcopy(database)
+            config.driver = driver
+            config.compress = compress
+            config.fetch_size = fetch_size
+            config.readonly = True
+            name = "mysql_" + driver.replace("-", "_") + ("_compressed" if compress else "")
+            try:
+                with MySQL(kwargs=config) as db:
+                    num = _stream(db, sql)  # WARM THE SERVER, AND COUNT THE ROWS
+                    stage(results, name, lambda: _stream(db, sql), num, None, repeat)
+            except Exception as e:
+                if "No module named" in e:
+                    Log.note("{{driver}} is not installed", driver=driver)
+                    break
+                Log.warning("Can not time {{driver}}", driver=driver, cause=e)
+
+
+def _stream(db, sql):
+    num = 0
+    for _ in db.query(sql, stream=True, row_tuples=True):
+        num += 1
+    return num
@@ -0,0 +1,152 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+import sqlite3
+
+from mo_dots import wrap
+from mo_files import File
+from mo_json import value2json
+from mo_logs import Log
+
+SCHEMA = "benchmark"
+FACT_TABLE = "fact"
+LOOKUP_ROWS = 100
+START_TIME = 1500000000  # UNIX TIME OF THE FIRST FACT
+WORDS = ["alpha", "beta", "gamma", "delta", "linux64", "windows10-64", "opt", "debug", "mochitest-e10s", "reftest"]
+
+
+def make_snowflake(filename, facts=1000, width=4, depth=2, fanout=3, seed=0):
+    """
+    MAKE A SQLITE SNOWFLAKE:
+
+        fact(id, modified, lookup, v0...)       lookup -> lookup1(id)
+        lookup1(id, next, v0...)                next -> lookup2(id) ... lookup<depth>
+        child1(id, parent, v0...)               fanout ROWS FOR EACH fact
+        child2(id, parent, v0...)               fanout ROWS FOR EACH child1 ... child<depth>
+
+    :param facts: NUMBER OF fact ROWS
+    :param width: NUMBER OF VALUE COLUMNS IN EACH TABLE (INT, TEXT, REAL, IN TURN)
+    :param depth: NUMBER OF LOOKUP TABLES (INNER OBJECTS), AND OF CHILD TABLES (NESTED DOCUMENTS)
+    :param fanout: CHILDREN FOR EACH PARENT
+    :return: Extract SETTINGS FOR THE SNOWFLAKE
+    """
+    file = File(filename)
+    file.delete()
+    if not file.parent.exists:
+        file.parent.create()
+
+    rand = random.Random(seed)
+    values = [_COLUMN_TYPES[i % 3] for i in range(width)]
+    columns = "".join(", v" + str(i) + " " + t for i, t in enumerate(values))
+
+    def row(*prefix):
+        return prefix + tuple(_MAKERS[t](rand) for t in values)
+
+    db = sqlite3.connect(file.abspath)
+    try:
+        for d in range(depth, 0, -1):
+            if d == depth:
+                db.execute("CREATE TABLE lookup" + str(d) + " (id INTEGER PRIMARY KEY, next INTEGER" + columns + ")")
+            else:
+                db.execute(
+                    "CREATE TABLE lookup" + str(d) + " (id INTEGER PRIMARY KEY, next INTEGER" + columns +
+                    ", FOREIGN KEY (next) REFERENCES lookup" + str(d + 1) + " (id))"
+                )
+            _insert(db, "lookup" + str(d), [
+                row(i, rand.randint(1, LOOKUP_ROWS) if d < depth else None)
+                for i in range(1, LOOKUP_ROWS + 1)
+            ])
+
+        db.execute(
+            "CREATE TABLE " + FACT_TABLE + " (id INTEGER PRIMARY KEY, modified INTEGER, lookup INTEGER" + columns +
+            (", FOREIGN KEY (lookup) REFERENCES lookup1 (id))" if depth else ")")
+        )
+        _insert(db, FACT_TABLE, [
+            row(i, START_TIME + i * 60, rand.randint(1, LOOKUP_ROWS) if depth else None)
+            for i in range(1, facts + 1)
+        ])
+
+        parents = range(1, facts + 1)
+        for d in range(1, depth + 1):
+            parent_table = FACT_TABLE if d == 1 else "child" + str(d - 1)
+            db.execute(
+                "CREATE TABLE child" + str(d) + " (id INTEGER PRIMARY KEY, parent INTEGER" + columns +
+                ", FOREIGN KEY (parent) REFERENCES " + parent_table + " (id))"
+            )
+            rows = []
+            for p in parents:
+                for _ in range(fanout):
+                    rows.append(row(len(rows) + 1, p))
+            _insert(db, "child" + str(d), rows)
+            parents = [r[0] for r in rows]
+        db.commit()
+    finally:
+        db.close()
+
+    Log.note(
+        "Made snowflake {{file}} with {{facts}} facts, width={{width}}, depth={{depth}}, fanout={{fanout}}",
+        file=file.abspath,
+        facts=facts,
+        width=width,
+        depth=depth,
+        fanout=fanout
+    )
+    return settings(filename)
+
+
+def settings(filename):
+    """
+    :return: Extract SETTINGS FOR THE SNOWFLAKE IN filename
+    """
+    file = File(filename)
+    last = File.new_instance(file.parent, "benchmark_last_run.json")
+    # PAST ALL THE FACTS, SO THE LISTER THAT Extract STARTS HAS NOTHING TO DO
+    last.write(value2json([[0, 0], [START_TIME * 2, 0]]))
+    return wrap({
+        "extract": {
+            "last": last.abspath,
+            "field": ["modified", "id"],
+            "type": ["number", "number"],
+            "start": [START_TIME, 0],
+            "batch": [3600, 1000]
+        },
+        "destination": File.new_instance(file.parent, "benchmark_output.json").abspath,
+        "snowflake": {
+            "fact_table": FACT_TABLE,
+            "show_foreign_keys": False,
+            "null_values": ["-", "unknown", ""],
+            "add_relations": [],
+            "include": [],
+            "exclude": [],
+            "reference_only": [],
+            "database": {
+                "filename": file.abspath,
+                "schema": SCHEMA
+            }
+        }
+    })
+
+
+def _insert(db, table, rows):
+    if rows:
+        db.executemany("INSERT INTO " + table + " VALUES (" + ",".join("?" * len(rows[0])) + ")", rows)
+
+
+_COLUMN_TYPES = ["INTEGER", "TEXT", "REAL"]
+_MAKERS = {
+    "INTEGER": lambda rand: rand.randint(0, 1000000),
+    "TEXT": lambda rand: rand.choice(WORDS) + "-" + str(rand.randint(0, 99)),
+    "REAL": lambda rand: round(rand.random() * 1000, 3)
+}
@@ -0,0 +1,68 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log
+from pyLibrary.sql import SQL_SELECT, SQL_FROM
+from pyLibrary.sql.mysql import quote_column
+
+from mysql_to_s3.extract import Extract
+from mysql_to_s3.sqlite_db import SqliteDB
+
+
+def record(config, filename, about=None):
+    """
+    RUN THE UNION QUERY FOR ALL THE FACTS, AND WRITE THE ROWS AS JSON LINES
+    :param config: Extract SETTINGS
+    :param filename: WHERE TO WRITE THE ROWS
+    :param about: DESCRIPTION OF THE DATA, KEPT IN THE FIRST LINE
+    :return: NUMBER OF ROWS
+    """
+    extractor = Extract(kwargs=config)
+    ids = SQL_SELECT + quote_column("id") + SQL_FROM + config.snowflake.fact_table
+    file = File(filename)
+    count = [0]
+
+    def lines(rows):
+        yield value2json(wrap(about)) + "\n"
+        for r in rows:
+            count[0] += 1
+            yield value2json(list(r)) + "\n"
+
+    with SqliteDB(kwargs=config.snowflake.database) as db:
+        file.write(lines(db.query(extractor.schema.get_sql(ids), stream=True, row_tuples=True)))
+    Log.note("Recorded {{num}} rows to {{file}}", num=count[0], file=file.abspath)
+    return count[0]
+
+
+def about(filename):
+    """
+    :return: THE DESCRIPTION GIVEN TO record(), OR None IF THERE IS NO RECORDING
+    """
+    file = File(filename)
+    if not file.exists:
+        return None
+    for line in file.read_lines():
+        return json2value(line)
+
+
+def replay(filename):
+    """
+    :return: ALL THE RECORDED ROWS, AS TUPLES, READY TO GIVE TO construct_docs() AGAIN AND AGAIN
+    """
+    lines = File(filename).read_lines()
+    next(lines)  # SKIP THE DESCRIPTION
+    return [tuple(json2value(line)) for line in lines]
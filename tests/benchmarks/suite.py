@@ -0,0 +1,295 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+"""
+TIME EACH STAGE OF THE PIPELINE ON A REPLAYED ROW STREAM:
+
+    construct_docs - ROWS TO DOCUMENTS
+    encode         - DOCUMENTS TO JSON LINES (JsonEncoder WITH A FragmentCache, AS Extract DOES)
+    compress       - JSON LINES TO A gzip FILE (ilines2file)
+    counters       - (modified, id) TO BATCH KEYS (DurationCounter/BatchCounter)
+
+OTHER --stages, ADDED TO THE SAME RESULTS:
+
+    mysql          - rows/sec OF EACH INSTALLED MySQL DRIVER (mysql_drivers.py; NEEDS --mysql AND --sql)
+    import         - IMPORTS/sec OF --module, IN A NEW PROCESS (imports.py); A LOADED --forbid MODULE IS A REGRESSION
+    value2json     - --docs TREEHERDER-LIKE DOCUMENTS TO JSON, NEW AND OLD ENCODER (json_encoders.py)
+    compression    - THOSE DOCUMENTS' JSON LINES WITH EACH write_lines() CODEC (compressors.py)
+    assembly       - ROWS OF THE test_sqlite SNAPSHOT TO --docs DOCUMENTS, WITH Record AND THE OLD Data (assembly.py)
+
+AND COMPARE items/sec, MB/sec AND PEAK RSS WITH THE BASELINE
+
+    export PYTHONPATH=.:vendor
+    python tests/benchmarks/suite.py --facts=2000 --width=4 --depth=2 --fanout=3
+    python tests/benchmarks/suite.py --save      # MAKE THESE RESULTS THE BASELINE
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import resource
+import subprocess
+import sys
+from copy import deepcopy
+from tempfile import TemporaryFile
+from timeit import default_timer
+
+from mo_dots import Null, wrap
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log, startup
+from pyLibrary.env.big_data import ilines2file
+
+from mysql_to_s3.counter import Counter, BatchCounter, DurationCounter
+from mysql_to_s3.extract import Extract
+from mysql_to_s3.fragments import FragmentCache, JsonEncoder
+from tests.benchmarks import snowflake, streams
+
+OUTPUT = "tests/output/benchmarks/"
+MB = 1000 * 1000
+PIPELINE = ["construct_docs", "encode", "compress", "counters"]
+
+
+def run(config, rows, repeat=3):
+    """
+    :param config: Extract SETTINGS FOR THE SNOWFLAKE THE rows CAME FROM
+    :param rows: THE REPLAYED UNION QUERY RESULT
+    :param repeat: RUN EACH STAGE THIS MANY TIMES, AND KEEP THE BEST
+    :return: MAP FROM STAGE NAME TO {"items", "items_per_second", "mb_per_second", "peak_rss_mb"}
+    """
+    extractor = Extract(kwargs=deepcopy(config))
+    fact_table = config.snowflake.fact_table
+    results = {}
+
+    def construct_docs():
+        docs = []
+        extractor.construct_docs(iter(rows), lambda v, i: docs.append(v), Null)
+        return docs
+    row_bytes = sum(len(value2json(list(r))) for r in rows)
+    docs = stage(results, "construct_docs", construct_docs, len(rows), row_bytes, repeat)
+
+    encoder = JsonEncoder(extractor.schema.columns, fact_table)
+    source = encoder.encode_etl({"id": 0})
+
+    def encode():
+        cache = FragmentCache()
+        return [encoder.encode(d, i, source, 0, cache) for i, d in enumerate(docs)]
+    lines = stage(results, "encode", encode, len(docs), None, repeat)
+    line_bytes = sum(len(l.encode("utf8")) + 1 for l in lines)
+    results["encode"]["mb_per_second"] = line_bytes / MB / results["encode"]["seconds"]
+
+    def compress():
+        with TemporaryFile() as buff:
+            ilines2file(lines, buff, codec="gzip", level=6)
+            return buff.tell()
+    stage(results, "compress", compress, len(lines), line_bytes, repeat)
+
+    keys = [(snowflake.START_TIME + i * 60, i) for i in range(len(docs))]
+
+    def counters():
+        counter = DurationCounter(start=snowflake.START_TIME, duration="hour", child=BatchCounter(start=0, size=1000, child=Counter(start=0)))
+        return [counter.next(k) for k in keys]
+    stage(results, "counters", counters, len(keys), None, repeat)
+
+    for r in results.values():
+        del r["seconds"]
+    return wrap(results)
+
+
+def stage(results, name, function, items, num_bytes, repeat):
+    """
+    TIME function (THE BEST OF repeat RUNS), AND ADD ITS RESULT TO results
+    :return: WHAT function RETURNED
+    """
+    _reset_peak_rss()
+    best = None
+    output = None
+    for _ in range(repeat):
+        output = None  # SO THE LAST RESULT IS NOT COUNTED IN THE PEAK TWICE
+        start = default_timer()
+        output = function()
+        duration = default_timer() - start
+        best = duration if best is None else min(best, duration)
+    best = max(best, 1e-9)
+    results[name] = {
+        "items": items,
+        "seconds": best,
+        "items_per_second": items / best,
+        "mb_per_second": num_bytes / MB / best if num_bytes is not None else None,
+        "peak_rss_mb": _peak_rss() / MB
+    }
+    return output
+
+
+def _reset_peak_rss():
+    # LINUX ONLY: "5" RESETS VmHWM; ELSEWHERE THE PEAK IS FOR THE WHOLE PROCESS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except Exception:
+        pass
+
+
+def _peak_rss():
+    """
+    :return: PEAK RESIDENT BYTES SINCE THE LAST _reset_peak_rss()
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1000
+    except Exception:
+        pass
+    scale = 1 if sys.platform == "darwin" else 1000  # ru_maxrss IS KB ON LINUX, BYTES ON OSX
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    :param tolerance: FRACTION WORSE THAN THE BASELINE THAT IS STILL NOT A REGRESSION
+    :return: LIST OF REGRESSIONS, AS TEXT
+    """
+    regressions = []
+    for stage, base in baseline.items():
+        result = results[stage]
+        if not result:
+            continue
+        for measure in ["items_per_second", "mb_per_second"]:
+            if base[measure] and result[measure] < base[measure] * (1 - tolerance):
+                regressions.append(
+                    stage + " " + measure + " is " + _round(result[measure]) + ", was " + _round(base[measure])
+                )
+        if base.peak_rss_mb and result.peak_rss_mb > base.peak_rss_mb * (1 + tolerance):
+            regressions.append(
+                stage + " peak_rss_mb is " + _round(result.peak_rss_mb) + ", was " + _round(base.peak_rss_mb)
+            )
+    return regressions
+
+
+def import_stage(module, forbid=""):
+    """
+    TIME THE IMPORT OF module IN A NEW PROCESS, SO NOTHING IS LOADED BEFORE THE TIMING STARTS
+    :return: (STAGE RESULT, LIST OF PROBLEMS)
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([".", "vendor"])
+    process = subprocess.Popen(
+        [sys.executable, "-W", "ignore", File("tests/benchmarks/imports.py").abspath, "--json", "--module=" + module, "--forbid=" + forbid],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stdout, stderr = process.communicate()
+    try:
+        output = json2value(stdout.decode("utf8").strip().split("\n")[-1])
+    except Exception as e:
+        Log.error("Can not time the import of {{module}}:\n{{error|indent}}", module=module, error=stderr.decode("utf8"), cause=e)
+    return output.stage, list(output.problems)
+
+
+def _round(value):
+    return "{0:.1f}".format(value)
+
+
+def main():
+    settings = startup.argparse([
+        {"name": ["--facts"], "help": "number of fact rows", "type": int, "dest": "facts", "default": 2000},
+        {"name": ["--width"], "help": "value columns in each table", "type": int, "dest": "width", "default": 4},
+        {"name": ["--depth"], "help": "number of lookup tables, and of nested child tables", "type": int, "dest": "depth", "default": 2},
+        {"name": ["--fanout"], "help": "children for each parent", "type": int, "dest": "fanout", "default": 3},
+        {"name": ["--repeat"], "help": "runs of each stage; the best is kept", "type": int, "dest": "repeat", "default": 3},
+        {"name": ["--baseline"], "help": "file with the baseline results", "type": str, "dest": "baseline", "default": OUTPUT + "baseline.json"},
+        {"name": ["--tolerance"], "help": "fraction worse than the baseline before it is a regression", "type": float, "dest": "tolerance", "default": 0.1},
+        {"name": ["--save"], "help": "make these results the baseline", "action": "store_true", "dest": "save"},
+        {"name": ["--stages"], "help": "comma separated: pipeline, mysql, import, value2json, compression, assembly", "type": str, "dest": "stages", "default": "pipeline"},
+        {"name": ["--mysql"], "help": "settings file with the database, for the mysql stage", "type": str, "dest": "mysql"},
+        {"name": ["--sql"], "help": "query to stream, for the mysql stage", "type": str, "dest": "sql"},
+        {"name": ["--fetch_size"], "help": "rows fetched at a time, for the mysql stage", "type": int, "dest": "fetch_size", "default": 1000},
+        {"name": ["--module"], "help": "module to import, for the import stage", "type": str, "dest": "module", "default": "mysql_to_s3.extract"},
+        {"name": ["--forbid"], "help": "comma separated modules the import must not load, for the import stage", "type": str, "dest": "forbid", "default": ""},
+        {"name": ["--docs"], "help": "number of documents, for the value2json, compression and assembly stages", "type": int, "dest": "docs", "default": 2000}
+    ])
+    Log.start()
+    try:
+        stages = set(settings.stages.split(","))
+        shape = {k: settings[k] for k in ["facts", "width", "depth", "fanout"]}
+        name = "snowflake_{facts}_{width}_{depth}_{fanout}".format(**shape)
+        results = wrap({})
+        problems = []
+        if "pipeline" in stages:
+            recording = OUTPUT + name + ".rows.json"
+            if streams.about(recording) == shape:
+                config = snowflake.settings(OUTPUT + name + ".sqlite")
+            else:
+                config = snowflake.make_snowflake(OUTPUT + name + ".sqlite", **shape)
+                streams.record(config, recording, about=shape)
+            rows = streams.replay(recording)
+            results = run(config, rows, repeat=settings.repeat)
+        if "mysql" in stages:
+            import mo_json_config
+            from tests.benchmarks import mysql_drivers
+
+            if not settings.mysql or not settings.sql:
+                Log.error("The mysql stage needs --mysql and --sql")
+            mysql_drivers.run(results, mo_json_config.get("file:///" + File(settings.mysql).abspath).database, settings.sql, settings.fetch_size, settings.repeat)
+        if "import" in stages:
+            results["import"], found = import_stage(settings.module, settings.forbid)
+            problems.extend(found)
+        if "value2json" in stages:
+            from tests.benchmarks import json_encoders
+
+            json_encoders.run(results, settings.docs, settings.repeat)
+        if "compression" in stages:
+            from tests.benchmarks import compressors
+
+            compressors.run(results, settings.docs, settings.repeat)
+        if "assembly" in stages:
+            from tests.benchmarks import assembly
+
+            assembly.run(results, settings.docs, settings.repeat)
+
+        print("stage".ljust(24) + "items/sec".rjust(12) + "MB/sec".rjust(10) + "peak RSS MB".rjust(14))
+        for stage in [s for s in PIPELINE if s in results] + sorted(s for s in results.keys() if s not in PIPELINE):
+            r = results[stage]
+            print(
+                stage.ljust(24) +
+                (str(int(r.items_per_second)) if r.items_per_second >= 100 else _round(r.items_per_second)).rjust(12) +
+                (_round(r.mb_per_second) if r.mb_per_second else "").rjust(10) +
+                _round(r.peak_rss_mb).rjust(14)
+            )
+
+        baseline_file = File(settings.baseline)
+        baselines = baseline_file.read_json() if baseline_file.exists else wrap({})
+        baseline = baselines[name]
+        if settings.save:
+            baselines[name] = results
+            baseline_file.write(value2json(baselines, pretty=True))
+            Log.note("Saved baseline {{name}} to {{file}}", name=name, file=baseline_file.abspath)
+        elif baseline:
+            regressions = problems + compare(results, baseline, settings.tolerance)
+            if regressions:
+                Log.warning("Regressions compared to {{file}}:\n{{regressions|indent}}", file=baseline_file.abspath, regressions="\n".join(regressions))
+                return 1
+            Log.note("No regressions compared to {{file}}", file=baseline_file.abspath)
+        else:
+            Log.note("No baseline for {{name}}; use --save to make one", name=name)
+            if problems:
+                Log.warning("Problems:\n{{problems|indent}}", problems="\n".join(problems))
+                return 1
+        return 0
+    finally:
+        Log.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
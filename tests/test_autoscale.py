@@ -0,0 +1,65 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap, Data
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from mysql_to_s3.autoscale import Autoscaler, rss
+
+EXTRACTOR = wrap({"settings": {"extract": {"threads": 2}}})
+
+
+def stats(**kwargs):
+    output = Data(workers=2, depth=0, room=16, lead=0, utilization=0.6, latency=10, rss=1000)
+    output.update(kwargs)
+    return output
+
+
+class TestAutoscale(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_backlog(self):
+        scaler = Autoscaler(EXTRACTOR, min=1, max=4)
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9)), (1, "backlog"))
+        self.assertEqual(scaler.decide(stats(lead=0.9, utilization=0.9)), (1, "backlog"))
+        # WORKERS ARE NOT THE BOTTLENECK
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.6)), (0, None))
+        self.assertEqual(scaler.decide(stats(workers=4, depth=8, utilization=0.9)), (0, None))
+
+    def test_idle(self):
+        scaler = Autoscaler(EXTRACTOR, min=1, max=4)
+        self.assertEqual(scaler.decide(stats(utilization=0.1)), (-1, "idle"))
+        self.assertEqual(scaler.decide(stats(workers=1, utilization=0.1)), (0, None))
+
+    def test_memory(self):
+        scaler = Autoscaler(EXTRACTOR, min=1, max=4, memory=1000)
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, rss=950)), (-1, "memory"))
+        # NO ROOM FOR ANOTHER WORKER
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, rss=700)), (0, None))
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, rss=500)), (1, "backlog"))
+
+    def test_latency(self):
+        scaler = Autoscaler(EXTRACTOR, min=1, max=4, hold=2)
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, latency=10)), (1, "backlog"))
+        self.assertEqual(scaler.decide(stats(workers=3, depth=8, utilization=0.9, latency=20)), (-1, "latency"))
+        # DO NOT TRY AGAIN RIGHT AWAY
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, latency=10)), (0, None))
+        self.assertEqual(scaler.decide(stats(depth=8, utilization=0.9, latency=10)), (1, "backlog"))
+
+    def test_rss(self):
+        self.assertGreater(rss(), 0)
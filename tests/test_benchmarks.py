@@ -0,0 +1,87 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Null, wrap
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from mysql_to_s3.extract import Extract
+from tests.benchmarks import snowflake, streams, suite, json_encoders, compressors, assembly
+
+OUTPUT = "tests/output/benchmarks/"
+
+
+class TestBenchmarks(FuzzyTestCase):
+    """
+    THE BENCHMARK TOOLS MUST MAKE THE SHAPES THEY ARE ASKED FOR
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_snowflake(self):
+        config = snowflake.make_snowflake(OUTPUT + "test.sqlite", facts=3, width=3, depth=2, fanout=2)
+        shape = {"facts": 3}
+        count = streams.record(config, OUTPUT + "test.rows.json", about=shape)
+        self.assertEqual(streams.about(OUTPUT + "test.rows.json"), shape)
+        rows = streams.replay(OUTPUT + "test.rows.json")
+        self.assertEqual(len(rows), count)
+
+        docs = []
+        Extract(kwargs=config).construct_docs(iter(rows), lambda v, i: docs.append(v), Null)
+        self.assertEqual(len(docs), 3)
+        for d in docs:
+            self.assertEqual(len(d["child1"]), 2)
+            for c in d["child1"]:
+                self.assertEqual(len(c["child2"]), 2)
+                self.assertEqual(set(c["child2"][0].keys()), {"v0", "v1", "v2"})
+            self.assertTrue(d["lookup"]["next"]["v1"])
+
+    def test_compare(self):
+        baseline = wrap({
+            "encode": {"items_per_second": 1000, "mb_per_second": 10, "peak_rss_mb": 100},
+            "compress": {"items_per_second": 1000, "mb_per_second": 10, "peak_rss_mb": 100}
+        })
+        results = wrap({
+            "encode": {"items_per_second": 950, "mb_per_second": 9.5, "peak_rss_mb": 105},
+            "compress": {"items_per_second": 800, "mb_per_second": 8, "peak_rss_mb": 150}
+        })
+        self.assertEqual(
+            set(suite.compare(results, baseline, tolerance=0.1)),
+            {
+                "compress items_per_second is 800.0, was 1000.0",
+                "compress mb_per_second is 8.0, was 10.0",
+                "compress peak_rss_mb is 150.0, was 100.0"
+            }
+        )
+
+    def test_value2json(self):
+        results = {}
+        json_encoders.run(results, num_docs=10, repeat=1)
+        self.assertEqual(set(results.keys()), {"value2json", "value2json_old"})
+        self.assertEqual(results["value2json"]["items"], 10)
+        self.assertGreater(results["value2json"]["mb_per_second"], 0)
+
+    def test_compression(self):
+        results = {}
+        compressors.run(results, num_docs=10, repeat=1, codecs=[("none", None, 1), ("gzip", 6, 2)])
+        self.assertEqual(set(results.keys()), {"compress_none", "compress_gzip_6_x2"})
+        self.assertGreater(results["compress_gzip_6_x2"]["mb_per_second"], 0)
+
+    def test_assembly(self):
+        results = {}
+        assembly.run(results, num_docs=8, repeat=1)
+        self.assertEqual(set(results.keys()), {"assembly_data", "assembly_record"})
+        self.assertEqual(results["assembly_record"]["items"], results["assembly_data"]["items"])
@@ -0,0 +1,91 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from io import BytesIO
+
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from pyLibrary.env import big_data
+from pyLibrary.env.big_data import ilines2file, GzipLines, scompressed2ibytes, ibytes2ilines, szstd2ibytes
+
+
+class TestCompression(FuzzyTestCase):
+    """
+    EVERY CODEC MUST GIVE BACK THE SAME LINES
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_gzip(self):
+        for level in [1, 6, 9]:
+            compressed = _write(lines, codec="gzip", level=level)
+            self.assertEqual(_gzip_lines(compressed), lines)
+            self.assertEqual(_read_gzip(compressed), lines)
+
+    def test_parallel_gzip(self):
+        chunk_size = big_data.PARALLEL_CHUNK_SIZE
+        block_size = big_data.WRITE_BLOCK_SIZE
+        try:
+            # SMALL CHUNKS, SO THE FILE HAS MANY MEMBERS
+            big_data.PARALLEL_CHUNK_SIZE = 1000
+            big_data.WRITE_BLOCK_SIZE = 100
+            compressed = _write(lines, codec="gzip", level=6, threads=3)
+        finally:
+            big_data.PARALLEL_CHUNK_SIZE = chunk_size
+            big_data.WRITE_BLOCK_SIZE = block_size
+
+        self.assertGreater(compressed.count(b"\037\213\010"), 10, "expecting many gzip members")
+        self.assertEqual(_gzip_lines(compressed), lines)
+        self.assertEqual(_read_gzip(compressed), lines)
+
+    def test_none(self):
+        compressed = _write(lines, codec="none")
+        self.assertEqual(compressed.decode("utf8").split("\n")[:-1], lines)
+
+    def test_zstd(self):
+        try:
+            import zstandard
+        except Exception:
+            self.skipTest("zstandard is not installed")
+        compressed = _write(lines, codec="zstd", threads=2)
+        self.assertEqual(list(ibytes2ilines(szstd2ibytes(BytesIO(compressed)))), lines)
+
+    def test_unknown_codec(self):
+        self.assertRaises(Exception, _write, lines, codec="lzma")
+
+
+def _write(lines, **kwargs):
+    buff = BytesIO()
+    count = ilines2file(lines, buff, **kwargs)
+    if count != len(lines):
+        Log.error("Expecting {{num}} lines written", num=len(lines))
+    return buff.getvalue()
+
+
+def _gzip_lines(compressed):
+    return [l.decode("utf8").rstrip("\n") for l in GzipLines(compressed)]
+
+
+def _read_gzip(compressed):
+    # READ IN SMALL PIECES, SO MEMBERS ARE SPLIT ACROSS READS
+    stream = BytesIO(compressed)
+    read = stream.read
+    stream.read = lambda size: read(7)
+    return list(ibytes2ilines(scompressed2ibytes(stream)))
+
+
+lines = ['{"id":' + str(i) + ',"name":"test-linux64/opt-mochitest-é' + str(i % 12) + '"}' for i in range(500)]
@@ -0,0 +1,159 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from copy import deepcopy
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from mo_dots import set_default, Null
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_times import Date
+from pyLibrary import convert
+
+from mysql_to_s3.elasticsearch_sink import ElasticsearchSink
+from mysql_to_s3.extract import Extract
+from mysql_to_s3.sqlite_db import SqliteDB
+from tests import test_sqlite
+from tests.test_sqlite import config_template
+
+
+class TestElasticsearch(FuzzyTestCase):
+    """
+    SEND BULK REQUESTS TO A LOCAL STAND-IN THAT RECORDS THEM
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+        test_sqlite.TestSqlite.setUpClass()  # MAKE THE SNAPSHOT
+
+    def setUp(self):
+        self.server = StandIn()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_bulk(self):
+        sink = ElasticsearchSink(host="http://localhost", port=self.server.port, index="jobs", id_field="job.id", max_docs=2)
+        count = sink.write([convert.value2json({"job": {"id": i}}) for i in range(5)])
+
+        self.assertEqual(count, 5)
+        self.assertEqual([len(b) for b in self.server.bulks], [2, 2, 1])
+        actions = [a for b in self.server.bulks for a, _ in b]
+        self.assertEqual(
+            sorted(a["index"]["_id"] for a in actions),
+            [0, 1, 2, 3, 4]
+        )
+        self.assertEqual(actions[0], {"index": {"_index": "jobs", "_type": "doc"}})
+
+    def test_max_bytes(self):
+        sink = ElasticsearchSink(host="http://localhost", port=self.server.port, index="jobs", max_bytes=100)
+        sink.write([convert.value2json({"job": {"name": "a" * 40}}) for i in range(4)])
+        self.assertEqual([len(b) for b in self.server.bulks], [1, 1, 1, 1])
+
+    def test_rejected(self):
+        # FIRST REQUEST IS REJECTED, THEN ONE DOCUMENT IS REJECTED AND ONE IS BAD
+        self.server.plan = [429, [201, 429, 400]]
+        sink = ElasticsearchSink(host="http://localhost", port=self.server.port, index="jobs", retry={"times": 3, "sleep": 0.1})
+        # THE BAD DOCUMENT FAILS THE WRITE, AFTER THE REJECTED ONE IS SENT AGAIN
+        self.assertRaises(Exception, sink.write, [convert.value2json({"job": {"id": i}}) for i in range(3)])
+
+        self.assertEqual([len(b) for b in self.server.bulks], [3, 3, 1])
+        self.assertEqual(self.server.bulks[2][0][1], {"job": {"id": 1}})
+        self.assertEqual(sink.failures, 1)
+
+    def test_too_many_rejections(self):
+        self.server.plan = [429, 429]
+        sink = ElasticsearchSink(host="http://localhost", port=self.server.port, index="jobs", retry={"times": 2, "sleep": 0.1})
+        self.assertRaises(Exception, sink.write, [convert.value2json({"job": {"id": 1}})])
+
+    def test_rollover(self):
+        sink = ElasticsearchSink(host="http://localhost", port=self.server.port, index="jobs", rollover_interval="week")
+        sink.write([convert.value2json({"job": {"id": 1}})], Date("2017-06-08"))
+
+        self.assertEqual(self.server.created, {"jobs20170604_000000": {"aliases": {"jobs": {}}}})
+        self.assertEqual(self.server.bulks[0][0][0]["index"]["_index"], "jobs20170604_000000")
+
+    def test_extract(self):
+        config = set_default(
+            {"destination": {"type": "elasticsearch", "host": "http://localhost", "port": self.server.port, "index": "testing"}},
+            deepcopy(config_template)  # Extract CHANGES ITS SETTINGS
+        )
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            count = Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=[10, 11], please_stop=Null)
+
+        self.assertEqual(count, 2)
+        docs = [d for b in self.server.bulks for _, d in b]
+        self.assertEqual([d["fact_table"]["name"] for d in docs], ["A", "B"])
+
+
+class StandIn(object):
+    """
+    PRETEND TO BE ELASTICSEARCH; RECORD THE BULK REQUESTS
+
+    plan - THE RESPONSE FOR EACH BULK REQUEST, IN ORDER: A STATUS FOR THE
+    WHOLE REQUEST, OR A LIST OF STATUS, ONE PER DOCUMENT (DEFAULT ALL 201)
+    """
+
+    def __init__(self):
+        self.bulks = []
+        self.created = {}
+        self.plan = []
+        self.server = HTTPServer(("localhost", 0), _Handler)
+        self.server.stand_in = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        lines = self.rfile.read(int(self.headers["Content-Length"])).decode("utf8").split("\n")
+        pairs = [(convert.json2value(lines[i]), convert.json2value(lines[i + 1])) for i in range(0, len(lines) - 1, 2)]
+        stand_in.bulks.append(pairs)
+
+        plan = stand_in.plan.pop(0) if stand_in.plan else None
+        if isinstance(plan, int):
+            self._respond(plan, {"error": "rejected"})
+            return
+        statuses = plan or [201] * len(pairs)
+        self._respond(200, {
+            "errors": any(s != 201 for s in statuses),
+            "items": [{"index": {"status": s, "error": None if s == 201 else {"type": "bad"}}} for s in statuses]
+        })
+
+    def do_PUT(self):
+        stand_in = self.server.stand_in
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf8")
+        stand_in.created[self.path.lstrip("/")] = convert.json2value(body)
+        self._respond(200, {"acknowledged": True})
+
+    def _respond(self, status, content):
+        data = convert.value2json(content).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -147,6 +147,41 @@ class TestExtract(FuzzyTestCase):
         self.assertEqual(result, expected, "expecting identical")
         self.assertEqual(expected, result, "expecting identical")
 
+    def test_include(self):
+        config = set_default(
+            {
+                "snowflake": {"include": [
+                    "name",
+                    "nested1.description"
+                ]}
+            },
+            config_template
+        )
+        db = MySQL(**config.snowflake.database)
+        Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=[10], please_stop=Null)
+
+        result = File(filename).read_json()
+        result[0].etl = None
+        expected = expected_results["include"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_materialize(self):
+        config = set_default(
+            {
+                "extract": {"materialize": True}
+            },
+            config_template
+        )
+        db = MySQL(**config.snowflake.database)
+        Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=[10], please_stop=Null)
+
+        result = File(filename).read_json()
+        result[0].etl = None
+        expected = expected_results["complex"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
 
 filename = "tests/output/test_output.json"
 
@@ -185,6 +220,12 @@ expected_results = {
     "simple": [{
         "fact_table": {"id": 22, "name": "L"}
     }],
+    "include": [{
+        "fact_table": {
+            "name": "A",
+            "nested1": {"description": "aaa"}
+        }
+    }],
     "lean_inline": [{
         "fact_table": {
             "about": "a",
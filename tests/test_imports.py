@@ -0,0 +1,85 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import subprocess
+import sys
+
+from mo_dots import set_default
+from mo_json import value2json, json2value
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from tests import test_sqlite
+from tests.benchmarks.suite import import_stage
+
+# LOADED ONLY WHEN THE CONFIG ASKS FOR S3, SQS, ELASTICSEARCH, OR TYPED JSON
+HEAVY = ["boto", "requests", "pyLibrary.aws", "pyLibrary.env.elasticsearch", "jx_elasticsearch", "numpy"]
+
+# LOADED ONLY WHEN THE CONFIG ASKS FOR THE FEATURE, OR FOR A METRICS PORT
+OPTIONAL = [
+    "mysql_to_s3.autoscale",
+    "mysql_to_s3.backfill",
+    "mysql_to_s3.large_values",
+    "mysql_to_s3.leases",
+    "mysql_to_s3.manifest",
+    "mysql_to_s3.parquet",
+    "BaseHTTPServer",
+    "http.server"
+]
+
+# CONSTRUCT AN Extract IN A NEW PROCESS, AND SHOW WHICH OF THE GIVEN MODULES ARE LOADED
+CONSTRUCT = """
+import json, os, sys
+from mo_dots import wrap
+from mysql_to_s3.extract import Extract
+Extract(kwargs=wrap(json.loads(sys.argv[1])))
+sys.stdout.write(json.dumps([m for m in sys.argv[2].split(",") if m in sys.modules]) + "\\n")
+sys.stdout.flush()
+os._exit(0)  # DO NOT WAIT FOR THE LISTER
+"""
+
+
+class TestImports(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_extract_is_light(self):
+        stage, problems = import_stage("mysql_to_s3.extract", ",".join(HEAVY + OPTIONAL))
+        self.assertTrue(problems == [], "; ".join(problems))
+        self.assertGreater(stage.items_per_second, 0)
+
+    def test_forbidden(self):
+        stage, problems = import_stage("mysql_to_s3.extract", "mysql_to_s3.extract")
+        self.assertEqual(problems, ["mysql_to_s3.extract is loaded"])
+
+    def test_minimal_config(self):
+        test_sqlite.TestSqlite.setUpClass()
+        config = set_default({"extract": {"last": "tests/output/test_imports_run.json"}}, test_sqlite.config_template)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([".", "vendor"])
+        process = subprocess.Popen(
+            [sys.executable, "-W", "ignore", "-c", CONSTRUCT, value2json(config), ",".join(HEAVY + OPTIONAL)],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+        try:
+            loaded = json2value(stdout.decode("utf8").strip().split("\n")[-1])
+        except Exception as e:
+            Log.error("Can not construct the extract:\n{{error|indent}}", error=stderr.decode("utf8"), cause=e)
+        self.assertTrue(list(loaded) == [], "expecting no optional modules, not " + ", ".join(loaded))
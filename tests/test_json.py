@@ -0,0 +1,98 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+from mo_dots import Data, FlatList, Null, wrap, Record
+from mo_future import text_type, utf8_json_encoder
+from mo_json import scrub, value2json
+from mo_json.encoder import fast_scrub
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_times import Date, Duration
+
+
+class TestJson(FuzzyTestCase):
+    """
+    THE FAST ENCODER MUST GIVE THE SAME JSON AS scrub() + utf8_json_encoder
+    """
+
+    def test_parity(self):
+        for value in corpus:
+            expected = text_type(utf8_json_encoder(scrub(value)))
+            self.assertEqual(value2json(value), expected, "expecting same JSON for " + text_type(repr(value)))
+
+    def test_scrub_parity(self):
+        for value in corpus:
+            self.assertEqual(repr(fast_scrub(value)), repr(scrub(value)), "expecting same scrub for " + text_type(repr(value)))
+
+    def test_loop(self):
+        value = {"a": 1}
+        value["b"] = {"c": value}
+        self.assertEqual(repr(fast_scrub(value)), repr(scrub(value)))
+
+
+corpus = [
+    None,
+    Null,
+    True,
+    False,
+    0,
+    -1,
+    2 ** 70,
+    1.0,
+    -0.0,
+    0.1 + 0.2,
+    1e20,
+    1e-7,
+    3.1415926539,
+    float("nan"),
+    float("inf"),
+    Decimal("3.10"),
+    Decimal("2"),
+    "",
+    "   ",
+    " padded ",
+    "quote\" backslash\\ newline\n tab\t bell\x07",
+    "unicode é中\U0001f600",
+    b"utf8 bytes \xc3\xa9",
+    date(2017, 1, 2),
+    datetime(2017, 1, 2, 3, 4, 5),
+    datetime(2017, 1, 2, 3, 4, 5, 678000),
+    Date("2017-01-02 03:04:05"),
+    timedelta(seconds=90),
+    Duration("day"),
+    [],
+    {},
+    [None, 1, "", [], {}],
+    (1, 2, (3,)),
+    {1, 2},
+    {"a": None, "b": "", "c": {}, "d": [None], "e": Null},
+    {b"bytes key": 1, "text key": 2},
+    Data(a={"b": [1, 2.5, Date("2017-01-02")]}, c=None),
+    wrap({"a": {"b": FlatList([1, 2])}}),
+    FlatList([{"a": 1}, None]),
+    Record(id=Record(name="A", about=Record(id=1, value=""), nested1=[Record(id=100, description="aaa")])),
+    {"job": {
+        "id": 123456789,
+        "guid": "c6f2a6b1-7d29-4f5b-8d1c-0d8ce6aa0b3e/0",
+        "result": "success",
+        "start_time": datetime(2017, 6, 1, 12, 30),
+        "end_time": Date(1496321110.5),
+        "duration": 915.5,
+        "signature": {"name": "build-linux64/opt", "platform": "linux64", "options": ["opt", "pgo"]},
+        "failure_classification": None,
+        "notes": [{"text": "   ", "who": "nobody"}]
+    }}
+]
@@ -0,0 +1,101 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_files import File
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Till
+from mo_threads.threads import MAIN_THREAD
+
+from mysql_to_s3.leases import Leases
+
+DATABASE_FILE = "tests/output/leases.sqlite"
+
+
+class TestLeases(FuzzyTestCase):
+    """
+    TWO "MACHINES" SHARING ONE LEASE TABLE
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+        if not File(DATABASE_FILE).parent.exists:
+            File(DATABASE_FILE).parent.create()
+
+    def setUp(self):
+        File(DATABASE_FILE).delete()
+
+    def test_share_batches(self):
+        a = Leases(database=database)
+        b = Leases(database=database)
+        try:
+            self.assertTrue(a.claim_lister())
+            self.assertFalse(b.claim_lister())
+            self.assertTrue(b.is_listing())
+
+            a.add([
+                {"start_point": (0,), "first_value": [0], "data": [0, 1]},
+                {"start_point": (1,), "first_value": [2], "data": [2, 3]},
+                {"start_point": (2,), "first_value": [4], "data": [4]}
+            ])
+            a.lister_done()
+            self.assertFalse(b.is_listing())
+            self.assertEqual(b.last_listed(), ((2,), [4]))
+
+            self.assertEqual(b.claim(), {"start_point": (0,), "first_value": [0], "data": [0, 1]})
+            self.assertEqual(a.claim().start_point, (1,))
+            self.assertEqual(b.claim().start_point, (2,))
+            self.assertEqual(a.claim(), None)
+
+            # CHECKPOINT ONLY MOVES OVER CONTIGUOUS DONE BATCHES
+            self.assertEqual(a.done((1,)), None)
+            self.assertEqual(b.done((0,)), ((1,), [2]))
+            self.assertEqual(b.done((2,)), ((2,), [4]))
+        finally:
+            a.close()
+            b.close()
+
+    def test_heartbeat_is_not_work(self):
+        a = Leases(database=database)
+        try:
+            self.assertNotIn(a.heartbeat_thread, MAIN_THREAD.children)
+        finally:
+            a.close()
+        self.assertTrue(a.heartbeat_thread.stopped)
+
+    def test_reclaim_expired(self):
+        a = Leases(database=database)
+        dead = Leases(database=database, timeout="second", heartbeat="hour")
+        try:
+            a.add([{"start_point": (0,), "first_value": [0], "data": [0]}])
+            self.assertEqual(dead.claim().start_point, (0,))
+            self.assertEqual(a.claim(), None)
+
+            self.assertEqual(a.unfinished(), 1)
+
+            # NO HEARTBEAT, SO THE LEASE EXPIRES
+            Till(seconds=1.5).wait()
+            self.assertEqual(a.claim().start_point, (0,))
+            self.assertEqual(a.done((0,)), ((0,), [0]))
+            self.assertEqual(a.unfinished(), 0)
+        finally:
+            a.close()
+            dead.close()
+
+
+database = {
+    "filename": DATABASE_FILE,
+    "schema": "testing"
+}
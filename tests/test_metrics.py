@@ -0,0 +1,128 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from copy import deepcopy
+
+from mo_dots import Null
+from mo_files import File
+from mo_logs import Log
+from mo_logs.strings import utf82unicode
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Till
+from mo_threads.metrics import Registry, MetricsExporter
+from mo_threads.threads import MAIN_THREAD
+from mo_times.timer import Timer
+from pyLibrary.env import http
+
+from mysql_to_s3 import extract
+from mysql_to_s3.extract import Extract
+from mysql_to_s3.sqlite_db import SqliteDB
+from tests import test_sqlite
+from tests.test_sqlite import config_template
+
+
+class TestMetrics(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_prometheus(self):
+        registry = Registry()
+        rows = registry.counter("rows_total", "Rows read")
+        registry.counter("batches_total", destination="s3").inc(2)
+        registry.gauge("depth", function=lambda: 7)
+        latency = registry.histogram("latency_seconds", buckets=[0.1, 1])
+        registry.counter("batches_total", destination="es").inc()
+
+        rows.inc()
+        rows.inc(4)
+        self.assertIs(registry.counter("rows_total"), rows)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        self.assertEqual(
+            registry.prometheus(),
+            "# HELP rows_total Rows read\n"
+            "# TYPE rows_total counter\n"
+            "rows_total 5\n"
+            "# TYPE batches_total counter\n"
+            "batches_total{destination=\"s3\"} 2\n"
+            "batches_total{destination=\"es\"} 1\n"
+            "# TYPE depth gauge\n"
+            "depth 7\n"
+            "# TYPE latency_seconds histogram\n"
+            "latency_seconds_bucket{le=\"0.1\"} 1\n"
+            "latency_seconds_bucket{le=\"1\"} 2\n"
+            "latency_seconds_bucket{le=\"+Inf\"} 3\n"
+            "latency_seconds_sum 5.55\n"
+            "latency_seconds_count 3\n"
+        )
+        self.assertRaises(Exception, registry.gauge, "rows_total")
+
+    def test_timer(self):
+        registry = Registry()
+        latency = registry.histogram("latency_seconds")
+        with Timer("nothing", debug=False, metric=latency):
+            pass
+        with Timer("nothing", debug=False, metric=latency):
+            Till(seconds=0.1).wait()
+        self.assertEqual(latency.count, 2)
+        self.assertGreater(latency.sum, 0.09)
+
+    def test_exporter(self):
+        registry = Registry()
+        registry.counter("rows_total").inc(3)
+        snapshot = File("tests/output/metrics.json")
+        snapshot.delete()
+        exporter = MetricsExporter(port=0, file=snapshot.abspath, interval="second", registry=registry)
+        try:
+            response = http.get("http://localhost:" + str(exporter.port) + "/")
+            self.assertEqual(utf82unicode(response.all_content), "# TYPE rows_total counter\nrows_total 3\n")
+            response = http.get_json("http://localhost:" + str(exporter.port) + "/json")
+            self.assertEqual(response.rows_total, 3)
+
+            Till(seconds=1.5).wait()
+            self.assertEqual(snapshot.read_json().rows_total, 3)
+        finally:
+            exporter.stop()
+
+    def test_exporter_stop(self):
+        registry = Registry()
+        rows = registry.counter("rows_total")
+        snapshot = File("tests/output/metrics_stop.json")
+        snapshot.delete()
+        exporter = MetricsExporter(port=0, file=snapshot.abspath, interval="hour", registry=registry)
+
+        # NOT WORK THAT KEEPS main() WAITING
+        self.assertFalse(any(t in MAIN_THREAD.children for t in exporter.threads))
+        rows.inc(5)
+        exporter.stop()
+        self.assertTrue(all(t.stopped for t in exporter.threads))
+        self.assertEqual(snapshot.read_json().rows_total, 5, "expecting the last snapshot written on stop")
+
+    def test_extract(self):
+        test_sqlite.TestSqlite.setUpClass()
+        documents = extract.DOCUMENTS.value
+        batches = extract.BATCHES_DONE.value
+        seconds = extract.BATCH_SECONDS.count
+
+        config = deepcopy(config_template)
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=[10, 11], please_stop=Null)
+
+        self.assertEqual(extract.DOCUMENTS.value - documents, 2)
+        self.assertEqual(extract.BATCHES_DONE.value - batches, 1)
+        self.assertEqual(extract.BATCH_SECONDS.count - seconds, 1)
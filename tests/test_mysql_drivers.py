@@ -0,0 +1,115 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from unittest import skipIf
+
+from mo_future import text_type, binary_type
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from pyLibrary.sql.mysql import MySQL, _fetch_blocks, _unicode_literal, _connector_literal
+
+try:
+    import mysql.connector
+    HAS_CONNECTOR = True
+except ImportError:
+    HAS_CONNECTOR = False
+
+
+class TestMySQLDrivers(FuzzyTestCase):
+    """
+    THE PARTS OF THE DRIVER SUPPORT THAT NEED NO SERVER
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_fetch_blocks(self):
+        cursor = Cursor(list(range(7)))
+        self.assertEqual(list(_fetch_blocks(cursor, 3)), list(range(7)))
+        self.assertEqual(cursor.requests, [3, 3, 3, 3])
+
+    def test_fetch_blocks_empty(self):
+        cursor = Cursor([])
+        self.assertEqual(list(_fetch_blocks(cursor, 1000)), [])
+        self.assertEqual(cursor.requests, [1000])
+
+    def test_unknown_driver(self):
+        self.assertRaises(Exception, MySQL, host=None, username="u", password="p", driver="oracle")
+
+    def test_known_drivers(self):
+        for driver in ["pymysql", "mysqlclient", "MySQLdb", "mysql-connector"]:
+            # NO host, SO NO CONNECTION IS MADE, AND THE DRIVER NEED NOT BE INSTALLED
+            self.assertEqual(MySQL(host=None, username="u", password="p", driver=driver).driver, driver)
+
+    def test_unicode_literal(self):
+        # mysqlclient GIVES BYTES; pymysql GIVES TEXT
+        literal = _unicode_literal(lambda v: "'caf\xc3\xa9'".encode("latin1"))
+        self.assertEqual(literal("ignored"), "'caf\xe9'")
+        literal = _unicode_literal(lambda v: "'text'")
+        self.assertEqual(literal("ignored"), "'text'")
+
+    @skipIf(not HAS_CONNECTOR, "mysql-connector is not installed")
+    def test_connector_literal(self):
+        literal = _connector_literal()
+        self.assertEqual(literal(None), "NULL")
+        self.assertEqual(literal(42), "42")
+        self.assertEqual(literal("a'b"), "'a\\'b'")
+        self.assertEqual(literal("back\\slash"), "'back\\\\slash'")
+        self.assertEqual(literal("caf\xe9"), "'caf\xe9'")
+
+    def test_connector_literal_without_driver(self):
+        literal = _connector_literal(converter=Converter())
+        self.assertEqual(literal(None), "NULL")
+        self.assertEqual(literal(42), "42")
+        self.assertEqual(literal("a'b"), "'a\\'b'")
+        self.assertEqual(literal("caf\xe9"), "'caf\xe9'")
+        self.assertEqual(literal("\u2603"), "'\u2603'")
+        self.assertEqual(literal("caf\xe9".encode("utf8")), "'caf\xe9'")
+
+
+class Cursor(object):
+    """
+    UNBUFFERED CURSOR STAND-IN, RECORDING THE fetchmany() SIZES
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+
+    def fetchmany(self, size):
+        self.requests.append(size)
+        output, self.rows = self.rows[:size], self.rows[size:]
+        return output
+
+
+class Converter(object):
+    """
+    mysql-connector MySQLConverter STAND-IN: escape() KEEPS THE TYPE, quote() ONLY ACCEPTS BYTES
+    """
+
+    def escape(self, value):
+        if isinstance(value, text_type):
+            return value.replace("'", "\\'")
+        if isinstance(value, binary_type):
+            return value.replace(b"'", b"\\'")
+        return value
+
+    def quote(self, value):
+        if value is None:
+            return bytearray(b"NULL")
+        if isinstance(value, (int, float)):
+            return text_type(value).encode("ascii")
+        return bytearray(b"'" + value + b"'")
@@ -0,0 +1,95 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from time import time
+
+from mo_files import File
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Thread
+
+from mysql_to_s3.profiler import BatchProfiler
+
+DIRECTORY = "tests/output/profiles"
+
+
+class TestProfiler(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def setUp(self):
+        File(DIRECTORY).delete()
+
+    def test_every(self):
+        profiler = BatchProfiler(directory=DIRECTORY, every=2)
+        with profiler.batch((1, 0)):
+            busy_work(0.1)
+        with profiler.batch((1, 1)):
+            busy_work(0.3)
+
+        self.assertFalse(File(DIRECTORY + "/1.0.collapsed").exists)
+        lines = list(File(DIRECTORY + "/1.1.collapsed").read_lines())
+        total = 0
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            total += int(count)
+        self.assertGreater(total, 5)
+        self.assertTrue(any("busy_work (test_profiler.py:" in line for line in lines))
+
+    def test_slow(self):
+        profiler = BatchProfiler(directory=DIRECTORY, slow=0.2)
+        with profiler.batch((2, 0)) as fast:
+            busy_work(0.05)
+        self.assertIsNone(fast.sampler, "expecting no sampler for a fast batch")
+        with profiler.batch((2, 1)):
+            busy_work(0.5)
+
+        self.assertFalse(File(DIRECTORY + "/2.0.collapsed").exists)
+        self.assertTrue(File(DIRECTORY + "/2.1.collapsed").exists)
+
+    def test_slow_many_workers(self):
+        profiler = BatchProfiler(directory=DIRECTORY, slow=0.2)
+
+        def worker(start_point, please_stop):
+            with profiler.batch(start_point):
+                busy_work(0.5)
+
+        # THE FIRST WORKER STARTS THE WATCHER, AND IS GONE BEFORE THE SECOND STARTS
+        Thread.run("first worker", worker, (4, 0)).join()
+        Thread.run("second worker", worker, (4, 1)).join()
+
+        self.assertTrue(File(DIRECTORY + "/4.0.collapsed").exists)
+        self.assertTrue(File(DIRECTORY + "/4.1.collapsed").exists)
+
+    def test_request(self):
+        profiler = BatchProfiler(directory=DIRECTORY)
+        with profiler.batch((3, 0)):
+            busy_work(0.05)
+        profiler.request()
+        with profiler.batch((3, 1)):
+            busy_work(0.05)
+        with profiler.batch((3, 2)):
+            busy_work(0.05)
+
+        self.assertFalse(File(DIRECTORY + "/3.0.collapsed").exists)
+        self.assertTrue(File(DIRECTORY + "/3.1.collapsed").exists)
+        self.assertFalse(File(DIRECTORY + "/3.2.collapsed").exists)
+
+
+def busy_work(seconds):
+    end = time() + seconds
+    while time() < end:
+        pass
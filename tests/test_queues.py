@@ -0,0 +1,86 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from time import time
+
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import BatchQueue, THREAD_STOP, Thread, Till, Signal
+
+
+class TestQueues(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_batches(self):
+        queue = BatchQueue("test", silent=True)
+        queue.put_many([1, 2, 3])
+        queue.put_many([4, 5])
+        self.assertEqual(queue.get_many(max_items=2), [1, 2])
+        self.assertEqual(queue.get_many(), [3, 4, 5])
+        self.assertEqual(queue.get_many(timeout=0.1), [])
+
+        queue.put_many([6, THREAD_STOP])
+        self.assertEqual(queue.get_many(), [6])
+        self.assertIs(queue.get_many(), THREAD_STOP)
+        self.assertRaises(Exception, queue.put, 7)
+
+    def test_byte_limit(self):
+        queue = BatchQueue("test", max_bytes=10, silent=True)
+        queue.put_many(["aaaaa", "bbbbb"])
+        self.assertEqual(queue.stats.bytes, 10)
+
+        def consume(please_stop):
+            Till(seconds=0.5).wait()
+            return queue.get_many(max_items=1)
+
+        consumer = Thread.run("consumer", consume)
+        start = time()
+        queue.put("ccccc")  # WAITS FOR THE CONSUMER
+        self.assertGreater(time() - start, 0.3)
+        self.assertEqual(consumer.join(), ["aaaaa"])
+        self.assertEqual(queue.get_many(), ["bbbbb", "ccccc"])
+
+        stats = queue.stats
+        self.assertEqual(stats.depth, 0)
+        self.assertEqual(stats.bytes, 0)
+        self.assertEqual(stats.puts, 3)
+        self.assertEqual(stats.gets, 3)
+        self.assertGreater(stats.put_wait, 0.3)
+
+    def test_wake_on_put(self):
+        queue = BatchQueue("test", silent=True)
+
+        def produce(please_stop):
+            Till(seconds=0.2).wait()
+            queue.put_many(["a", "b"])
+
+        Thread.run("producer", produce)
+        self.assertEqual(queue.get_many(timeout=5), ["a", "b"])
+        self.assertGreater(queue.stats.get_wait, 0.1)
+
+    def test_till(self):
+        queue = BatchQueue("test", silent=True)
+        stop = Signal()
+        Thread.run("stopper", lambda please_stop: (Till(seconds=0.2).wait(), stop.go()))
+        start = time()
+        self.assertIs(queue.pop(till=stop), None)
+        self.assertLess(time() - start, 2)
+
+    def test_close_wakes_reader(self):
+        queue = BatchQueue("test", silent=True)
+        Thread.run("closer", lambda please_stop: (Till(seconds=0.2).wait(), queue.add(THREAD_STOP)))
+        self.assertIs(queue.pop(), THREAD_STOP)
@@ -0,0 +1,98 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_files import File
+from mo_logs import Log
+from mo_logs.exceptions import Except
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from mysql_to_s3.retries import Retries
+
+DIRECTORY = "tests/output/test_retries"
+
+
+def batch(data, part=None):
+    output = {"start_point": (4,), "first_value": 40, "data": data}
+    if part:
+        output["part"] = part
+    return output
+
+
+class TestRetries(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def setUp(self):
+        File(DIRECTORY).delete()
+
+    def test_backoff(self):
+        retries = Retries(attempts=4, backoff="10second", max_backoff="15second", directory=DIRECTORY)
+        waits = []
+        for _ in range(3):
+            self.assertFalse(retries.failed(batch([1, 2]), Exception("bad")))
+            waits.append(round(retries.wait()))
+            retries.waiting = []
+        self.assertEqual(waits, [10, 15, 15])
+        self.assertIsNone(retries.due())
+
+    def test_split(self):
+        retries = Retries(attempts=1, directory=DIRECTORY)
+        self.assertFalse(retries.failed(batch([1, 2, 3]), Exception("bad")))
+        first, second = retries.due(), retries.due()
+        self.assertEqual(first, batch([1], "0"))
+        self.assertEqual(second, batch([2, 3], "1"))
+
+        self.assertFalse(retries.succeeded(first))
+        self.assertFalse(retries.failed(second, Exception("bad")))
+        third, fourth = retries.due(), retries.due()
+        self.assertEqual(third, batch([2], "10"))
+        self.assertEqual(fourth, batch([3], "11"))
+
+        self.assertFalse(retries.succeeded(fourth))
+        self.assertTrue(retries.failed(third, Exception("bad")), "expecting the batch done after its last part")
+        self.assertEqual(File(DIRECTORY + "/4_10.json").read_json().data, [2])
+
+    def test_both_halves_fail(self):
+        retries = Retries(attempts=1, backoff="second", directory=DIRECTORY)
+        self.assertFalse(retries.failed(batch([1, 2, 3, 4]), Exception("bad")))
+        first, second = retries.due(), retries.due()
+
+        # NEITHER HALF WENT THROUGH, SO NEITHER IS SPLIT
+        self.assertFalse(retries.failed(first, Exception("bad")))
+        self.assertFalse(retries.failed(second, Exception("bad")))
+        self.assertIsNone(retries.due())
+        self.assertEqual([b for _, _, b in sorted(retries.waiting)], [first, second])
+        self.assertFalse(File(DIRECTORY).exists)
+
+        # ONCE ONE HALF IS WRITTEN, THE OTHER IS SPLIT
+        retries.waiting = []
+        self.assertFalse(retries.succeeded(second))
+        self.assertFalse(retries.failed(first, Exception("bad")))
+        self.assertEqual([retries.due(), retries.due()], [batch([1], "00"), batch([2], "01")])
+
+    def test_single_fact(self):
+        retries = Retries(attempts=2, directory=DIRECTORY)
+        self.assertFalse(retries.failed(batch([1]), Exception("bad")))
+        self.assertTrue(retries.failed(batch([1]), Exception("bad")), "expecting the fact quarantined after attempts")
+        self.assertEqual(File(DIRECTORY + "/4.json").read_json().data, [1])
+
+    def test_outage(self):
+        retries = Retries(attempts=1, directory=DIRECTORY)
+        lost = Except(template="Problem executing SQL", cause=Except(template="(2013, 'Lost connection to MySQL server during query')"))
+        self.assertFalse(retries.failed(batch([1, 2, 3]), lost))
+        self.assertEqual(len(retries), 1, "expecting no split")
+        self.assertFalse(retries.failed(batch([1, 2, 3]), IOError(32, "Broken pipe")))
+        self.assertEqual(len(retries), 2, "expecting no split")
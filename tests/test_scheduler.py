@@ -0,0 +1,98 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Thread, Till, Signal, THREAD_STOP
+
+from mysql_to_s3 import scheduler as scheduler_module
+from mysql_to_s3.scheduler import Scheduler
+
+
+class TestScheduler(FuzzyTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+
+    def test_weighted_share(self):
+        scheduler = Scheduler(threads=1)
+        scheduler.add("a", weight=4)
+        scheduler.add("b", weight=1)
+        never = Signal()
+        order = []
+
+        def worker(name, please_stop):
+            if scheduler.acquire(name, never):
+                order.append(name)
+                scheduler.release(name, 1)
+
+        # HOLD THE ONLY SLOT UNTIL ALL WORKERS ARE WAITING
+        self.assertTrue(scheduler.acquire("a", never))
+        workers = [Thread.run("worker " + n, worker, n) for n in ["a", "a", "b", "b"]]
+        timeout = Till(seconds=10)
+        while len(scheduler.waiting) < 4 and not timeout:
+            Till(seconds=0.01).wait()
+        scheduler.release("a", 1)
+        for w in workers:
+            w.join()
+
+        # a IS CHARGED 1/4 OF A SECOND FOR EACH BATCH, b IS CHARGED 1
+        self.assertEqual(order, ["b", "a", "a", "b"])
+
+    def test_stop_while_waiting(self):
+        scheduler = Scheduler(threads=1)
+        scheduler.add("a")
+        never = Signal()
+        self.assertTrue(scheduler.acquire("a", never))
+
+        stop = Signal()
+        stop.go()
+        self.assertFalse(scheduler.acquire("a", stop))
+        self.assertEqual(scheduler.waiting, [])
+
+    def test_no_connection(self):
+        extractor = Extractor({"filename": "/no/such/directory/snapshot.sqlite"})
+        scheduler_module.run([("a", extractor)], 1, Signal())
+
+        # THE BATCH IS HANDED TO THE RETRIES, NOT DROPPED
+        self.assertEqual([b["key"] for b, _ in extractor.failures], [1])
+        self.assertEqual(extractor.worked, [])
+
+
+class Extractor(object):
+    """
+    GIVES ONE BATCH, AND RECORDS WHAT HAPPENS TO IT
+    """
+
+    def __init__(self, database):
+        self.settings = wrap({"snowflake": {"database": database}, "extract": {"threads": 1}})
+        self.manifest = None
+        self.leases = None
+        self.batches = [{"key": 1}]
+        self.failures = []
+        self.worked = []
+
+    def next_batch(self, please_stop):
+        if self.batches:
+            return self.batches.pop()
+        return THREAD_STOP
+
+    def work(self, db, batch, please_stop):
+        self.worked.append(batch)
+        return True
+
+    def failed(self, batch, cause):
+        self.failures.append((batch, cause))
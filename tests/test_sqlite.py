@@ -0,0 +1,752 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import shutil
+import sqlite3
+from hashlib import sha256
+
+from mo_dots import set_default, wrap, Null, listwrap
+from mo_files import File
+from mo_future import text_type
+from mo_json.typed_encoder import untyped
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import THREAD_STOP, Signal, Till
+from pyLibrary.env.elasticsearch import scrub
+from pyLibrary.sql import SQL
+
+from mysql_to_s3.autoscale import Autoscaler
+from mysql_to_s3.backfill import submit
+from mysql_to_s3.extract import Extract, FRAGMENT_HITS, STREAMED_DOCUMENTS
+from mysql_to_s3.large_values import LargeValues
+from mysql_to_s3.leases import Leases
+from mysql_to_s3.manifest import pack_ids, unpack_ids, ids_contain
+from mysql_to_s3.snowflake_schema import Catalog, schema_tree
+from mysql_to_s3.sqlite_db import SqliteDB, unix_time, quote_value
+
+DATABASE_FILE = "tests/output/testing.sqlite"
+
+
+class TestSqlite(FuzzyTestCase):
+    """
+    THE SAME EXTRACTS AS test_extract, BUT FROM A LOCAL SQLITE SNAPSHOT
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        Log.start()
+        File(DATABASE_FILE).delete()
+        if not File(DATABASE_FILE).parent.exists:
+            File(DATABASE_FILE).parent.create()
+
+        # MAKE SNAPSHOT FROM THE MySQL TEST DATABASE
+        sql = "\n".join(
+            line
+            for line in File("tests/resources/database.sql").read_lines()
+            if not line.startswith(("CREATE DATABASE", "USE", "commit"))
+        )
+        db = sqlite3.connect(File(DATABASE_FILE).abspath)
+        db.executescript(sql)
+        db.commit()
+        db.close()
+
+    def _extract(self, config, data, keep_etl=False):
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=data, please_stop=Null)
+
+        result = File(filename).read_json()
+        if not keep_etl:
+            for r in result:
+                r.etl = None
+        return result
+
+    def test_complex(self):
+        result = self._extract(config_template, [10])
+        expected = expected_results["complex"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_lean_inline_all(self):
+        config = set_default(
+            {
+                "snowflake": {
+                    "show_foreign_keys": False,
+                    "reference_only": [
+                        "inner1.value",
+                        "inner2.value"
+                    ]
+                }
+            },
+            config_template
+        )
+        data = [10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21, 22]
+        result = self._extract(config, data)
+        expected = expected_results["lean_inline_all"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_include(self):
+        config = set_default(
+            {
+                "snowflake": {"include": [
+                    "name",
+                    "nested1.description"
+                ]}
+            },
+            config_template
+        )
+        result = self._extract(config, [10])
+        expected = expected_results["include"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_exclude_paths(self):
+        config = set_default({"snowflake": {"exclude_paths": ["nested1"]}}, config_template)
+        result = self._extract(config, [10])
+        self.assertEqual(result[0].fact_table.name, "A")
+        self.assertTrue(result[0].fact_table.nested1 == None, "expecting nested1 left out")
+        self.assertTrue(result[0].fact_table.about != None, "expecting the rest of the document")
+
+    def test_extract_returns_count(self):
+        with SqliteDB(kwargs=config_template.snowflake.database) as db:
+            count = Extract(kwargs=config_template).extract(db=db, start_point=Null, first_value=Null, data=[10, 11], please_stop=Null)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(File(filename).read_json()), 2)
+
+    def test_unix_time(self):
+        db = sqlite3.connect(":memory:")
+        for value, expected in [("2017-07-14 02:40:00.123456", 1500000000.123456), ("2017-07-14 02:40:00", 1500000000)]:
+            sql = SQL("SELECT ") + unix_time(quote_value(value))
+            self.assertEqual(db.execute(text_type(sql)).fetchone()[0], expected, delta=0.000001)
+        db.close()
+
+    def test_materialize(self):
+        config = set_default(
+            {
+                "extract": {"materialize": True}
+            },
+            config_template
+        )
+        result = self._extract(config, [10])
+        expected = expected_results["complex"]
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_typed(self):
+        config = set_default({"extract": {"typed": True}}, config_template)
+        result = self._extract(config, [10])
+        self.assertEqual(result[0].fact_table.name, {"~s~": "A"})
+        self.assertEqual(result[0].fact_table.nested1["~e~"], 1)
+
+        # A NESTED DOCUMENT IS ALWAYS A LIST, scrub() MAKES IT LIKE THE UNTYPED OUTPUT
+        untyped_result = wrap([scrub(untyped(r)) for r in result])
+        expected = expected_results["complex"]
+        self.assertEqual(untyped_result, expected, "expecting identical")
+        self.assertEqual(expected, untyped_result, "expecting identical")
+
+    def test_fragment_cache(self):
+        # FACTS 10, 15 AND 19 ALL POINT TO inner1 1
+        hits = FRAGMENT_HITS.value
+        cached = self._extract(config_template, [10, 11, 15, 19])
+        self.assertGreater(FRAGMENT_HITS.value, hits)
+
+        config = set_default({"extract": {"fragment_cache": 0}}, config_template)
+        hits = FRAGMENT_HITS.value
+        encoded = self._extract(config, [10, 11, 15, 19])
+        self.assertEqual(FRAGMENT_HITS.value, hits)
+        self.assertEqual(cached, encoded, "expecting identical")
+        self.assertEqual(encoded, cached, "expecting identical")
+
+    def test_stream_children(self):
+        # EVERY FACT WITH MORE THAN ONE CHILD ROW IS STREAMED
+        data = [10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21, 22]
+        config = set_default({"extract": {"stream_children": 1}}, config_template)
+        before = STREAMED_DOCUMENTS.value
+        streamed = self._extract(config, data)
+        self.assertGreater(STREAMED_DOCUMENTS.value, before)
+        expected = self._extract(config_template, data)
+        self.assertEqual(streamed, expected, "expecting identical")
+        self.assertEqual(expected, streamed, "expecting identical")
+
+        config = set_default({"extract": {"stream_children": 1, "typed": True}}, config_template)
+        typed = wrap([scrub(untyped(r)) for r in self._extract(config, data)])
+        self.assertEqual(typed, expected, "expecting identical")
+        self.assertEqual(expected, typed, "expecting identical")
+
+    def test_max_children(self):
+        # FACT 10 HAS ONE nested1, WITH THREE nested2
+        config = set_default({"extract": {"max_children": {"path": "nested1.nested2", "max": 1}}}, config_template)
+        result = self._extract(config, [10], keep_etl=True)
+        self.assertEqual(result[0].fact_table.nested1.nested2.id, 1000)
+        self.assertEqual(result[0].etl.truncated["nested1.nested2"], 2)
+
+        # FACT 15 HAS TWO nested1
+        config = set_default({"extract": {"max_children": 1, "stream_children": 1}}, config_template)
+        result = self._extract(config, [15], keep_etl=True)
+        self.assertEqual(result[0].fact_table.nested1.id, 104)
+        self.assertEqual(result[0].etl.truncated, {"nested1": 1})
+
+    def test_normalize(self):
+        # 'aaa' IS A nested1.description, -1 IS AN inner2.id
+        data = [10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21, 22]
+        config = set_default({"snowflake": {"null_values": ["aaa", -1, "c"]}}, config_template)
+        expected = self._extract(config, data)
+        self.assertNotIn("aaa", [n.description for r in expected for n in listwrap(r.fact_table.nested1)])
+
+        config = set_default({"snowflake": {"normalize": True}}, config)
+        extractor = Extract(kwargs=config)
+        self.assertIn("NULLIF(", extractor.schema.get_sql(SQL("SELECT 10")).sql)
+        result = self._extract(config, data)
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+        config = set_default({"extract": {"materialize": True}}, config)
+        result = self._extract(config, data)
+        self.assertEqual(result, expected, "expecting identical")
+
+        # null_values THAT ARE ALSO ids MUST NOT CHANGE THE ORDER, OR WHICH PARENT A CHILD IS UNDER
+        database = File("tests/output/test_sqlite_normalize.sqlite")
+        database.delete()
+        shutil.copyfile(File(DATABASE_FILE).abspath, database.abspath)
+        db = sqlite3.connect(database.abspath)
+        db.executescript(
+            "insert into nested2 VALUES (2000, 105, 1.0, 1);"
+            "insert into nested2 VALUES (2001, 104, 2.0, 1);"
+            "insert into nested2 VALUES (2002, 105, 3.0, 1);"
+        )
+        db.commit()
+        db.close()
+        config = set_default({"snowflake": {"null_values": [104, 105], "database": {"filename": database.abspath}}}, config_template)
+        expected = self._extract(config, [15])
+        nested2 = {n.description: sorted(c.id for c in listwrap(n.nested2)) for n in listwrap(expected[0].fact_table.nested1)}
+        self.assertEqual(nested2, {"eee": [2001], "fff": [2000, 2002]})
+
+        config = set_default({"snowflake": {"normalize": True}}, config)
+        result = self._extract(config, [15])
+        self.assertEqual(result, expected, "expecting identical")
+        self.assertEqual(expected, result, "expecting identical")
+
+    def test_large_values(self):
+        side = File("tests/output/test_sqlite_large")
+        side.delete()
+        config = set_default(
+            {"snowflake": {"large_values": {
+                "size": 2,
+                "types": ["varchar"],  # EVERY varchar OVER 2 BYTES IS TRUNCATED
+                "directory": side.abspath,
+                "columns": [{"name": "fact_table.name", "action": "offload", "size": 0}]
+            }}},
+            config_template
+        )
+        result = self._extract(config, [10])
+        doc = result[0].fact_table
+        self.assertEqual(doc.nested1.description, "aa")
+        self.assertEqual(doc.about.value, "a")
+
+        side_object = File.new_instance(side, sha256(b"A").hexdigest())
+        self.assertEqual(doc.name, "file://" + side_object.abspath)
+        self.assertEqual(side_object.read(), "A")
+
+    def test_large_values_length(self):
+        columns = Extract(kwargs=config_template).schema.columns
+
+        def checked(**kwargs):
+            rules = LargeValues(kwargs=kwargs).rules(columns)
+            return sorted(columns[i].column.table.name + "." + columns[i].column.column.name for i, _ in rules)
+
+        # VARCHAR(20) IS AT MOST 80 BYTES
+        self.assertEqual(checked(size=100, types=["varchar"]), [])
+        self.assertEqual(
+            checked(size=50, types=[]),
+            ["fact_table.name", "inner1.value", "inner1.value", "nested1.description"]  # inner1 IS ON TWO PATHS
+        )
+
+    def test_manifest(self):
+        directory = File("tests/output/test_sqlite_manifest")
+        directory.delete()
+        config = set_default({"extract": {"manifest": {"directory": directory.abspath}}}, config_template)
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            extractor = Extract(kwargs=config)
+            extractor.extract(db=db, start_point=(1,), first_value=[10], data=[10, 11, 15], please_stop=Null)
+        extractor.manifest.close()
+
+        day = extractor.manifest.all_days()
+        self.assertEqual(len(day), 1)
+        entries = extractor.manifest.entries(day[0])
+        self.assertEqual(entries, [{
+            "key": "1",
+            "start_point": [1],
+            "first_value": [10],
+            "ranges": [{"field": "id", "min": 10, "max": 15}],
+            "count": 3
+        }])
+        self.assertGreater(entries[0].bytes, 0)
+        self.assertEqual(unpack_ids(entries[0].ids.packed), [10, 11, 15])
+        self.assertEqual(extractor.manifest.find(11).key, ["1"])
+        self.assertEqual(len(extractor.manifest.find(12)), 0)
+        self.assertEqual(extractor.manifest.last().start_point, [1])
+
+    def test_pack_ids(self):
+        ids = [-3, 0, 7, 200, 100000]
+        packed = wrap(pack_ids(ids))
+        self.assertEqual(unpack_ids(packed.packed), ids)
+        self.assertFalse(ids_contain(packed, 8))
+
+        names = ["a", "b", "c"]
+        bloom = wrap(pack_ids(names))
+        self.assertTrue(all(ids_contain(bloom, n) for n in names))
+
+    def test_shared_catalog(self):
+        catalog = Catalog()
+        first = Extract(catalog=catalog, kwargs=set_default({}, config_template))
+        second = Extract(catalog=catalog, kwargs=set_default({"snowflake": {"include": ["name"]}}, config_template))
+        self.assertEqual(catalog.scans, 1)
+        self.assertGreater(len(first.schema.columns), len(second.schema.columns))
+
+    def test_parquet_schema(self):
+        columns = Extract(kwargs=config_template).schema.columns
+        tree = schema_tree(columns)
+        self.assertEqual(tree["repeated"], False)
+        self.assertEqual(tree["fields"]["name"], "varchar")
+        self.assertEqual(tree["fields"]["about"]["repeated"], False)
+        self.assertEqual(tree["fields"]["nested1"]["repeated"], True)
+        self.assertEqual(tree["fields"]["nested1"]["fields"]["nested2"]["repeated"], True)
+
+    def test_parquet(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except Exception:
+            self.skipTest("pyarrow is not installed")
+
+        parquet_file = "tests/output/test_sqlite_output.parquet"
+        if not _can_write_nested(pyarrow, parquet_file):
+            # pyarrow BEFORE 0.17 CAN NOT WRITE NESTED COLUMNS
+            self.skipTest("this pyarrow can not write nested parquet")
+
+        config = set_default({"destination": parquet_file}, config_template)
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            count = Extract(kwargs=config).extract(db=db, start_point=Null, first_value=Null, data=[10, 11], please_stop=Null)
+
+        self.assertEqual(count, 2)
+        result = pyarrow.parquet.read_table(File(parquet_file).abspath).to_pydict()
+        self.assertEqual([d["name"] for d in result["fact_table"]], ["A", "B"])
+        self.assertEqual(
+            [n["description"] for n in result["fact_table"][0]["nested1"]],
+            ["aaa"]
+        )
+
+    def test_lease_reclaim(self):
+        last = File("tests/output/test_lease_reclaim_run.json")
+        last.write("[[0], [0]]")
+        lease_database = {"filename": File("tests/output/test_lease_reclaim.sqlite").abspath, "schema": "testing"}
+        File(lease_database["filename"]).delete()
+
+        # A PROCESS LISTED EVERYTHING, LEASED A BATCH, AND DIED
+        dead = Leases(database=lease_database, timeout="3second", heartbeat="hour")
+        self.assertTrue(dead.claim_lister())
+        dead.add([{"start_point": (2,), "first_value": [10], "data": [10, 11, 12, 13, 15]}])
+        dead.lister_done()
+        self.assertEqual(dead.claim().start_point, (2,))
+        dead.close()
+
+        config = set_default(
+            {"extract": {"last": last.abspath, "lease": {"database": lease_database}}},
+            config_template
+        )
+        config.extract.batch = 5  # NOT MERGED WITH THE batch LIST OF THE TEMPLATE
+        extractor = Extract(kwargs=config)
+        extract = extractor.extract
+
+        def done(**batch):
+            # A FILE destination IS ONLY FOR TESTING, SO DOES NOT MARK THE LEASE DONE
+            extract(**batch)
+            extractor.leases.done(batch["start_point"])
+        extractor.extract = done
+
+        extracted = []
+        timeout = Till(seconds=30)
+        with SqliteDB(kwargs=config.snowflake.database) as db:
+            with db.transaction():
+                while not timeout:
+                    batch = extractor.next_batch(timeout)
+                    if batch is THREAD_STOP:
+                        break
+                    extractor.work(db, batch, timeout)
+                    extracted.append(batch["start_point"])
+        extractor.leases.close()
+
+        # NOT THE LISTER, AND NOTHING TO CLAIM AT FIRST, BUT IT WAITS FOR THE LEASE TO EXPIRE
+        self.assertFalse(timeout, "expecting the extract to finish")
+        self.assertTrue(extracted == [(3,), (2,)], "expecting the batch of the dead process extracted last")
+
+    def test_backfill(self):
+        last = File("tests/output/test_backfill_run.json")
+        last.write("[[3], [20]]")  # THE LIVE TAIL HAS NOTHING TO DO
+        requests = File("tests/output/test_backfill.json")
+        requests.delete()
+        File("tests/output/test_backfill.json.progress").delete()
+        submit(requests.abspath, 13, 18)  # IDS 13 THROUGH 19 ARE IN BATCHES 1 AND 2
+
+        config = set_default(
+            {
+                "extract": {
+                    "batch": 3,
+                    "last": last.abspath,
+                    "backfill": {"file": requests.abspath}
+                }
+            },
+            config_template
+        )
+        extractor = Extract(kwargs=config)
+        batches = []
+        while True:
+            batch = extractor.next_batch(Signal())
+            if batch is THREAD_STOP:
+                break
+            batches.append(batch)
+            extractor.backfill.done(batch["backfill"], batch["start_point"])
+
+        self.assertEqual(
+            batches,
+            [
+                {"start_point": (1,), "data": [13, 15, 16], "backfill": 1},
+                {"start_point": (2,), "data": [17, 18, 19], "backfill": 1}
+            ]
+        )
+        self.assertEqual(last.read_json(), [[3], [20]], "expecting live tail checkpoint untouched")
+        self.assertEqual(File("tests/output/test_backfill.json.progress").read_json(), {"1": {"complete": True}})
+
+    def test_autoscale_finishes(self):
+        last = File("tests/output/test_autoscale_run.json")
+        last.write("[[0], [0]]")
+        output = File("tests/output/test_autoscale.json")
+        output.delete()
+        config = set_default(
+            {
+                "extract": {"last": last.abspath, "threads": 2, "autoscale": {"min": 1, "max": 3, "interval": 0.05}},
+                "destination": output.abspath
+            },
+            config_template
+        )
+        config.extract.batch = 5  # NOT MERGED WITH THE batch LIST OF THE TEMPLATE
+        extractor = Extract(kwargs=config)
+        extracted = []
+        extract = extractor.extract
+
+        def record(**batch):
+            extract(**batch)
+            extracted.extend(batch["data"])
+        extractor.extract = record
+
+        scaler = Autoscaler(extractor, kwargs=config.extract.autoscale)
+        scaler.start(Signal())
+
+        # THE CONTROLLER STOPS WHEN THE WORKERS RUN OUT OF BATCHES
+        scaler.controller.join(till=Till(seconds=30))
+        self.assertTrue(scaler.done)
+        self.assertEqual(scaler.workers, [])
+        db = sqlite3.connect(File(DATABASE_FILE).abspath)
+        expected = [row[0] for row in db.execute("SELECT id FROM fact_table ORDER BY id")]
+        db.close()
+        # THE LAST BATCH IS NOT COMPLETE, SO IT IS NOT LISTED
+        self.assertEqual(sorted(extracted), expected[:-(len(expected) % 5)], "expecting every complete batch extracted")
+
+    def test_quarantine(self):
+        last = File("tests/output/test_quarantine_run.json")
+        last.write("[[3], [22]]")  # THE LIVE TAIL HAS NOTHING TO DO
+        quarantine = File("tests/output/quarantine")
+        quarantine.delete()
+        config = set_default(
+            {"extract": {"last": last.abspath, "retry": {"attempts": 1, "backoff": 0.01}}},
+            config_template
+        )
+        extractor = Extract(kwargs=config)
+
+        # FACT 11 CAN NOT BE ENCODED
+        encode = extractor.encoder.encode
+
+        def bad_encode(value, *args):
+            if value["id"] == 11:
+                Log.error("bad fact")
+            return encode(value, *args)
+        extractor.encoder.encode = bad_encode
+
+        extracted = []
+        extract = extractor.extract
+
+        def record(**batch):
+            extract(**batch)
+            extracted.append(batch["data"])
+        extractor.extract = record
+
+        _work_all(extractor, config, {"start_point": (1,), "first_value": [10], "data": [10, 11, 12, 13]})
+
+        self.assertEqual(sorted(d for data in extracted for d in data), [10, 12, 13], "expecting only the bad fact left out")
+        files = quarantine.children
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0].read_json().data, [11])
+
+    def test_outage(self):
+        last = File("tests/output/test_outage_run.json")
+        last.write("[[3], [22]]")  # THE LIVE TAIL HAS NOTHING TO DO
+        quarantine = File("tests/output/quarantine")
+        quarantine.delete()
+        config = set_default(
+            {"extract": {"last": last.abspath, "retry": {"attempts": 1, "backoff": 0.01, "max_backoff": 0.05}}},
+            config_template
+        )
+        extractor = Extract(kwargs=config)
+
+        # EVERY TRY FAILS FOR A WHILE, WITH AN ERROR THAT COULD BE THE FACTS
+        tries = []
+        extracted = []
+        extract = extractor.extract
+
+        def outage(**batch):
+            tries.append(batch["data"])
+            if len(tries) <= 10:
+                Log.error("bad batch")
+            extract(**batch)
+            extracted.append(batch["data"])
+        extractor.extract = outage
+
+        _work_all(extractor, config, {"start_point": (1,), "first_value": [10], "data": [10, 11, 12, 13]})
+
+        self.assertGreater(len(tries), 10)
+        self.assertEqual(sorted(d for data in extracted for d in data), [10, 11, 12, 13], "expecting every fact once the outage is over")
+        self.assertFalse(quarantine.exists and quarantine.children, "expecting nothing quarantined")
+
+    def test_quarantine_single_fact(self):
+        quarantine, extractor, config, extracted = self._bad_facts("test_quarantine_single_fact", [11])
+        _work_all(extractor, config, {"start_point": (1,), "first_value": [11], "data": [11]})
+
+        self.assertEqual(extracted, [])
+        self.assertEqual([f.read_json().data for f in quarantine.children], [[11]])
+
+    def test_quarantine_both_halves(self):
+        # 11 AND 13 ARE IN DIFFERENT HALVES, SO NEITHER HALF EVER GOES THROUGH
+        quarantine, extractor, config, extracted = self._bad_facts("test_quarantine_both_halves", [11, 13])
+        _work_all(extractor, config, {"start_point": (1,), "first_value": [10], "data": [10, 11, 12, 13]})
+
+        self.assertEqual(sorted(d for data in extracted for d in data), [10, 12])
+        self.assertEqual(sorted(d for f in quarantine.children for d in f.read_json().data), [11, 13])
+        self.assertIsNone(extractor.retries.wait(), "expecting nothing left to retry")
+
+    def _bad_facts(self, name, bad):
+        """
+        :return: (quarantine, extractor, config, extracted) FOR AN EXTRACT THAT CAN NOT ENCODE THE bad FACTS
+        """
+        last = File("tests/output/" + name + "_run.json")
+        last.write("[[3], [22]]")  # THE LIVE TAIL HAS NOTHING TO DO
+        quarantine = File("tests/output/" + name)
+        quarantine.delete()
+        config = set_default(
+            {"extract": {
+                "last": last.abspath,
+                "retry": {"attempts": 1, "backoff": 0.01, "max_backoff": 0.02, "rounds": 2, "directory": quarantine.abspath}
+            }},
+            config_template
+        )
+        extractor = Extract(kwargs=config)
+
+        encode = extractor.encoder.encode
+
+        def bad_encode(value, *args):
+            if value["id"] in bad:
+                Log.error("bad fact")
+            return encode(value, *args)
+        extractor.encoder.encode = bad_encode
+
+        extracted = []
+        extract = extractor.extract
+
+        def record(**batch):
+            extract(**batch)
+            extracted.append(batch["data"])
+        extractor.extract = record
+        return quarantine, extractor, config, extracted
+
+
+def _work_all(extractor, config, batch):
+    """
+    WORK THE batch, AND ITS RETRIES, UNTIL NONE ARE WAITING
+    """
+    with SqliteDB(kwargs=config.snowflake.database) as db:
+        with db.transaction():
+            while batch:
+                extractor.work(db, batch, Signal())
+                wait = extractor.retries.wait()
+                if wait is None:
+                    break
+                Till(seconds=wait).wait()
+                batch = extractor.retries.due()
+
+
+def _can_write_nested(pyarrow, filename):
+    type_ = pyarrow.struct([pyarrow.field("a", pyarrow.int64()), pyarrow.field("b", pyarrow.string())])
+    schema = pyarrow.schema([pyarrow.field("x", type_)])
+    try:
+        pyarrow.parquet.write_table(
+            pyarrow.Table.from_arrays([pyarrow.array([{"a": 1, "b": "c"}], type=type_)], schema=schema),
+            File(filename).abspath
+        )
+        return True
+    except Exception:
+        return False
+    finally:
+        File(filename).delete()
+
+
+filename = "tests/output/test_sqlite_output.json"
+
+config_template = wrap({
+    "extract": {
+        "last": "tests/output/test_sqlite_run.json",
+        "field": "id",
+        "type": "number",
+        "start": 0,
+        "batch": 100
+    },
+    "destination": filename,
+    "snowflake": {
+        "fact_table": "fact_table",
+        "show_foreign_keys": True,
+        "null_values": [
+            "-",
+            "unknown",
+            ""
+        ],
+        "add_relations": [],
+        "include": [],
+        "exclude": [],
+        "reference_only": [
+            "inner1",
+            "inner2"
+        ],
+        "database": {
+            "filename": DATABASE_FILE,
+            "schema": "testing"
+        }
+    }
+})
+
+expected_results = {
+    "include": [{
+        "fact_table": {
+            "name": "A",
+            "nested1": {"description": "aaa"}
+        }
+    }],
+    "complex": [{"fact_table": {
+        "about": {"id": 1, "time": {"id": -1, "value": 0}, "value": "a"},
+        "id": 10,
+        "name": "A",
+        "nested1": {
+            "about": {"id": -1, "value": 0},
+            "description": "aaa",
+            "id": 100,
+            "nested2": [
+                {
+                    "about": {"id": 1, "time": {"id": -1, "value": 0}, "value": "a"},
+                    "id": 1000,
+                    "minutia": 3.1415926539,
+                    "ref": 100
+                },
+                {
+                    "about": {"id": 2, "time": {"id": -2}, "value": "b"},
+                    "id": 1001,
+                    "minutia": 4,
+                    "ref": 100
+                },
+                {
+                    "about": {"id": 3, "value": "c"},
+                    "id": 1002,
+                    "minutia": 5.1,
+                    "ref": 100
+                }
+            ],
+            "ref": 10
+        }
+    }}],
+    "lean_inline_all": [
+        {"fact_table": {
+            "nested1": {
+                "about": 0,
+                "description": "aaa",
+                "nested2": [
+                    {"about": "a", "minutia": 3.1415926539},
+                    {"about": "b", "minutia": 4},
+                    {"about": "c", "minutia": 5.1}
+                ]
+            },
+            "about": "a",
+            "id": 10,
+            "name": "A"
+        }},
+        {"fact_table": {
+            "nested1": {
+                "description": "bbb",
+                "nested2": {"about": "a", "minutia": 6.2}
+            },
+            "about": "b",
+            "id": 11,
+            "name": "B"
+        }},
+        {"fact_table": {
+            "nested1": {
+                "description": "ccc",
+                "nested2": {"about": "c", "minutia": 7.3}
+            },
+            "about": "c",
+            "id": 12,
+            "name": "C"
+        }},
+        {"fact_table": {
+            "nested1": {"about": 0, "description": "ddd"},
+            "id": 13,
+            "name": "D"
+        }},
+        {"fact_table": {
+            "nested1": [
+                {"about": 0, "description": "eee"},
+                {"about": 0, "description": "fff"}
+            ],
+            "about": "a",
+            "id": 15,
+            "name": "E"
+        }},
+        {"fact_table": {
+            "nested1": [{"description": "ggg"}, {"description": "hhh"}],
+            "about": "b",
+            "id": 16,
+            "name": "F"
+        }},
+        {"fact_table": {
+            "nested1": [{"description": "iii"}, {"description": "jjj"}],
+            "about": "c",
+            "id": 17,
+            "name": "G"
+        }},
+        {"fact_table": {
+            "nested1": [{"description": "kkk"}, {"description": "lll"}],
+            "id": 18,
+            "name": "H"
+        }},
+        {"fact_table": {"about": "a", "id": 19, "name": "I"}},
+        {"fact_table": {"about": "b", "id": 20, "name": "J"}},
+        {"fact_table": {"about": "c", "id": 21, "name": "K"}},
+        {"fact_table": {"id": 22, "name": "L"}}
+    ]
+}